@@ -0,0 +1,110 @@
+import os
+import sys
+import threading
+import time
+import matplotlib
+matplotlib.use("Agg")
+import pytest
+import torch
+import torch.nn as nn
+
+# Benchmarks of the dissect hot paths, on CPU. Run with (needs pytest-benchmark):
+#   python -m pytest benchmarks --benchmark-sort=name
+# Save a baseline and compare against it:
+#   python -m pytest benchmarks --benchmark-autosave
+#   python -m pytest benchmarks --benchmark-compare
+# Besides time, every benchmark records the peak RSS growth while it ran (peak_rss_mb in extra_info).
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from examples.dlight.simple_convnet import SimpleConvnet
+
+
+class WideBlock(nn.Module):
+    """ Synthetic wide-ResNet-style block: conv3x3 - bn - relu - conv3x3 - bn + identity """
+
+    def __init__(self, channels):
+        super(WideBlock, self).__init__()
+        self.conv1 = nn.Conv2d(channels, channels, kernel_size=3, padding=1, bias=False)
+        self.bn1 = nn.BatchNorm2d(channels)
+        self.conv2 = nn.Conv2d(channels, channels, kernel_size=3, padding=1, bias=False)
+        self.bn2 = nn.BatchNorm2d(channels)
+        self.pool = nn.AdaptiveAvgPool2d(1)
+        self.fc = nn.Linear(channels, channels)
+
+    def forward(self, x):
+        out = torch.relu(self.bn1(self.conv1(x)))
+        out = torch.relu(self.bn2(self.conv2(out)) + x)
+        return self.fc(torch.flatten(self.pool(out), 1))
+
+
+class PeakRSS:
+    """ Samples the resident set size of the process in a background thread
+        and records the peak growth above the RSS at start, in bytes.
+    """
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.start = self.peak_rss = _rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
+        self.peak_rss = max(self.peak_rss, _rss())
+        self.peak = self.peak_rss - self.start
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, _rss())
+            time.sleep(self.interval)
+
+
+def _rss():
+    """ Current resident set size of the process in bytes """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        import resource
+        # peak (not current) RSS, in kilobytes on Linux and bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+@pytest.fixture(autouse=True)
+def seed():
+    torch.manual_seed(0)
+    yield
+
+
+@pytest.fixture
+def measure(benchmark):
+    """ benchmark(func, *args, **kwargs) that also records peak RSS growth in extra_info """
+    def run(func, *args, **kwargs):
+        with PeakRSS() as peak:
+            result = benchmark(func, *args, **kwargs)
+        benchmark.extra_info["peak_rss_mb"] = round(peak.peak / 1024 ** 2, 2)
+        return result
+    return run
+
+
+@pytest.fixture(scope="session")
+def simple_convnet():
+    return SimpleConvnet().eval()
+
+
+@pytest.fixture(scope="session")
+def wide_block():
+    """ WideBlock(channels) in eval mode """
+    return lambda channels: WideBlock(channels).eval()
@@ -0,0 +1,143 @@
+import pytest
+pytest.importorskip("pytest_benchmark")
+import matplotlib.pyplot as plt
+import torch
+import dlight.dissect.activations as dactivations
+import dlight.dissect.attribution as dattribution
+import dlight.dissect.capture as dcapture
+import dlight.dissect.conv as dconv
+import dlight.dissect.projections as dprojections
+
+batch_sizes = [8, 64]
+channel_counts = [64, 256]
+resolutions = [14, 28]
+
+wide_params = pytest.mark.parametrize("batch_size,channels,resolution", [
+    (batch_size, channels, resolution)
+    for batch_size in batch_sizes for channels in channel_counts for resolution in resolutions])
+
+
+def _wide_activations(wide_block, batch_size, channels, resolution):
+    block = wide_block(channels)
+    inputs = torch.rand(batch_size, channels, resolution, resolution)
+    activations = dcapture.capture_activations(block, inputs, ["conv2", "fc"])
+    return block, inputs, activations
+
+
+def _uncached_max_activations(inputs, activations, nlargest, params):
+    # get_maximimum_activations caches its tables per activations Tensor, measure the computation
+    dactivations._max_activations_tables.clear()
+    return dactivations.get_maximimum_activations(inputs, activations, nlargest, params)
+
+
+# ----------------------------- Conv dissection -----------------------------
+
+@pytest.mark.parametrize("batch_size", batch_sizes)
+def test_conv_dissection_simple_convnet(measure, simple_convnet, batch_size):
+    input_to_conv = torch.rand(batch_size, 8, 14, 14)
+    measure(dconv.get_conv_dissection, input_to_conv, simple_convnet.conv2, 3)
+
+
+@wide_params
+def test_conv_dissection_wide(measure, wide_block, batch_size, channels, resolution):
+    block = wide_block(channels)
+    input_to_conv = torch.rand(batch_size, channels, resolution, resolution)
+    measure(dconv.get_conv_dissection, input_to_conv, block.conv1, 3)
+
+
+# ----------------------------- Max activations -----------------------------
+
+@pytest.mark.parametrize("batch_size", [256, 4096])
+@pytest.mark.parametrize("node", ["conv2", "fc4"])
+def test_max_activations_simple_convnet(measure, simple_convnet, batch_size, node):
+    inputs = torch.rand(batch_size, 1, 28, 28)
+    activations = dcapture.capture_activations(simple_convnet, inputs, [node])[node]
+    measure(_uncached_max_activations, inputs, activations, 16, {"outer_idx": 3})
+
+
+@wide_params
+@pytest.mark.parametrize("node", ["conv2", "fc"])
+def test_max_activations_wide(measure, wide_block, batch_size, channels, resolution, node):
+    _, inputs, activations = _wide_activations(wide_block, batch_size, channels, resolution)
+    measure(_uncached_max_activations, inputs, activations[node], 8, {"outer_idx": 3})
+
+
+# ----------------------------- Superstimuli -----------------------------
+
+@pytest.mark.parametrize("num_channels", [1, 8])
+def test_image_superstimuli_simple_convnet(measure, simple_convnet, num_channels):
+    forward_funcs = [lambda x, c=c: torch.mean(simple_convnet.partial_forward(x, "conv2")[:, c])
+        for c in range(num_channels)]
+    initial_input = torch.rand(1, 1, 28, 28)
+    measure(dactivations.get_image_superstimuli, forward_funcs, initial_input, num_iterations=20)
+
+
+@pytest.mark.parametrize("num_channels", [8, 64])
+@pytest.mark.parametrize("resolution", resolutions)
+def test_image_superstimuli_batched_wide(measure, wide_block, num_channels, resolution):
+    block = wide_block(64)
+    forward_func = lambda x: block.conv2(torch.relu(block.bn1(block.conv1(x))))
+    initial_input = torch.rand(1, 64, resolution, resolution)
+    measure(dactivations.get_image_superstimuli_batched, forward_func, list(range(num_channels)),
+        initial_input, num_iterations=10)
+
+
+# ----------------------------- Activations grid -----------------------------
+
+def _show_activations(inputs, activations):
+    dactivations.show_activations(inputs, activations)
+    plt.close("all")
+
+
+@pytest.mark.parametrize("batch_size", [8, 64])
+@pytest.mark.parametrize("channels", channel_counts)
+@pytest.mark.parametrize("resolution", resolutions)
+def test_show_activations_grid(measure, batch_size, channels, resolution):
+    inputs = torch.rand(batch_size, 3, resolution, resolution)
+    activations = torch.rand(batch_size, channels, resolution, resolution)
+    measure(_show_activations, inputs, activations)
+
+
+@pytest.mark.parametrize("max_size", [None, 7])
+def test_get_activations_grid_page(measure, max_size):
+    inputs = torch.rand(512, 3, 28, 28)
+    activations = torch.rand(512, 256, 28, 28)
+    measure(dactivations.get_activations_grid, inputs, activations, rows=(64, 80), max_size=max_size)
+
+
+# ----------------------------- Attribution -----------------------------
+
+@pytest.mark.parametrize("method", ["gradient-x-input", "integrated-gradients"])
+def test_attributions_simple_convnet(measure, simple_convnet, method):
+    inputs = torch.rand(256, 1, 28, 28)
+    measure(dattribution.get_attributions, simple_convnet, inputs, 3, method, num_steps=16)
+
+
+# ----------------------------- Projections -----------------------------
+
+@pytest.mark.parametrize("num_images", [1024, 16384])
+@pytest.mark.parametrize("resolution", resolutions)
+def test_build_atlas_pages(measure, num_images, resolution):
+    inputs = torch.rand(num_images, 4, resolution, resolution)
+    measure(dprojections.build_atlas_pages, inputs, 4096)
+
+
+@pytest.mark.parametrize("num_points", [16384, 131072])
+def test_build_spatial_index(measure, num_points):
+    embedding = torch.randn(num_points, 3).numpy()
+    measure(dprojections.build_spatial_index, embedding, 1296)
+
+
+@pytest.mark.parametrize("num_samples", [2048, 16384])
+@pytest.mark.parametrize("channels", channel_counts)
+@pytest.mark.parametrize("projection", ["pca", "randomized-pca", "torch-pca"])
+def test_run_projections_pipe(measure, num_samples, channels, projection):
+    activations = torch.rand(num_samples, channels)
+    measure(dprojections.run_projections_pipe, activations,
+        [{"type": projection, "n_components": 3}], use_cache=False)
+
+
+def test_run_projections_pipe_tsne(measure, simple_convnet):
+    activations = dcapture.capture_activations(simple_convnet, torch.rand(1024, 1, 28, 28), ["fc4"])["fc4"]
+    measure(dprojections.run_projections_pipe, activations,
+        [{"type": "pca", "n_components": 8}, {"type": "t-sne", "n_components": 2}], use_cache=False)
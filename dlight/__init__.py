@@ -1,49 +1,30 @@
-import dlight.dissect
-import dlight.utils
+import importlib
+
+# Lazy package: subpackages and modules are imported on first access
+# (e.g. dlight.dissect.conv), and heavy dependencies (matplotlib, torchvision,
+# sklearn, imageio, IPython) are imported by the functions that use them.
+# So "import dlight" is fast and does not need a notebook.
+_submodules = ["dissect", "report", "utils"]
+
+
+def __getattr__(name):
+  if name in _submodules:
+    return importlib.import_module(__name__ + "." + name)
+  raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
+
+
+def __dir__():
+  return sorted(list(globals().keys()) + _submodules)
 
-import IPython.display as ipd
-import dlight.utils.css_style
-import os.path as osp
 
 # Add requirejs. See https://github.com/googlecolab/colabtools/issues/461#issuecomment-469854101
 def add_require_js():
-  ipd.display(ipd.HTML('<script src="/static/components/requirejs/require.js"></script>'))
-
-get_ipython().events.register('pre_run_cell', add_require_js)
+  import dlight.utils.assets as dassets
+  dassets.use(["require"])
 
 
 def load_js_libs():
-  # to inspect require config: require.s.contexts._.config
-
-  # ipd.display(ipd.Javascript("""
-  #   require.config({
-  #     baseUrl: "/nbextensions/dlight/lib", // see https://stackoverflow.com/a/49487396/13344574
-  #     paths: {
-  #       d3: 'd3.v5.7.min',
-  #       THREE: 'three.min',
-  #       }
-  #   });
-  #   """))
-
-  ipd.display(ipd.Javascript("""
-    require.config({
-      paths: {
-        d3: 'https://d3js.org/d3.v5.min',
-        THREE: 'https://cdnjs.cloudflare.com/ajax/libs/three.js/88/three.min',
-      }
-    });
-    """))
-
-  dlight_dir = osp.dirname(osp.realpath(__file__))
-  ipd.display(ipd.Javascript(filename=osp.join(dlight_dir, "lib", "three_trackball_controls.js")))
-
-  ipd.display(ipd.Javascript("""
-      require(['THREE', 'trackballLoader'], function(THREE, trackballLoader) {
-          if (!THREE.hasOwnProperty("TrackballControls")) {
-              console.log("Loading trackball controls for THREE");
-              trackballLoader(THREE);
-          }
-      });
-  """))
-
-  ipd.display(ipd.HTML(dlight.utils.css_style.global_style))
+  # d3, three.js (with trackball controls) and the global style, injected once
+  # per scope from the copies in dlight/lib. See dlight/utils/assets.py
+  import dlight.utils.assets as dassets
+  dassets.use(["style", "d3", "THREE", "trackball"])
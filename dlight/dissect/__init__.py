@@ -1,4 +1,27 @@
-import dlight.dissect.activations
-import dlight.dissect.conv
-import dlight.dissect.projections
-import dlight.dissect.weights
+import importlib
+
+# Submodules are imported on first access (e.g. dlight.dissect.conv), see dlight/__init__.py
+_submodules = [
+    "activations",
+    "attribution",
+    "capture",
+    "contributions",
+    "conv",
+    "live",
+    "parallel",
+    "parameterizations",
+    "projections",
+    "statistics",
+    "store",
+    "weights",
+]
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module(__name__ + "." + name)
+    raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + _submodules)
@@ -1,93 +1,135 @@
-import matplotlib.pyplot as plt
+from collections import OrderedDict
+import os.path as osp
+import time
+import weakref
 import torch
 import torch.nn as nn
-import torchvision
+import dlight.dissect.capture as dcapture
+import dlight.dissect.parameterizations as dparam
+import dlight.dissect.store as dstore
 import dlight.utils.image as dimage
+import dlight.utils.profiling as dprofiling
 
 
-def show_activations(inputs, activations, num_cols=16, figsize=(20, 20), clf=True):
+@dprofiling.profile
+def show_activations(inputs, activations, num_cols=16, figsize=(20, 20), clf=True, rows=None, max_size=None):
     """ Show activations along with inputs
 
     Args:
-        inputs ([Tensor]): expected shape [B, C, H, W]
-        activations ([Tensor]): expected shape [B, C, H, W]
+        inputs ([Tensor or StoredActivations]): expected shape [B, C, H, W]
+        activations ([Tensor or StoredActivations]): expected shape [B, C, H, W]
+        rows ([tuple of int]): (optional) (start, end) range of inputs to show. Every input
+            takes one row (or one group of rows) of the figure. Only these inputs and their
+            activations are read, so paging through a large batch (or an ActivationStore) is cheap.
+        max_size ([int]): (optional) downsample inputs and activations by area averaging,
+            so that their height and width are at most max_size
     """
-    assert inputs.shape[0] == activations.shape[0], "batch dimension should match"
-    if len(inputs.shape) != 4:
-        raise NotImplementedError("Only inputs of shape [B, C, H, W] (images) are supported for now")
-    if len(activations.shape) != 4:
-        raise NotImplementedError("Only activations of shape [B, C, H, W] are supported for now")
+    import matplotlib.pyplot as plt
 
-    inputs = inputs.detach().cpu()
-    activations = activations.detach().cpu()
-
-    num_cols = min(num_cols, activations.shape[1])
-    num_rows_per_input = -(-activations.shape[1] // num_cols) # ceiling-divide https://stackoverflow.com/a/17511341/13344574
-    
-    if num_rows_per_input > 1:
-        inputs_padded = []
-        padding = torch.zeros_like(inputs[0])
-        for i in range(inputs.shape[0]):
-            inputs_padded.append(inputs[i])
-            for j in range(num_rows_per_input - 1):
-                inputs_padded.append(padding)
-        inputs_padded = torch.stack(inputs_padded, dim=0)
-    else:
-        inputs_padded = inputs
-    inputs_grid = torchvision.utils.make_grid(inputs_padded, nrow=1)
-
-    if (num_rows_per_input * num_cols) > activations.shape[1]:
-        activations_padded = []
-        padding = torch.zeros_like(activations[0, 0])
-        for i in range(activations.shape[0]):
-            for j in range(num_rows_per_input * num_cols):
-                if j < activations.shape[1]:
-                    activations_padded.append(activations[i, j])
-                else:
-                    activations_padded.append(padding)
-        activations_padded = torch.stack(activations_padded, dim=0)
-        activations_padded = activations_padded[:, None, :, :]
-    else:
-        activations_padded = activations.view(-1, 1, activations.shape[-2], activations.shape[-1])
-    activations_grid = torchvision.utils.make_grid(activations_padded, nrow=num_cols)
+    inputs_grid, activations_grid = get_activations_grid(inputs, activations, num_cols, rows, max_size)
 
     # put channels dim in the back
     inputs_grid = inputs_grid.permute(1, 2, 0)
-    activations_grid = activations_grid.permute(1, 2, 0)
+    if inputs_grid.shape[2] == 1:
+        inputs_grid = inputs_grid[:, :, 0]
 
     if clf:
         plt.clf()
     # plt.figure(figsize=figsize, dpi=80) # https://stackoverflow.com/questions/36367986/how-to-make-inline-plots-in-jupyter-notebook-larger
 
-    f, (a0, a1) = plt.subplots(1, 2, figsize=figsize, dpi=80, gridspec_kw={'width_ratios': [1, 8]})
-    a0.imshow(dimage.normalize(inputs_grid), cmap="gray", interpolation="nearest")
-    a1.imshow(dimage.normalize(activations_grid), cmap="gray", interpolation="nearest")
-    f.tight_layout()
-    a0.axis('off')
-    a1.axis('off')
+    with dprofiling.span("plot"):
+        f, (a0, a1) = plt.subplots(1, 2, figsize=figsize, dpi=80, gridspec_kw={'width_ratios': [1, 8]})
+        a0.imshow(inputs_grid, cmap="gray", interpolation="nearest")
+        a1.imshow(activations_grid, cmap="gray", interpolation="nearest")
+        f.tight_layout()
+        a0.axis('off')
+        a1.axis('off')
 
 
+@dprofiling.profile
+def get_activations_grid(inputs, activations, num_cols=16, rows=None, max_size=None, padding=2):
+    """ Grids of inputs and activations, as shown by show_activations.
+        See docstring of show_activations.
+        Every grid is copied into a preallocated buffer in one go (see dlight.utils.image.grid_buffer).
+
+    Returns:
+        [tuple of Tensors]: (inputs_grid, activations_grid) of shapes [C, H', W'] and [H'', W''],
+            normalized to [0, 1]. Input i is in the same row (group of rows) of inputs_grid
+            as its activations in activations_grid.
+    """
+    assert inputs.shape[0] == activations.shape[0], "batch dimension should match"
+    if len(inputs.shape) != 4:
+        raise NotImplementedError("Only inputs of shape [B, C, H, W] (images) are supported for now")
+    if len(activations.shape) != 4:
+        raise NotImplementedError("Only activations of shape [B, C, H, W] are supported for now")
+
+    if rows is not None:
+        inputs = inputs[rows[0]:rows[1]]
+        activations = activations[rows[0]:rows[1]]
+    inputs = dstore.as_tensor(inputs).detach().cpu().float()
+    activations = dstore.as_tensor(activations).detach().cpu().float()
+    if max_size is not None:
+        inputs = dimage.downsample(inputs, max_size)
+        activations = dimage.downsample(activations, max_size)
+
+    num_inputs, num_channels, height, width = activations.shape
+    num_cols = min(num_cols, num_channels)
+    num_rows_per_input = -(-num_channels // num_cols) # ceiling-divide https://stackoverflow.com/a/17511341/13344574
+
+    # Input i goes to the first column of row i * num_rows_per_input, the other rows stay empty
+    inputs_grid, tiles = dimage.grid_buffer(inputs.shape[1], num_inputs * num_rows_per_input, 1,
+        inputs.shape[2], inputs.shape[3], padding)
+    tiles = tiles.unflatten(1, (num_inputs, num_rows_per_input)) # now shape is [C, B, ROWS_PER_INPUT, H, 1, W]
+    tiles[:, :, 0, :, 0, :] = inputs.permute(1, 0, 2, 3)
+
+    # Channel j of input i goes to row i * num_rows_per_input + j // num_cols, column j % num_cols
+    activations_grid, tiles = dimage.grid_buffer(1, num_inputs * num_rows_per_input, num_cols,
+        height, width, padding)
+    tiles = tiles[0].unflatten(0, (num_inputs, num_rows_per_input)) # now shape is [B, ROWS_PER_INPUT, H, COLS, W]
+    num_full_rows, remainder = divmod(num_channels, num_cols)
+    if num_full_rows > 0:
+        full_rows = activations[:, :num_full_rows * num_cols].unflatten(1, (num_full_rows, num_cols))
+        tiles[:, :num_full_rows] = full_rows.permute(0, 1, 3, 2, 4)
+    if remainder > 0:
+        tiles[:, num_full_rows, :, :remainder] = activations[:, num_full_rows * num_cols:].permute(0, 2, 1, 3)
+
+    return dimage.normalize(inputs_grid), dimage.normalize(activations_grid[0])
+
+
+@dprofiling.profile
 def show_inputs_with_max_activation(inputs, activations, nlargest, params,
         num_cols=16, figsize=(20, 20), clf=True):
     """ See docstring of get_maximimum_activations """
-    inputs = inputs.detach().cpu()
-    activations = activations.detach().cpu()
+    grid, max_activations = get_inputs_with_max_activation_grid(inputs, activations, nlargest, params, num_cols)
+    dimage.show_torch(grid, figsize, clf)
+    print("max activations:", max_activations)
+
+
+@dprofiling.profile
+def get_inputs_with_max_activation_grid(inputs, activations, nlargest, params, num_cols=16):
+    """ Grid of the inputs with max activation, as shown by show_inputs_with_max_activation.
+        See docstring of get_maximimum_activations.
 
+    Returns:
+        [tuple]: (grid, max_activations), where grid is a Tensor of shape [C, H, W]
+            with values in [0, 1] and max_activations is a tuple of floats
+    """
+    import torchvision
     max_inputs, max_activations = \
         zip(*get_maximimum_activations(inputs, activations, nlargest, params))
-    max_inputs = torch.stack(max_inputs, dim=0)
+    max_inputs = torch.stack(max_inputs, dim=0).detach().cpu()
 
     grid = torchvision.utils.make_grid(max_inputs, nrow=num_cols)
-    dimage.show_torch(dimage.normalize(grid), figsize, clf)
-    print("max activations:", max_activations)
+    return dimage.normalize(grid), max_activations
 
 
+@dprofiling.profile
 def get_maximimum_activations(inputs, activations, nlargest, params):
     """ Get nlargest max activations along with the corresponding inputs
 
     Args:
-        inputs ([Tensor]): expected shape [B, C, H, W]
-        activations ([Tensor]): expected shape [B, C, H, W] or [B, C]
+        inputs ([Tensor or StoredActivations]): expected shape [B, C, H, W]
+        activations ([Tensor or StoredActivations]): expected shape [B, C, H, W] or [B, C]
         nlargest ([int]): number of largest activations to show
         params ([dict]): depends on shape of activations.
             if [B, C, H, W]:
@@ -119,42 +161,166 @@ def _get_maximimum_activations_conv(inputs, activations, nlargest, params):
     if "outer_idx" not in params:
         raise ValueError("outer_idx expected for conv node")
     reduce_func = params.get("reduce_func", "mean")
-
-    activations = activations[:, params["outer_idx"]]
-    activations = activations.view(activations.shape[0], -1)
-    if reduce_func == "mean":
-        activations = torch.mean(activations, dim=1)
-    elif reduce_func == "max":
-        activations = torch.max(activations, dim=1)[0]
-    activations = activations.tolist()
-
-    inputs = list(inputs)
-    return sorted(zip(inputs, activations), key=lambda x: x[1], reverse=True)[:nlargest]
+    return _lookup_maximimum_activations(inputs, activations, nlargest, params["outer_idx"], reduce_func)
 
 def _get_maximimum_activations_fc(inputs, activations, nlargest, params):
     if "outer_idx" not in params:
         raise ValueError("outer_idx expected for fully connected node")
-    activations = activations[:, params["outer_idx"]].tolist()
-    inputs = list(inputs)
-    return sorted(zip(inputs, activations), key=lambda x: x[1], reverse=True)[:nlargest]
+    return _lookup_maximimum_activations(inputs, activations, nlargest, params["outer_idx"], "mean")
+
+def _lookup_maximimum_activations(inputs, activations, nlargest, outer_idx, reduce_func):
+    indices, values = get_maximimum_activations_table(activations, nlargest, reduce_func)
+    indices = indices[outer_idx, :nlargest].tolist()
+    values = values[outer_idx, :nlargest].tolist()
+    return [(inputs[i], v) for i, v in zip(indices, values)]
+
+
+# Tables computed by get_maximimum_activations_table, so that paging through
+# the channels of the same activations does not recompute them.
+# Maps (id(activations), reduce_func) to (weakref to activations, version, indices, values).
+# StoredActivations are keyed by their layer in the store instead, because store[layer_name]
+# returns a new object every time: (store directory, layer_name, reduce_func) maps to
+# (None, number of samples, indices, values).
+_max_activations_tables = OrderedDict()
+_max_activations_tables_size = 8
+
+@dprofiling.profile
+def get_maximimum_activations_table(activations, nlargest, reduce_func="mean"):
+    """ Get nlargest max activations of every channel in one vectorized pass.
+        The result is cached for the given activations Tensor (as long as it is alive
+        and not modified in-place), or for the layer of StoredActivations (as long as
+        no samples are appended), so subsequent calls for the same activations
+        and nlargest <= the cached one are free.
+        StoredActivations are reduced chunk by chunk, so they never have to fit in memory.
+
+    Args:
+        activations ([Tensor or StoredActivations]): expected shape [B, C, H, W] or [B, C]
+        nlargest ([int]): number of largest activations to keep per channel
+        reduce_func ([str]): how to reduce the grid [H, W] of conv activation,
+            one of ("mean", "max"). Ignored for activations of shape [B, C]
+
+    Returns:
+        [tuple of Tensors]: (indices, values), both of shape [C, nlargest].
+            Row c holds the (batch) indices and activations of channel c,
+            (reverse) sorted by activation.
+    """
+    is_stored = isinstance(activations, dstore.StoredActivations)
+    if is_stored:
+        key = (osp.abspath(activations.store.directory), activations.layer_name, reduce_func)
+        # StoredActivations are append-only, so their length is their version
+        version = activations.num_samples
+    else:
+        key = (id(activations), reduce_func)
+        version = activations._version
+    cached = _max_activations_tables.get(key)
+    if cached is not None:
+        activations_ref, cached_version, indices, values = cached
+        is_same = is_stored or activations_ref() is activations
+        if is_same and cached_version == version \
+                and indices.shape[1] >= min(nlargest, activations.shape[0]):
+            _max_activations_tables.move_to_end(key)
+            return indices[:, :nlargest], values[:, :nlargest]
+
+    if is_stored:
+        reduced = torch.cat([dcapture.reduce_activations(chunk.float(), reduce_func)
+            for _, chunk in activations.iter_chunks()], dim=0)
+    else:
+        reduced = dcapture.reduce_activations(activations.detach(), reduce_func) # now shape is [B, C]
+    k = min(nlargest, reduced.shape[0])
+    values, indices = torch.topk(reduced.t(), k, dim=1)
+    indices, values = indices.cpu(), values.cpu()
+
+    _max_activations_tables[key] = (None if is_stored else weakref.ref(activations), version, indices, values)
+    _max_activations_tables.move_to_end(key)
+    while len(_max_activations_tables) > _max_activations_tables_size:
+        _max_activations_tables.popitem(last=False)
+    return indices, values
 
 
+@dprofiling.profile
+def get_maximimum_activations_streaming(model, node, data_loader, nlargest, params=None):
+    """ Streaming version of get_maximimum_activations. Runs the model over data_loader
+        batch by batch and keeps a running top-nlargest for every channel of node's output.
+        Only one batch plus [C, nlargest] values are held in memory at a time.
+
+    Args:
+        model ([nn.Module]): model to run the inputs through
+        node ([str or nn.Module]): name or submodule of model whose output is dissected.
+            Its output should have shape [B, C, H, W] (conv) or [B, C] (fc)
+        data_loader ([DataLoader]): must not shuffle, so that the position of a sample
+            in the stream is its index in the dataset. Each batch is either a Tensor
+            or a tuple/list whose first item is the input Tensor
+        nlargest ([int]): number of largest activations to keep per channel
+        params ([dict]): (optional)
+            {
+                "reduce_func" (optional): how to reduce the grid [H, W] of conv
+                        activation, one of ("mean", "max"), default is "mean"
+            }
+
+    Returns:
+        [tuple of Tensors]: (indices, values), both of shape [C, nlargest].
+            Row c holds the dataset indices and activations of channel c,
+            (reverse) sorted by activation.
+    """
+    if params is None:
+        params = {}
+    reduce_func = params.get("reduce_func", "mean")
+    device = dcapture.get_device(model)
+
+    top_values = None
+    top_indices = None
+    offset = 0
+    with dcapture.ActivationCapture(model, [node], reductions=reduce_func) as capture:
+        node_name = capture.node_names[0]
+        with torch.no_grad():
+            for batch in data_loader:
+                if isinstance(batch, (tuple, list)):
+                    batch = batch[0]
+                with dprofiling.span("forward"):
+                    model(batch.to(device))
+
+                batch_activations = capture.activations[node_name].t() # now shape is [C, B]
+                batch_indices = torch.arange(offset, offset + batch_activations.shape[1],
+                    device=batch_activations.device).expand_as(batch_activations)
+                offset += batch_activations.shape[1]
+
+                if top_values is not None:
+                    batch_activations = torch.cat([top_values, batch_activations], dim=1)
+                    batch_indices = torch.cat([top_indices, batch_indices], dim=1)
+                k = min(nlargest, batch_activations.shape[1])
+                top_values, positions = torch.topk(batch_activations, k, dim=1)
+                top_indices = torch.gather(batch_indices, 1, positions)
+
+    if top_values is None:
+        raise ValueError("data_loader is empty")
+    return top_indices.cpu(), top_values.cpu()
+
+
+@dprofiling.profile
 def show_image_superstimuli(forward_funcs, initial_input,
         optimizer_provider=None, num_iterations=100, total_variation=True,
+        device=None, dtype=None, autocast=False, patience=None,
+        parameterization="pixel", transforms=None, resolution_schedule=None,
         num_cols=16, figsize=(20, 20), clf=True,):
     """ See docstring of get_image_superstimuli """
+    import torchvision
     superstimuli = get_image_superstimuli(forward_funcs, initial_input,
-        optimizer_provider, num_iterations, total_variation)
+        optimizer_provider, num_iterations, total_variation,
+        device, dtype, autocast, patience,
+        parameterization, transforms, resolution_schedule)
     superstimuli = torch.cat(superstimuli, dim=0)
     
-    superstimuli = superstimuli.detach().cpu()
+    superstimuli = superstimuli.detach().cpu().float()
 
     grid = torchvision.utils.make_grid(superstimuli, nrow=num_cols)
     dimage.show_torch(dimage.normalize(grid), figsize, clf)
 
 
+@dprofiling.profile
 def get_image_superstimuli(forward_funcs, initial_input,
-        optimizer_provider=None, num_iterations=100, total_variation=True):
+        optimizer_provider=None, num_iterations=100, total_variation=True,
+        device=None, dtype=None, autocast=False, patience=None,
+        parameterization="pixel", transforms=None, resolution_schedule=None):
     """ Get superstimulus for each forward_func.
         The term "superstimuli" was borrowed from
         https://distill.pub/2020/circuits/curve-detectors/#feature-visualization
@@ -169,6 +335,23 @@ def get_image_superstimuli(forward_funcs, initial_input,
             same distribution as the training input to the model.
             See Colab notebook (https://colab.research.google.com/drive/1GqynTl2NhVPMUk3LCOQ91yXGsLf1UmJj?usp=sharing)
             for example usage.
+        device ([torch.device or str]): (optional) device of the superstimuli, should be the device
+            of the model. The input is placed there once before optimization.
+            Default is the device of initial_input
+        dtype ([torch.dtype]): (optional) dtype of the superstimuli. Default is the dtype of initial_input
+        autocast ([bool]): run forward_funcs under torch.autocast
+            (bfloat16 on CPU, float16 on CUDA). The loss is still computed in float32.
+        patience ([int]): (optional) stop early when the loss has not improved
+            (by a relative 1e-4) for this many iterations. Checking the loss
+            synchronizes with the device every iteration, so it is off by default.
+        parameterization ([str or func]): how the image is parameterized for optimization.
+            One of ("pixel", "fourier", "fourier_decorrelated") or a custom one.
+            See dlight.dissect.parameterizations. "fourier_decorrelated" converges in
+            a fraction of the iterations of "pixel" on large (e.g. 224x224) inputs.
+        transforms ([func]): (optional) random transforms applied to the image before
+            forward_funcs in every iteration, e.g. dlight.dissect.parameterizations.standard_transforms(224)
+        resolution_schedule ([list of float]): (optional) coarse-to-fine fractions of the full
+            resolution, e.g. [0.25, 0.5, 1.0]. Iterations are split evenly between them.
 
     Returns:
         [list of Tensors]: The superstimulus for each provided forward_func
@@ -176,35 +359,176 @@ def get_image_superstimuli(forward_funcs, initial_input,
     assert len(initial_input.shape) == 4 and initial_input.shape[0] == 1, \
         "an image input of shape [1, C, H, W] is expected"
 
-    use_cuda = torch.cuda.is_available()
-    device = torch.device("cuda" if use_cuda else "cpu")
-
     if optimizer_provider is None:
         optimizer_provider = lambda input_to_optimize: torch.optim.Adam([input_to_optimize], lr=0.1, weight_decay=1e-6)
 
     if not isinstance(forward_funcs, list):
         forward_funcs = [forward_funcs]
 
+    initial_input = _place_initial_input(initial_input, device, dtype)
+
     optimized_inputs = []
     for forward_func in forward_funcs:
-        initial_input_copy = initial_input.clone()
-        input_to_optimize = torch.autograd.Variable(initial_input_copy, requires_grad=True)
-        optimizer = optimizer_provider(input_to_optimize)
-            
-        for _ in range(num_iterations):
-            optimizer.zero_grad()
-            scalar_to_maximize = forward_func(input_to_optimize)
-
-            loss = -scalar_to_maximize
-            if total_variation:
-                # for smoother superstimuli
-                regularizer_coefficient = 0.0005
-                loss += regularizer_coefficient * dimage.total_variation_loss(input_to_optimize[0].to(device))
-            # Backward
-            loss.backward()
-            # Update image
-            optimizer.step()
-
-        optimized_inputs.append(input_to_optimize)
-    
+        image = dparam.get_parameterization(parameterization, initial_input)
+        optimizer = optimizer_provider(image.tensor)
+        _optimize_superstimuli(forward_func, image, optimizer,
+            num_iterations, total_variation, autocast, patience, transforms, resolution_schedule)
+        with torch.no_grad():
+            optimized_inputs.append(image().detach())
+
     return optimized_inputs
+
+
+@dprofiling.profile
+def show_image_superstimuli_batched(forward_func, channel_indices, initial_input,
+        optimizer_provider=None, num_iterations=100, total_variation=True,
+        reduce_func="mean", batch_size=None,
+        device=None, dtype=None, autocast=False, patience=None,
+        parameterization="pixel", transforms=None, resolution_schedule=None,
+        num_cols=16, figsize=(20, 20), clf=True):
+    """ See docstring of get_image_superstimuli_batched """
+    import torchvision
+    superstimuli = get_image_superstimuli_batched(forward_func, channel_indices, initial_input,
+        optimizer_provider, num_iterations, total_variation, reduce_func, batch_size,
+        device, dtype, autocast, patience,
+        parameterization, transforms, resolution_schedule)
+    superstimuli = superstimuli.detach().cpu().float()
+
+    grid = torchvision.utils.make_grid(superstimuli, nrow=num_cols)
+    dimage.show_torch(dimage.normalize(grid), figsize, clf)
+
+
+@dprofiling.profile
+def get_image_superstimuli_batched(forward_func, channel_indices, initial_input,
+        optimizer_provider=None, num_iterations=100, total_variation=True,
+        reduce_func="mean", batch_size=None,
+        device=None, dtype=None, autocast=False, patience=None,
+        parameterization="pixel", transforms=None, resolution_schedule=None):
+    """ Get superstimulus for each channel in channel_indices by optimizing all of them
+        together as one batch, with one forward/backward pass per iteration.
+        Same as calling get_image_superstimuli with one forward_func per channel,
+        as long as the samples of a batch don't interact in the model
+        (e.g. call model.eval() so that BatchNorm uses running statistics).
+
+    Args:
+        forward_func ([func]): a function that takes a batch of inputs [N, C, H, W]
+            and returns the activations of a layer, of shape [N, K, H', W'] (conv) or [N, K] (fc).
+            For example: lambda x: model.partial_forward(x, "conv2")
+        channel_indices ([list of int]): channel (outer index) of the layer to maximize
+            for each superstimulus. For example list(range(K)) for all channels of the layer.
+        initial_input ([Tensor]): starting point for the superstimuli. Either of shape [1, C, H, W]
+            (shared by all channels) or [len(channel_indices), C, H, W].
+            See docstring of get_image_superstimuli
+        reduce_func ([str]): how to reduce the grid [H', W'] of conv activation,
+            one of ("mean", "max"). Ignored for activations of shape [N, K]
+        batch_size ([int]): (optional) max number of superstimuli optimized together.
+            By default all of them are optimized in one batch.
+        device, dtype, autocast, patience, parameterization, transforms, resolution_schedule:
+            see docstring of get_image_superstimuli. Early stopping applies to the loss
+            of the whole batch. The same random transform is applied to the whole batch.
+
+    Returns:
+        [Tensor]: superstimuli of shape [len(channel_indices), C, H, W]
+    """
+    num_superstimuli = len(channel_indices)
+    assert len(initial_input.shape) == 4 and initial_input.shape[0] in (1, num_superstimuli), \
+        "an image input of shape [1, C, H, W] or [len(channel_indices), C, H, W] is expected"
+
+    if optimizer_provider is None:
+        optimizer_provider = lambda input_to_optimize: torch.optim.Adam([input_to_optimize], lr=0.1, weight_decay=1e-6)
+    if batch_size is None:
+        batch_size = num_superstimuli
+
+    initial_input = _place_initial_input(initial_input, device, dtype)
+    initial_input = initial_input.expand(num_superstimuli, -1, -1, -1)
+    channel_indices = torch.as_tensor(channel_indices, dtype=torch.long, device=initial_input.device)
+
+    optimized_inputs = []
+    for start in range(0, num_superstimuli, batch_size):
+        batch_channel_indices = channel_indices[start:start + batch_size]
+        batch_positions = torch.arange(len(batch_channel_indices), device=initial_input.device)
+
+        def objective(input_to_optimize):
+            activations = forward_func(input_to_optimize)
+            activations = activations[batch_positions, batch_channel_indices]
+            activations = activations.reshape(activations.shape[0], -1)
+            if reduce_func == "mean":
+                scalars_to_maximize = torch.mean(activations, dim=1)
+            elif reduce_func == "max":
+                scalars_to_maximize = torch.max(activations, dim=1)[0]
+            else:
+                raise ValueError("reduce_func must be one of (mean, max). Instead got: " + str(reduce_func))
+            # Samples are independent, so the gradient of the sum w.r.t. each
+            # input is the gradient of its own objective
+            return torch.sum(scalars_to_maximize)
+
+        image = dparam.get_parameterization(parameterization, initial_input[start:start + batch_size])
+        optimizer = optimizer_provider(image.tensor)
+        _optimize_superstimuli(objective, image, optimizer,
+            num_iterations, total_variation, autocast, patience, transforms, resolution_schedule)
+        with torch.no_grad():
+            optimized_inputs.append(image().detach())
+
+    return torch.cat(optimized_inputs, dim=0)
+
+
+def _place_initial_input(initial_input, device, dtype):
+    """ Place initial_input on its final device and dtype once, before optimization """
+    if device is None:
+        device = initial_input.device
+    if dtype is None:
+        dtype = initial_input.dtype
+    return initial_input.detach().to(device, dtype)
+
+
+@dprofiling.profile
+def _optimize_superstimuli(objective, image, optimizer, num_iterations,
+        total_variation, autocast, patience, transforms=None, resolution_schedule=None,
+        tolerance=1e-4):
+    """ Maximize objective(image()) by optimizing image.tensor in place.
+        The number of iterations run and iterations/sec are recorded as args of its profiling span.
+
+    Returns:
+        [int]: number of iterations run (less than num_iterations if stopped early)
+    """
+    start_time = time.perf_counter()
+    device_type = image.tensor.device.type
+    autocast_dtype = torch.bfloat16 if device_type == "cpu" else torch.float16
+
+    best_loss = None
+    num_iterations_without_improvement = 0
+    for iteration in range(num_iterations):
+        optimizer.zero_grad(set_to_none=True)
+        if resolution_schedule is not None:
+            image.set_detail(dparam.get_detail(resolution_schedule, iteration, num_iterations))
+        input_to_optimize = image()
+        transformed_input = input_to_optimize if transforms is None else transforms(input_to_optimize)
+        with torch.autocast(device_type=device_type, dtype=autocast_dtype, enabled=autocast):
+            scalar_to_maximize = objective(transformed_input)
+
+        loss = -scalar_to_maximize.float()
+        if total_variation:
+            # for smoother superstimuli
+            regularizer_coefficient = 0.0005
+            loss = loss + regularizer_coefficient * dimage.total_variation_loss(input_to_optimize.float())
+        # Backward
+        loss.backward()
+        # Update image
+        optimizer.step()
+
+        if patience is not None:
+            loss_value = loss.item()
+            if best_loss is None or loss_value < best_loss - tolerance * max(1.0, abs(best_loss)):
+                best_loss = loss_value
+                num_iterations_without_improvement = 0
+            else:
+                num_iterations_without_improvement += 1
+                if num_iterations_without_improvement >= patience:
+                    num_iterations = iteration + 1
+                    break
+
+    s = dprofiling.current_span()
+    if s is not None:
+        elapsed = time.perf_counter() - start_time
+        s.args.update(iterations=num_iterations, iterations_per_second=num_iterations / max(elapsed, 1e-9))
+    return num_iterations
@@ -0,0 +1,136 @@
+import torch
+import dlight.dissect.activations as dactivations
+import dlight.utils.profiling as dprofiling
+
+
+# Supported methods of get_attributions
+METHODS = ("saliency", "gradient-x-input", "integrated-gradients")
+
+
+@dprofiling.profile
+def show_attributions(forward_func, inputs, outer_idx, method="integrated-gradients", reduce_channels=True,
+        num_cols=16, figsize=(20, 20), clf=True, **kwargs):
+    """ Show attribution maps of inputs along with inputs (see show_activations)
+
+    Args:
+        forward_func, inputs, outer_idx, method: see get_attributions
+        reduce_channels ([bool]): show one map per input instead of one per input channel
+            (sum over channels for gradient-x-input and integrated-gradients,
+            max over channels for saliency)
+        kwargs: passed to get_attributions (reduce_func, baseline, num_steps, batch_size, device)
+    """
+    attributions = get_attributions(forward_func, inputs, outer_idx, method, **kwargs)
+    if reduce_channels:
+        attributions = reduce_attribution_channels(attributions, method)
+    dactivations.show_activations(inputs, attributions, num_cols, figsize, clf)
+
+
+@dprofiling.profile
+def get_attributions(forward_func, inputs, outer_idx, method="integrated-gradients", reduce_func="mean",
+        baseline=None, num_steps=32, batch_size=256, device=None):
+    """ Which values of each input drive a unit (outer index) of a layer
+
+        - "saliency": absolute gradient of the unit w.r.t. the input
+        - "gradient-x-input": gradient times input
+        - "integrated-gradients": (input - baseline) times the gradient averaged along the straight
+            path from baseline to input (https://arxiv.org/abs/1703.01365). Attributions of an input
+            sum up to (approximately, depending on num_steps) unit(input) - unit(baseline).
+
+        All inputs and (for integrated-gradients) all interpolation steps are evaluated in batches
+        of batch_size, with one forward/backward pass per batch.
+        Samples of a batch must not interact in the model (e.g. call model.eval()
+        so that BatchNorm uses running statistics).
+
+    Args:
+        forward_func ([func]): a function that takes a batch of inputs [N, C, H, W]
+            and returns the activations of a layer, of shape [N, K, H', W'] (conv) or [N, K] (fc).
+            For example: lambda x: model.partial_forward(x, "conv2"), or model for its outputs
+        inputs ([Tensor or StoredActivations]): expected shape [B, C, H, W]
+        outer_idx ([int, list of int or Tensor]): unit of the layer, the same for all inputs,
+            or one per input (e.g. the predicted class of each input)
+        method ([str]): one of METHODS
+        reduce_func ([str]): how to reduce the grid [H', W'] of conv activation to a scalar,
+            one of ("mean", "max"). Ignored for activations of shape [N, K]
+        baseline ([Tensor]): (integrated-gradients) "absence of signal", of shape [1, C, H, W]
+            or [B, C, H, W]. Default is zeros (black image).
+        num_steps ([int]): (integrated-gradients) number of interpolation steps between
+            baseline and input (midpoint Riemann sum)
+        batch_size ([int]): max number of samples in a forward/backward pass
+        device ([torch.device]): (optional) device to run on, default is the device of inputs
+            (cpu for StoredActivations)
+
+    Returns:
+        [Tensor]: attributions of the same shape as inputs
+    """
+    if method not in METHODS:
+        raise ValueError("method must be one of " + str(METHODS) + ". Instead got: " + str(method))
+
+    num_inputs = inputs.shape[0]
+    if device is None:
+        device = inputs.device if isinstance(inputs, torch.Tensor) else torch.device("cpu")
+    outer_idx = torch.as_tensor(outer_idx, dtype=torch.long, device=device).expand(num_inputs)
+    # Inputs are read batch by batch, so that StoredActivations are never read into memory as a whole
+    attributions = None
+
+    if method == "integrated-gradients":
+        if baseline is None:
+            baseline = torch.zeros((1,) + tuple(inputs.shape[1:]))
+        baseline = baseline.to(device).expand(inputs.shape)
+        # midpoints of num_steps equal intervals of the path from baseline to input
+        alphas = (torch.arange(num_steps, device=device) + 0.5) / num_steps
+        # Every (input, step) pair is one sample: sample_idx // num_steps is its input.
+        # A batch of samples covers the inputs [first_input, last_input]
+        for start in range(0, num_inputs * num_steps, batch_size):
+            end = min(start + batch_size, num_inputs * num_steps)
+            first_input, last_input = start // num_steps, (end - 1) // num_steps
+            chunk = inputs[first_input:last_input + 1].detach().to(device)
+            if attributions is None:
+                attributions = torch.zeros(inputs.shape, dtype=chunk.dtype, device=device)
+            difference = chunk - baseline[first_input:last_input + 1].to(chunk.dtype)
+            sample_indices = torch.arange(start, end, device=device)
+            input_indices = sample_indices // num_steps - first_input
+            step_alphas = alphas[sample_indices % num_steps].to(chunk.dtype).view(-1, *([1] * (len(inputs.shape) - 1)))
+            interpolated = baseline[first_input:last_input + 1].to(chunk.dtype)[input_indices] + \
+                step_alphas * difference[input_indices]
+            gradients = _get_gradients(forward_func, interpolated, outer_idx[input_indices + first_input], reduce_func)
+            gradients_sum = torch.zeros_like(chunk).index_add_(0, input_indices, gradients)
+            attributions[first_input:last_input + 1] += difference * gradients_sum / num_steps
+        return attributions
+
+    for start in range(0, num_inputs, batch_size):
+        chunk = inputs[start:start + batch_size].detach().to(device)
+        gradients = _get_gradients(forward_func, chunk, outer_idx[start:start + batch_size], reduce_func)
+        if attributions is None:
+            attributions = torch.zeros(inputs.shape, dtype=gradients.dtype, device=device)
+        if method == "saliency":
+            attributions[start:start + batch_size] = torch.abs(gradients)
+        else:
+            attributions[start:start + batch_size] = gradients * chunk
+    return attributions
+
+
+def reduce_attribution_channels(attributions, method):
+    """ One map per input: attributions of shape [B, C, H, W] to [B, 1, H, W]
+        (sum over channels for gradient-x-input and integrated-gradients, max for saliency)
+    """
+    if method == "saliency":
+        return torch.max(attributions, dim=1, keepdim=True)[0]
+    return torch.sum(attributions, dim=1, keepdim=True)
+
+
+def _get_gradients(forward_func, inputs, outer_idx, reduce_func):
+    """ Gradient of unit outer_idx[i] w.r.t. inputs[i], for every i, in one forward/backward pass """
+    with torch.enable_grad():
+        inputs = inputs.detach().requires_grad_(True)
+        activations = forward_func(inputs)
+        activations = activations[torch.arange(inputs.shape[0], device=inputs.device), outer_idx]
+        activations = activations.reshape(activations.shape[0], -1)
+        if reduce_func == "mean":
+            units = torch.mean(activations, dim=1)
+        elif reduce_func == "max":
+            units = torch.max(activations, dim=1)[0]
+        else:
+            raise ValueError("reduce_func must be one of (mean, max). Instead got: " + str(reduce_func))
+        # Samples are independent, so the gradient of the sum w.r.t. each
+        # input is the gradient of its own unit
+        return torch.autograd.grad(torch.sum(units), inputs)[0]
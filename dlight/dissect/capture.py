@@ -0,0 +1,200 @@
+import itertools
+import torch
+import torch.nn as nn
+import dlight.utils.profiling as dprofiling
+
+
+class ActivationCapture:
+    """ Record outputs of any set of submodules of a model in a single forward pass,
+        using forward hooks. This replaces a hand-written partial_forward(x, node_name)
+        (see examples/dlight/simple_convnet.py), which needs one forward pass per node.
+
+        Note that only outputs of nn.Module nodes can be captured. Functional calls
+        (e.g. F.relu) inside forward() have no hook, so capture the module before them.
+
+        Usage:
+            with ActivationCapture(model, ["conv2", "fc4"], reductions={"conv2": "max"}) as capture:
+                model(inputs)
+            capture.activations["conv2"] # shape [B, C]
+            capture.activations["fc4"] # shape [B, C]
+
+        The captured Tensors can be passed directly to the dlight.dissect functions
+        that take activations.
+    """
+
+    def __init__(self, model, nodes, offload_to_cpu=False, dtype=None, reductions=None, accumulate=False):
+        """
+        Args:
+            model ([nn.Module]): model to capture activations from
+            nodes ([list of str or nn.Module]): names (as in model.named_modules())
+                or submodules of the model to capture
+            offload_to_cpu ([bool]): move captured activations to CPU inside the hook
+            dtype ([torch.dtype]): (optional) downcast captured activations,
+                e.g. torch.float16 or torch.bfloat16
+            reductions ([str, func or dict]): (optional) reduction applied inside the hook,
+                before offloading and downcasting. One of ("mean", "max") to reduce
+                the grid [H, W] of conv activations to shape [B, C], or a function
+                that takes and returns a Tensor. A dict maps node names to reductions.
+            accumulate ([bool]): if True, outputs of consecutive forward passes are
+                concatenated along the batch dimension (e.g. when iterating over a DataLoader).
+                Otherwise only the output of the last forward pass is kept.
+        """
+        self.model = model
+        self.nodes = resolve_nodes(model, nodes)
+        self.node_names = list(self.nodes.keys())
+        self.offload_to_cpu = offload_to_cpu
+        self.dtype = dtype
+        if not isinstance(reductions, dict):
+            reductions = {name: reductions for name in self.node_names}
+        self.reductions = reductions
+        self.accumulate = accumulate
+
+        self._outputs = {}
+        self._handles = []
+        self._pending_copies = [] # CUDA events of device to host copies started in hooks
+
+    def __enter__(self):
+        self.attach()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.detach()
+
+    def attach(self):
+        """ Register the forward hooks. Called automatically when used as a context manager """
+        self.detach()
+        for name, node in self.nodes.items():
+            self._handles.append(node.register_forward_hook(self._make_hook(name)))
+
+    def detach(self):
+        """ Remove the forward hooks. Captured activations are kept """
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+    def clear(self):
+        """ Forget captured activations """
+        self._wait_for_copies()
+        self._outputs = {}
+
+    def _wait_for_copies(self):
+        for event in self._pending_copies:
+            event.synchronize()
+        self._pending_copies = []
+
+    @property
+    def activations(self):
+        """ [dict]: mapping from node name to captured Tensor """
+        self._wait_for_copies()
+        activations = {}
+        for name, outputs in self._outputs.items():
+            activations[name] = outputs[0] if len(outputs) == 1 else torch.cat(outputs, dim=0)
+            self._outputs[name] = [activations[name]]
+        return activations
+
+    def _make_hook(self, name):
+        reduction = self.reductions.get(name)
+
+        def hook(module, input, output):
+            output = output.detach()
+            if reduction is not None:
+                output = reduce_activations(output, reduction)
+            if self.dtype is not None:
+                output = output.to(self.dtype)
+            if self.offload_to_cpu:
+                if output.is_cuda:
+                    # The copy runs asynchronously, activations waits for it before
+                    # the Tensor is handed out
+                    output = output.to("cpu", non_blocking=True)
+                    event = torch.cuda.Event()
+                    event.record()
+                    self._pending_copies.append(event)
+                else:
+                    output = output.to("cpu")
+
+            if self.accumulate:
+                self._outputs.setdefault(name, []).append(output)
+            else:
+                self._outputs[name] = [output]
+        return hook
+
+
+@dprofiling.profile
+def capture_activations(model, inputs, nodes, **kwargs):
+    """ Run inputs through the model and capture the outputs of nodes in one forward pass
+        (per batch). No gradients are recorded.
+
+    Args:
+        model ([nn.Module]): model to run
+        inputs ([Tensor or DataLoader]): a single batch, or an iterable of batches.
+            Each batch is either a Tensor or a tuple/list whose first item is the input Tensor
+        nodes ([list of str or nn.Module]): see ActivationCapture
+        kwargs: passed to ActivationCapture (offload_to_cpu, dtype, reductions)
+
+    Returns:
+        [dict]: mapping from node name to captured Tensor
+    """
+    device = get_device(model)
+    if isinstance(inputs, torch.Tensor):
+        inputs = [inputs]
+
+    with ActivationCapture(model, nodes, accumulate=True, **kwargs) as capture:
+        with torch.no_grad():
+            for batch in inputs:
+                if isinstance(batch, (tuple, list)):
+                    batch = batch[0]
+                model(batch.to(device))
+    return capture.activations
+
+
+def resolve_nodes(model, nodes):
+    """ Map names and/or submodules of model to an ordered dict of {name: submodule} """
+    if isinstance(nodes, (str, nn.Module)):
+        nodes = [nodes]
+    named_modules = dict(model.named_modules())
+    names_by_module = {module: name for name, module in named_modules.items()}
+
+    resolved = {}
+    for node in nodes:
+        if isinstance(node, nn.Module):
+            if node not in names_by_module:
+                raise ValueError("node " + node.__class__.__name__ + " is not a submodule of the model")
+            resolved[names_by_module[node]] = node
+        elif node in named_modules:
+            resolved[node] = named_modules[node]
+        else:
+            raise ValueError("Invalid node name= " + str(node) +
+                ". Available names: " + ", ".join(name for name in named_modules if name))
+    return resolved
+
+
+def get_device(model):
+    """ Device of the parameters (or buffers) of model, CPU for a model without any """
+    for tensor in itertools.chain(model.parameters(), model.buffers()):
+        return tensor.device
+    return torch.device("cpu")
+
+
+def reduce_activations(activations, reduce_func):
+    """ Reduce activations of shape [B, C, H, W] (conv) to [B, C].
+        Activations of shape [B, C] (fc) are returned as is.
+
+    Args:
+        activations ([Tensor]): expected shape [B, C, H, W] or [B, C]
+        reduce_func ([str or func]): one of ("mean", "max"), or a function
+            that takes and returns a Tensor
+    """
+    if callable(reduce_func):
+        return reduce_func(activations)
+    if len(activations.shape) == 2:
+        return activations
+    if len(activations.shape) != 4:
+        raise NotImplementedError("Only activations of shape [B, C, H, W] (for conv) and [B, C] (for fc) are supported for now")
+
+    activations = activations.reshape(activations.shape[0], activations.shape[1], -1)
+    if reduce_func == "mean":
+        return torch.mean(activations, dim=2)
+    elif reduce_func == "max":
+        return torch.max(activations, dim=2)[0]
+    else:
+        raise ValueError("reduce_func must be one of (mean, max). Instead got: " + str(reduce_func))
@@ -0,0 +1,130 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import dlight.dissect.store as dstore
+import dlight.utils.profiling as dprofiling
+
+
+# Contribution of every input channel to an output unit of a node, such that
+#     contributions.sum(inner channels) + bias = output
+# (see the figure title "Dissected activation of conv2_3" in
+# https://towardsdatascience.com/explainable-mnist-classification-dissection-of-a-convnet-f32910d52842).
+# Maps node type to the number of its spatial dims.
+conv_types = {nn.Conv1d: 1, nn.Conv2d: 2, nn.Conv3d: 3}
+supported_types = (nn.Linear,) + tuple(conv_types.keys())
+
+_conv_funcs = {1: F.conv1d, 2: F.conv2d, 3: F.conv3d}
+
+# Outer indices of convs are decomposed in chunks, so that the inputs gathered for a chunk
+# take about this many bytes, whatever the number of outer indices. See get_outer_chunk_size.
+max_chunk_bytes = 256 * 1024 ** 2
+
+
+def get_outer_chunk_size(inputs, node):
+    """ Number of outer indices of a conv node decomposed at once by get_contributions,
+        so that their gathered inputs take about max_chunk_bytes (at least one outer index)
+
+    Args:
+        inputs ([Tensor or StoredActivations]): input to node, see get_contributions
+        node ([nn.Conv1d, nn.Conv2d or nn.Conv3d]): node to decompose
+    """
+    # every outer index gets its own copy of the inner channels of its group (padding aside)
+    channel_numel = torch.Size(inputs.shape).numel() // inputs.shape[1]
+    bytes_per_outer_idx = channel_numel * node.weight.shape[1] * node.weight.element_size()
+    return max(1, max_chunk_bytes // max(1, bytes_per_outer_idx))
+
+
+@dprofiling.profile
+def get_contributions(inputs, node, outer_indices, outer_chunk_size=None):
+    """ Decompose outputs of node into the contributions of its input channels,
+        for several outer indices at once.
+
+        For convs, every inner channel of the group of an outer index is convolved with its
+        own slice of the weights, all in one grouped conv call. Groups, dilation, stride and
+        padding modes of the node are taken into account. nn.Linear is treated as a conv with
+        kernel size 1 over any dims between the batch and the feature dim (e.g. tokens).
+
+    Args:
+        inputs ([Tensor or StoredActivations]): input to node. Expected shape
+            [B, C, *spatial] for convs (spatial is [L], [H, W] or [D, H, W])
+            and [B, *, C] for nn.Linear. StoredActivations are read into memory as a whole
+            (up to dlight.dissect.store.max_in_memory_bytes), slice them to dissect a subset
+        node ([nn.Linear, nn.Conv1d, nn.Conv2d or nn.Conv3d]): node to decompose
+        outer_indices ([int or list of int]): outer indices (output channels) of node
+        outer_chunk_size ([int]): (optional) how many outer indices of a conv are decomposed
+            in one grouped conv call, each of them on its own copy of its inner channels.
+            Default is get_outer_chunk_size(inputs, node)
+
+    Returns:
+        [tuple]: (inner_indices, weights, bias, contributions, outputs) with O outer indices
+            and K inner channels per group (K is all input channels, unless node is grouped):
+            inner_indices: LongTensor [O, K], input channels that contribute to each outer index
+            weights: [O, K, *kernel] ([O, K] for nn.Linear)
+            bias: [O] (zeros if the node has no bias)
+            contributions: [B, O, K, *spatial_out] ([B, O, K, *] for nn.Linear)
+            outputs: [B, O, *spatial_out] ([B, O, *] for nn.Linear)
+    """
+    if not isinstance(node, supported_types):
+        raise NotImplementedError("Type " + node.__class__.__name__ + " is not supported yet. Supported types: " +
+            ", ".join(node_type.__name__ for node_type in supported_types))
+    if isinstance(outer_indices, int):
+        outer_indices = [outer_indices]
+
+    # Decompose on the device of the node, so that its weights are used as is
+    inputs = dstore.as_tensor(inputs).to(node.weight.device, node.weight.dtype)
+    outer_indices = torch.as_tensor(outer_indices, dtype=torch.long, device=node.weight.device)
+    weights = node.weight.data[outer_indices]
+    if node.bias is not None:
+        bias = node.bias.data[outer_indices]
+    else:
+        bias = torch.zeros(len(outer_indices), dtype=weights.dtype, device=weights.device)
+
+    if isinstance(node, nn.Linear):
+        inner_indices = torch.arange(node.in_features, device=weights.device).expand(len(outer_indices), -1)
+        with torch.no_grad():
+            features = inputs.movedim(-1, 1) # now shape is [B, C, *]
+            extra_dims = (1,) * (len(features.shape) - 2)
+            contributions = features.unsqueeze(1) * weights.view(1, *weights.shape, *extra_dims)
+            outputs = node(inputs).movedim(-1, 1)[:, outer_indices]
+        return inner_indices, weights, bias, contributions, outputs
+
+    num_spatial_dims = conv_types[type(node)]
+    assert len(inputs.shape) == num_spatial_dims + 2, \
+        "inputs of " + node.__class__.__name__ + " must have " + str(num_spatial_dims + 2) + " dims. " + \
+        "Instead got shape: " + str(list(inputs.shape))
+
+    num_inner_channels = node.weight.shape[1] # per group
+    outer_channels_per_group = node.out_channels // node.groups
+    group_indices = outer_indices // outer_channels_per_group
+    inner_indices = group_indices[:, None] * num_inner_channels + \
+        torch.arange(num_inner_channels, device=weights.device)[None, :]
+
+    if outer_chunk_size is None:
+        outer_chunk_size = get_outer_chunk_size(inputs, node)
+
+    padding = node.padding
+    padded_inputs = inputs
+    if node.padding_mode != "zeros":
+        padded_inputs = F.pad(inputs, node._reversed_padding_repeated_twice, mode=node.padding_mode)
+        padding = 0
+
+    with torch.no_grad():
+        outputs = node(inputs)[:, outer_indices]
+        # shape is [B, O, K, *spatial_out]
+        contributions = weights.new_empty(outputs.shape[:1] + inner_indices.shape + outputs.shape[2:])
+
+        for start in range(0, len(outer_indices), outer_chunk_size):
+            chunk_inner_indices = inner_indices[start:start + outer_chunk_size]
+            chunk_weights = weights[start:start + outer_chunk_size]
+            # Convolve each inner channel of each outer index with its own slice of the weights in one call:
+            # groups=O*K turns weights of shape [O, K, *kernel] into O*K independent [1, 1, *kernel] kernels.
+            num_kernels = chunk_weights.shape[0] * chunk_weights.shape[1]
+            chunk_contributions = _conv_funcs[num_spatial_dims](
+                padded_inputs[:, chunk_inner_indices.flatten()],
+                chunk_weights.reshape(num_kernels, 1, *chunk_weights.shape[2:]),
+                stride=node.stride, padding=padding, dilation=node.dilation, groups=num_kernels)
+            contributions[:, start:start + outer_chunk_size] = chunk_contributions.unflatten(1, chunk_inner_indices.shape)
+
+    # [ torch.sum(contributions, dim=2) + bias = outputs ] should hold true
+
+    return inner_indices, weights, bias, contributions, outputs
@@ -1,13 +1,17 @@
-import os.path as osp
 from random import randrange
 import json
-import IPython.display as ipd
 import torch
 import torch.nn as nn
-import dlight
+import dlight.dissect.contributions as dcontributions
+import dlight.dissect.store as dstore
+import dlight.utils.image as dimage
+import dlight.utils.assets as dassets
+import dlight.utils.profiling as dprofiling
+from dlight.utils.tensor_codec import encode_tensor
 
 
-def show_conv_dissection(input_to_conv, node, outer_idx, input_description=None):
+@dprofiling.profile
+def show_conv_dissection(input_to_conv, node, outer_idx, input_description=None, encoding="float32"):
     """ Conv dissection consists of the following columns
         - input to convolutional layer
         - (optional) description of the input
@@ -20,44 +24,26 @@ def show_conv_dissection(input_to_conv, node, outer_idx, input_description=None)
         for the definition of each column.)
 
     Args:
-        input_to_conv ([Tensor]): expected shape [B, C, H, W]
-        node ([nn.Conv2d]): conv node
+        input_to_conv ([Tensor or StoredActivations]): expected shape [B, C, H, W]
+            (or [B, C, L], [B, C, D, H, W] and [B, *, C], see dlight.dissect.contributions)
+        node ([nn.Conv2d, nn.Conv1d, nn.Conv3d or nn.Linear]): conv (or linear) node
         outer_idx ([int]): outer index of the conv node
         input_description ([dict]): mappping from (1-based) index of conv
             inner channels to the description of the corresponding input.
+        encoding ([str]): how tensors are sent to the browser, one of
+            ("float32", "float16", "uint8"). See dlight.utils.tensor_codec.encode_tensor.
+            "float16" halves the payload, but keeps only ~3 significant digits and
+            turns values above 65504 in magnitude into inf
     """
-    
-    input_to_conv, weights, bias, intermediate_activations, activation = \
-        get_conv_dissection(input_to_conv, node, outer_idx)
-
-    num_images = input_to_conv.shape[0]
-    num_inner_channels = input_to_conv.shape[1]
-    cumulative_activations = []
-    for img_idx in range(num_images):
-        cumulative = [intermediate_activations[img_idx, 0]]
-        for inner_idx in range(1, num_inner_channels):
-            cumulative.append(cumulative[inner_idx - 1] + intermediate_activations[img_idx, inner_idx])
-        cumulative.append(cumulative[num_inner_channels - 1] + bias)
-        for i in range(len(cumulative)):
-            cumulative[i] = cumulative[i].tolist()
-        cumulative_activations.append(cumulative)
+    import IPython.display as ipd
 
-    data = {
-        "input_to_conv": input_to_conv.tolist(), # shape = (B, NUM_IN_CHANNELS, H, W)
-        "weights": weights.tolist(), # shape = (1, NUM_IN_CHANNELS, H, W)
-        "bias": bias,
-        "intermediate_activations": intermediate_activations.tolist(), # shape = (B, NUM_IN_CHANNELS, H, W)
-        "cumulative_activations": cumulative_activations, # shape = (B, NUM_IN_CHANNELS + 1(for bias), H, W)
-        "activation": activation.tolist() # shape = (B, 1, H, W)
-    }
+    data = get_conv_dissection_data(input_to_conv, node, outer_idx, input_description, encoding)
 
-    if input_description is not None:
-        data["input_description"] = input_description
+    dassets.use(["conv_dissection"])
 
-    dlight.load_js_libs()
-    dissect_dir = osp.dirname(osp.realpath(__file__))
-    ipd.display(ipd.Javascript(filename=osp.join(dissect_dir, "js", "conv_dissection.js")))
-    ipd.display(ipd.HTML(filename=osp.join(dissect_dir, "js", "conv_dissection.css.html")))
+    with dprofiling.span("serialize") as s:
+        payload = json.dumps(data)
+        s.add_bytes(len(payload))
 
     container_id = "conv-dissection-container-" + str(randrange(1000))
     ipd.display(ipd.HTML("<div id='{}'></div> ".format(container_id)))
@@ -65,43 +51,96 @@ def show_conv_dissection(input_to_conv, node, outer_idx, input_description=None)
             require(['conv_dissection'], function(conv_dissection) {{
                 conv_dissection(document.getElementById("{}"), {});
             }});
-        """.format(container_id, json.dumps(data))))
-
+        """.format(container_id, payload)))
 
-def get_conv_dissection(input_to_conv, node, outer_idx):
-    """ See docstring of show_conv_dissection """
-    assert isinstance(node, nn.Conv2d)
-    assert len(input_to_conv.shape) == 4, "input_to_conv must be of shape [B, C, H, W]"
-
-    num_inner_channels = input_to_conv.shape[1]
-    
-    use_cuda = torch.cuda.is_available()
-    device = torch.device("cuda" if use_cuda else "cpu")
-    input_to_conv = input_to_conv.to(device)
 
-    weights = node.weight.data[outer_idx:outer_idx + 1]
-    bias = 0.0
-    if node.bias is not None:
-        bias = node.bias.data[outer_idx].item()
+@dprofiling.profile
+def get_conv_dissection_data(input_to_conv, node, outer_idx, input_description=None, encoding="float32"):
+    """ JSON-serializable data of the conv dissection, as sent to conv_dissection.js.
+        See docstring of show_conv_dissection.
+    """
+    input_to_conv, weights, bias, intermediate_activations, activation = \
+        get_conv_dissection(input_to_conv, node, outer_idx)
 
-    intermediate_activations = []
-    for inner_idx in range(num_inner_channels):
-        intermediate_conv = nn.Conv2d(1, 1,
-                kernel_size=node.kernel_size, stride=node.stride, padding=node.padding)
-        intermediate_conv.weight.data = \
-            node.weight.data[outer_idx:outer_idx + 1, inner_idx:inner_idx + 1, :, :].clone()
-        intermediate_conv.bias.data[0] = 0.0
-        intermediate_conv = intermediate_conv.to(device)
+    cumulative_activations = torch.cumsum(intermediate_activations, dim=1)
+    cumulative_activations = torch.cat(
+        [cumulative_activations, cumulative_activations[:, -1:] + bias], dim=1)
 
-        intermediate_activations.append(
-            intermediate_conv(input_to_conv[:, inner_idx:inner_idx + 1, :, :]))
+    data = {
+        "input_to_conv": encode_tensor(input_to_conv, encoding), # shape = (B, NUM_IN_CHANNELS, H, W)
+        "weights": encode_tensor(weights, encoding), # shape = (1, NUM_IN_CHANNELS, H, W)
+        "bias": bias,
+        "intermediate_activations": encode_tensor(intermediate_activations, encoding), # shape = (B, NUM_IN_CHANNELS, H, W)
+        "cumulative_activations": encode_tensor(cumulative_activations, encoding), # shape = (B, NUM_IN_CHANNELS + 1(for bias), H, W)
+        "activation": encode_tensor(activation, encoding) # shape = (B, 1, H, W)
+    }
 
-    intermediate_activations = torch.cat(intermediate_activations, dim=1) # now shape is [B, NUM_IN_CHANNELS, H, W]
+    if input_description is not None:
+        data["input_description"] = input_description
+    return data
 
-    activation = node(input_to_conv)[:, outer_idx:outer_idx + 1, :, :]
 
-    # [ torch.sum(intermediate_activations, dim=1) + bias = activation ] should hold true
+@dprofiling.profile
+def get_conv_dissection(input_to_conv, node, outer_idx):
+    """ See docstring of show_conv_dissection.
+        For grouped convs (node.groups > 1) only the inner channels in the group
+        of outer_idx contribute, so input_to_conv is narrowed down to them.
+        Conv1d, Conv3d and Linear nodes are dissected too (see dlight.dissect.contributions),
+        their inputs and activations are reshaped into images (see dlight.utils.image.as_images).
+    """
+    return get_conv_dissections(input_to_conv, node, [outer_idx])[0]
 
-    return input_to_conv, weights, bias, intermediate_activations, activation
 
+@dprofiling.profile
+def get_conv_dissections(input_to_conv, node, outer_indices, outer_chunk_size=None):
+    """ get_conv_dissection for many outer indices of node, decomposed in chunks of outer indices
 
+    Args:
+        input_to_conv ([Tensor or StoredActivations]): see dlight.dissect.contributions.get_contributions
+        node ([nn.Linear, nn.Conv1d, nn.Conv2d or nn.Conv3d]): node to dissect
+        outer_indices ([list of int]): outer indices of node
+        outer_chunk_size ([int]): (optional) see dlight.dissect.contributions.get_contributions
+
+    Returns:
+        [list of tuples]: for every outer index (in order) the tuple
+            (input_to_conv, weights, bias, intermediate_activations, activation)
+            as returned by get_conv_dissection
+    """
+    input_to_conv = dstore.as_tensor(input_to_conv)
+    inner_indices, weights, bias, contributions, outputs = \
+        dcontributions.get_contributions(input_to_conv, node, outer_indices, outer_chunk_size)
+
+    dissections = []
+    group_inputs = {} # outer indices of the same group share their input
+    for i, outer_idx in enumerate(outer_indices):
+        group_idx = get_group_index(node, outer_idx)
+        if group_idx not in group_inputs:
+            group_inputs[group_idx] = get_group_input(input_to_conv, node, group_idx)
+        dissections.append((
+            group_inputs[group_idx], # shape = (B, NUM_IN_CHANNELS, H, W)
+            dimage.as_images(weights[i:i + 1]), # shape = (1, NUM_IN_CHANNELS, kH, kW)
+            bias[i].item(),
+            dimage.as_images(contributions[:, i]), # shape = (B, NUM_IN_CHANNELS, H, W)
+            dimage.as_images(outputs[:, i:i + 1]), # shape = (B, 1, H, W)
+        ))
+    return dissections
+
+
+def get_group_index(node, outer_idx):
+    """ Group of node (see nn.Conv2d groups) that outer_idx belongs to. Always 0 for nn.Linear """
+    if isinstance(node, nn.Linear):
+        return 0
+    return outer_idx // (node.out_channels // node.groups)
+
+
+def get_group_input(input_to_conv, node, group_idx):
+    """ Input channels of group group_idx of node (all input channels for nn.Linear),
+        as images of shape [B, NUM_IN_CHANNELS, H, W], on the device and dtype of node
+    """
+    input_to_conv = dstore.as_tensor(input_to_conv)
+    if isinstance(node, nn.Linear):
+        group_input = input_to_conv.movedim(-1, 1)
+    else:
+        num_inner_channels = node.weight.shape[1] # per group
+        group_input = input_to_conv[:, group_idx * num_inner_channels:(group_idx + 1) * num_inner_channels]
+    return dimage.as_images(group_input.to(node.weight.device, node.weight.dtype))
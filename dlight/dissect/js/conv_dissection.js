@@ -3,11 +3,11 @@
 // Uncomment for debugging
 // require.undef("conv_dissection");
 
-define("conv_dissection", ["d3"], function (d3) {
+define("conv_dissection", ["d3", "tensor_codec"], function (d3, tensor_codec) {
   return (container, data) => {
     /** data should contain the following:
      * {
-     *   // below are all nested lists of floats
+     *   // below are all tensors encoded by dlight.utils.tensor_codec.encode_tensor
      *   input_to_conv: shape = (B, NUM_IN_CHANNELS, H, W),
      *   weights: shape = (1, NUM_IN_CHANNELS, H, W),
      *   intermediate_activations: shape = (B, NUM_IN_CHANNELS, H, W),
@@ -21,14 +21,16 @@ define("conv_dissection", ["d3"], function (d3) {
      */
 
     // ----------------------------- Init -----------------------------
-    const {
-      input_to_conv,
-      weights,
-      bias,
-      intermediate_activations,
-      cumulative_activations,
-      activation,
-    } = data;
+    const bias = data.bias;
+    const input_to_conv = tensor_codec.decode(data.input_to_conv);
+    const weights = tensor_codec.decode(data.weights);
+    const intermediate_activations = tensor_codec.decode(
+      data.intermediate_activations
+    );
+    const cumulative_activations = tensor_codec.decode(
+      data.cumulative_activations
+    );
+    const activation = tensor_codec.decode(data.activation);
     const input_description = data.input_description
       ? data.input_description
       : null;
@@ -38,13 +40,13 @@ define("conv_dissection", ["d3"], function (d3) {
       .append("div")
       .attr("class", "conv-dissection-inner-container");
 
-    const num_in_channels = input_to_conv[0].length;
-    const input_height = input_to_conv[0][0].length;
-    const input_width = input_to_conv[0][0][0].length;
-    const weight_height = weights[0][0].length;
-    const weight_width = weights[0][0][0].length;
-    const activation_height = activation[0][0].length;
-    const activation_width = activation[0][0][0].length;
+    const num_in_channels = input_to_conv.shape[1];
+    const input_height = input_to_conv.shape[2];
+    const input_width = input_to_conv.shape[3];
+    const weight_height = weights.shape[2];
+    const weight_width = weights.shape[3];
+    const activation_height = activation.shape[2];
+    const activation_width = activation.shape[3];
 
     // ----------------------------- Add empty columns -----------------------------
 
@@ -95,7 +97,7 @@ define("conv_dissection", ["d3"], function (d3) {
 
     function populate_image_column(
       content_node,
-      content_data,
+      content_tensor,
       canvas_class,
       canvas_size
     ) {
@@ -103,7 +105,7 @@ define("conv_dissection", ["d3"], function (d3) {
 
       const verticals = content_node
         .selectAll(".column-content-verticals")
-        .data(content_data)
+        .data(tensor_codec.toImages(content_tensor))
         .enter()
         .append("div")
         .attr(
@@ -131,7 +133,7 @@ define("conv_dissection", ["d3"], function (d3) {
 
       populateCanvasNodes(
         horizontals.nodes(),
-        get_column_color_scale(content_data)
+        get_column_color_scale(content_tensor)
       );
 
       return verticals;
@@ -213,52 +215,40 @@ define("conv_dissection", ["d3"], function (d3) {
     function populateCanvasNodes(nodes, colorScale) {
       for (let i = 0; i < nodes.length; i++) {
         let canvas = nodes[i];
-        let imageArray = d3.select(canvas).data()[0];
-        if (imageArray === null) continue;
+        let imageData = d3.select(canvas).data()[0];
+        if (imageData === null) continue;
 
         let context = canvas.getContext("2d");
 
-        let image = context.createImageData(
-          imageArray.length,
-          imageArray[0].length
-        );
+        let image = context.createImageData(imageData.width, imageData.height);
 
-        populateCanvasImage(image, imageArray, colorScale);
+        populateCanvasImage(image, imageData.values, colorScale);
 
         context.putImageData(image, 0, 0);
       }
     }
 
-    function populateCanvasImage(canvasImage, imageArray, colorScale) {
-      // expected shape of image array = [height, width]
-      for (let y = 0; y < imageArray.length; y++) {
-        for (let x = 0; x < imageArray[0].length; x++) {
-          let pos = y * imageArray[0].length + x;
-          let c = colorScale(imageArray[y][x]);
-          canvasImage.data[pos * 4 + 0] = c; // R
-          canvasImage.data[pos * 4 + 1] = c; // G
-          canvasImage.data[pos * 4 + 2] = c; // B
-          canvasImage.data[pos * 4 + 3] = 255; // A
-        }
+    function populateCanvasImage(canvasImage, imageValues, colorScale) {
+      // imageValues is a Float32Array of length height * width (row-major)
+      for (let pos = 0; pos < imageValues.length; pos++) {
+        let c = colorScale(imageValues[pos]);
+        canvasImage.data[pos * 4 + 0] = c; // R
+        canvasImage.data[pos * 4 + 1] = c; // G
+        canvasImage.data[pos * 4 + 2] = c; // B
+        canvasImage.data[pos * 4 + 3] = 255; // A
       }
     }
 
-    function get_column_color_scale(column_data) {
+    function get_column_color_scale(column_tensor) {
       /**
-       * column_data shape is (B, NUM_IN_CHANNELS, H, W)
+       * column_tensor shape is (B, NUM_IN_CHANNELS, H, W)
        */
       let overallMin = Infinity;
       let overallMax = -Infinity;
-      for (let img_idx = 0; img_idx < column_data.length; img_idx++) {
-        for (let in_idx = 0; in_idx < column_data[0].length; in_idx++) {
-          for (let y = 0; y < column_data[0][0].length; y++) {
-            for (let x = 0; x < column_data[0][0][0].length; x++) {
-              let weightVal = column_data[img_idx][in_idx][y][x];
-              if (weightVal < overallMin) overallMin = weightVal;
-              if (weightVal > overallMax) overallMax = weightVal;
-            }
-          }
-        }
+      const values = column_tensor.data;
+      for (let i = 0; i < values.length; i++) {
+        if (values[i] < overallMin) overallMin = values[i];
+        if (values[i] > overallMax) overallMax = values[i];
       }
 
       const color_scale = d3
@@ -0,0 +1,121 @@
+import torch
+import dlight.dissect.capture as dcapture
+import dlight.utils.image as dimage
+import dlight.utils.profiling as dprofiling
+
+
+class LiveModel:
+    """ Persistent wrapper of a model for interactive probing: runs one image at a time
+        and returns the activations of a single node. The hook on the node is registered once
+        and the input Tensor is preallocated, so that a call is a copy and a forward pass.
+
+        Usage:
+            with LiveModel(model, "conv2", input_shape=(1, 28, 28)) as live_model:
+                activations = live_model(image) # shape [C, H, W]
+    """
+
+    def __init__(self, model, node, input_shape, transform=None, device=None):
+        """
+        Args:
+            model ([nn.Module]): model to run, in eval mode
+            node ([str or nn.Module]): name (as in model.named_modules()) or submodule of the model
+            input_shape ([tuple of int]): shape [C, H, W] of a single input of the model
+            transform ([func]): (optional) function applied to the input batch of shape
+                [1, C, H, W] (values in [0, 1]) before the model, e.g. normalization
+            device ([torch.device]): (optional) device of the input, default is the device
+                of the model (CPU for a model without parameters)
+        """
+        self.model = model
+        self.transform = transform
+        self.capture = dcapture.ActivationCapture(model, [node])
+        self.node_name = self.capture.node_names[0]
+        if device is None:
+            device = dcapture.get_device(model)
+        with torch.inference_mode():
+            self.input = torch.zeros((1,) + tuple(input_shape), device=device)
+        self.capture.attach()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """ Remove the hook from the model """
+        self.capture.detach()
+
+    @dprofiling.profile(name="dissect.live.LiveModel")
+    def __call__(self, image):
+        """ Activations of the node for image
+
+        Args:
+            image ([Tensor]): uint8 with values within [0, 255], of shape [H, W]
+                (copied to all channels of the input) or [C, H, W]
+
+        Returns:
+            [Tensor]: activations of the node, without the batch dimension
+        """
+        with torch.inference_mode():
+            self.input[0].copy_(image, non_blocking=True)
+            self.input.mul_(1.0 / 255.0)
+            inputs = self.input if self.transform is None else self.transform(self.input)
+            self.model(inputs)
+            return self.capture.activations[self.node_name][0]
+
+
+@dprofiling.profile
+def show_live_activations(model, node, input_shape, transform=None, num_cols=16, transport=None):
+    """ Draw an input and see the activations of node change while drawing
+        (see dlight.utils.image.draw_synthetic_input)
+
+    Args:
+        model ([nn.Module]): model to run, in eval mode
+        node ([str or nn.Module]): name (as in model.named_modules()) or submodule of the model
+        input_shape ([tuple of int]): shape [C, H, W] of a single input of the model.
+            The drawing is grayscale and it is copied to all channels.
+        transform ([func]): see LiveModel
+        num_cols ([int]): number of channels per row of the activations grid
+        transport ([str]): see dlight.utils.image.draw_synthetic_input
+
+    Returns:
+        [LiveModel]: the wrapper that runs the model. Call close() on it to remove its hook.
+    """
+    live_model = LiveModel(model, node, input_shape, transform)
+
+    def callback(image):
+        return get_activations_image(live_model(image), num_cols)
+
+    dimage.draw_synthetic_input(input_shape[1], input_shape[2], callback, live=True, transport=transport)
+    return live_model
+
+
+def get_activations_image(activations, num_cols=16, padding=2):
+    """ Activations of a single input as one grayscale image
+
+    Args:
+        activations ([Tensor]): expected shape [C, H, W] (conv) or [C] (fc)
+        num_cols ([int]): number of channels per row
+
+    Returns:
+        [Tensor]: shape [H', W']. Conv channels are tiled like in show_activations,
+            fc activations are wrapped into rows of num_cols values.
+    """
+    activations = activations.detach().cpu().float()
+    num_channels = activations.shape[0]
+    num_cols = min(num_cols, num_channels)
+    num_rows = -(-num_channels // num_cols) # ceiling-divide
+
+    if len(activations.shape) == 1:
+        image = torch.zeros(num_rows * num_cols)
+        image[:num_channels] = activations
+        return image.view(num_rows, num_cols)
+    if len(activations.shape) != 3:
+        raise NotImplementedError("Only activations of shape [C, H, W] (for conv) and [C] (for fc) are supported for now")
+
+    height, width = activations.shape[1:]
+    grid, tiles = dimage.grid_buffer(1, num_rows, num_cols, height, width, padding)
+    channels = torch.zeros(num_rows * num_cols, height, width)
+    channels[:num_channels] = activations
+    tiles[0] = channels.view(num_rows, num_cols, height, width).permute(0, 2, 1, 3)
+    return grid[0]
@@ -0,0 +1,249 @@
+import copy
+import os
+import random
+import torch
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader, Subset
+import dlight.dissect.activations as dactivations
+import dlight.dissect.capture as dcapture
+import dlight.dissect.conv as dconv
+import dlight.utils.profiling as dprofiling
+
+
+# Run dissection jobs on all CPU cores, sharded by data or by channel, in a
+# torch.multiprocessing pool. Partial results are merged in shard order, so
+# results don't depend on the number of workers or on scheduling.
+# Workers run on CPU. The shared state of a job (model, dataset, ...) is handed to
+# every worker once, when the pool starts (with the default "fork" start method on
+# Linux it is not even copied), and jobs only carry shard indices.
+
+_worker_context = None
+
+
+@dprofiling.profile
+def run_in_pool(worker_func, context, jobs, num_workers=None, start_method=None):
+    """ Run worker_func(context, job) for every job in a process pool
+
+    Args:
+        worker_func ([func]): module-level function (so that it can be pickled)
+        context: state shared by all jobs, handed to each worker once
+        jobs ([list]): one item per call of worker_func
+        num_workers ([int]): (optional) number of processes, default is the number of CPU cores
+        start_method ([str]): (optional) multiprocessing start method
+            ("fork", "spawn", "forkserver"), default is the platform default
+
+    Returns:
+        [list]: results in the order of jobs
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count()
+    num_workers = max(1, min(num_workers, len(jobs)))
+    # Split the cores between workers instead of oversubscribing them
+    num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+
+    pool_context = mp.get_context(start_method)
+    with pool_context.Pool(num_workers, initializer=_init_worker, initargs=(context, num_threads)) as pool:
+        return pool.starmap(_run_job, [(worker_func, job) for job in jobs], chunksize=1)
+
+
+def _init_worker(context, num_threads):
+    global _worker_context
+    _worker_context = context
+    torch.set_num_threads(num_threads)
+
+
+def _run_job(worker_func, job):
+    return worker_func(_worker_context, job)
+
+
+def _split(num_items, num_shards):
+    """ Split range(num_items) into num_shards contiguous (start, end) ranges """
+    num_shards = max(1, min(num_shards, num_items))
+    bounds = [num_items * i // num_shards for i in range(num_shards + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(num_shards)]
+
+
+def _cpu_model(model):
+    """ model itself if it is on CPU, otherwise a CPU copy (CUDA does not survive fork) """
+    if all(p.device.type == "cpu" for p in model.parameters()):
+        return model
+    return copy.deepcopy(model).cpu()
+
+
+# ----------------------------- Max activations -----------------------------
+
+@dprofiling.profile
+def parallel_maximum_activations(model, node, dataset, nlargest, params=None,
+        num_workers=None, batch_size=256, start_method=None):
+    """ Sharded version of get_maximimum_activations_streaming: every worker runs
+        the model over a contiguous shard of the dataset and the per-shard top-k tables
+        are merged. Ties are broken by dataset index, so the result is deterministic.
+
+    Args:
+        model ([nn.Module]): model to run, in eval mode
+        node ([str or nn.Module]): name or submodule of model whose output is dissected
+        dataset ([Dataset]): map-style dataset. Each item is either a Tensor or
+            a tuple/list whose first item is the input Tensor
+        nlargest, params: see docstring of get_maximimum_activations_streaming
+        num_workers, start_method: see docstring of run_in_pool
+        batch_size ([int]): batch size within each worker
+
+    Returns:
+        [tuple of Tensors]: (indices, values), both of shape [C, nlargest]. See docstring
+            of get_maximimum_activations_streaming
+    """
+    node_name = next(iter(dcapture.resolve_nodes(model, [node])))
+    context = {
+        "model": _cpu_model(model),
+        "node_name": node_name,
+        "dataset": dataset,
+        "nlargest": nlargest,
+        "params": params,
+        "batch_size": batch_size,
+    }
+    shards = _split(len(dataset), num_workers or os.cpu_count())
+    results = run_in_pool(_max_activations_job, context, shards, num_workers, start_method)
+
+    indices = torch.cat([shard_indices for shard_indices, _ in results], dim=1)
+    values = torch.cat([shard_values for _, shard_values in results], dim=1)
+    return merge_topk(indices, values, nlargest)
+
+
+def _max_activations_job(context, shard):
+    start, end = shard
+    data_loader = DataLoader(Subset(context["dataset"], range(start, end)), batch_size=context["batch_size"])
+    indices, values = dactivations.get_maximimum_activations_streaming(context["model"],
+        context["node_name"], data_loader, context["nlargest"], context["params"])
+    return indices + start, values
+
+
+def merge_topk(indices, values, nlargest):
+    """ Deterministic top-k of each row of values: ties are broken by smaller index
+
+    Args:
+        indices ([Tensor]): shape [C, N]
+        values ([Tensor]): shape [C, N]
+    """
+    indices, order = torch.sort(indices, dim=1)
+    values = torch.gather(values, 1, order)
+    values, order = torch.sort(values, dim=1, descending=True, stable=True)
+    indices = torch.gather(indices, 1, order)
+    return indices[:, :nlargest], values[:, :nlargest]
+
+
+# ----------------------------- Superstimuli -----------------------------
+
+@dprofiling.profile
+def parallel_image_superstimuli(model, node, channel_indices, initial_input,
+        num_workers=None, seed=0, start_method=None, **kwargs):
+    """ Superstimuli of many channels of a layer, sharded by channel between workers.
+        Every worker runs get_image_superstimuli_batched on its channels.
+
+    Args:
+        model ([nn.Module]): model, in eval mode
+        node ([str or nn.Module]): name or submodule of model whose channels are maximized
+        channel_indices ([list of int]): channels to get superstimuli of
+        initial_input ([Tensor]): shape [1, C, H, W] or [len(channel_indices), C, H, W]
+        num_workers, start_method: see docstring of run_in_pool
+        seed ([int]): seed of the random transforms. Every channel is optimized on its own
+            (with its own random transforms and early stopping), seeded with seed + its position
+            in channel_indices, so results don't depend on num_workers.
+        kwargs: passed to get_image_superstimuli_batched (num_iterations, parameterization, ...),
+            except batch_size
+
+    Returns:
+        [Tensor]: superstimuli of shape [len(channel_indices), C, H, W]
+    """
+    channel_indices = list(channel_indices)
+    node_name = next(iter(dcapture.resolve_nodes(model, [node])))
+    initial_input = initial_input.detach().cpu().expand(len(channel_indices), -1, -1, -1)
+    kwargs.pop("batch_size", None)
+    context = {
+        "model": _cpu_model(model),
+        "node_name": node_name,
+        "channel_indices": channel_indices,
+        "initial_input": initial_input,
+        "seed": seed,
+        "kwargs": kwargs,
+    }
+    shards = _split(len(channel_indices), num_workers or os.cpu_count())
+    results = run_in_pool(_superstimuli_job, context, shards, num_workers, start_method)
+    return torch.cat(results, dim=0)
+
+
+def _superstimuli_job(context, shard):
+    start, end = shard
+    model = context["model"]
+    node = dcapture.resolve_nodes(model, [context["node_name"]])[context["node_name"]]
+    outputs = {}
+    # not detached (unlike ActivationCapture), gradients flow through the output
+    handle = node.register_forward_hook(lambda module, input, output: outputs.update(output=output))
+
+    def forward_func(x):
+        model(x)
+        return outputs.pop("output")
+
+    try:
+        superstimuli = []
+        for channel_position in range(start, end):
+            torch.manual_seed(context["seed"] + channel_position)
+            random.seed(context["seed"] + channel_position)
+            superstimuli.append(dactivations.get_image_superstimuli_batched(forward_func,
+                context["channel_indices"][channel_position:channel_position + 1],
+                context["initial_input"][channel_position:channel_position + 1], **context["kwargs"]))
+        return torch.cat(superstimuli, dim=0)
+    finally:
+        handle.remove()
+
+
+# ----------------------------- Conv dissections -----------------------------
+
+@dprofiling.profile
+def parallel_conv_dissections(input_to_conv, node, outer_indices=None, outer_chunk_size=None,
+        num_workers=None, start_method=None):
+    """ get_conv_dissection for many outer indices of a conv node, sharded by outer index
+
+    Args:
+        input_to_conv ([Tensor]): expected shape [B, C, H, W] (see get_conv_dissection for other nodes)
+        node ([nn.Conv2d, nn.Conv1d, nn.Conv3d or nn.Linear]): conv (or linear) node
+        outer_indices ([list of int]): (optional) default is all outer indices of node
+        outer_chunk_size ([int]): (optional) how many outer indices of its shard a worker decomposes
+            at once, see dlight.dissect.contributions.get_contributions
+        num_workers, start_method: see docstring of run_in_pool
+
+    Returns:
+        [list of tuples]: for every outer index (in order) the tuple
+            (input_to_conv, weights, bias, intermediate_activations, activation)
+            as returned by get_conv_dissection
+    """
+    if outer_indices is None:
+        outer_indices = list(range(node.weight.shape[0]))
+    outer_indices = list(outer_indices)
+    input_to_conv = input_to_conv.detach().cpu()
+    node = _cpu_model(node)
+    context = {
+        "input_to_conv": input_to_conv,
+        "node": node,
+        "outer_indices": outer_indices,
+        "outer_chunk_size": outer_chunk_size,
+    }
+    shards = _split(len(outer_indices), num_workers or os.cpu_count())
+    results = run_in_pool(_conv_dissection_job, context, shards, num_workers, start_method)
+
+    # Workers don't send the group inputs back, every group input is built once here
+    dissections = []
+    group_inputs = {}
+    merged = [dissection for shard_dissections in results for dissection in shard_dissections]
+    for outer_idx, dissection in zip(outer_indices, merged):
+        group_idx = dconv.get_group_index(node, outer_idx)
+        if group_idx not in group_inputs:
+            group_inputs[group_idx] = dconv.get_group_input(input_to_conv, node, group_idx)
+        dissections.append((group_inputs[group_idx],) + tuple(dissection))
+    return dissections
+
+
+def _conv_dissection_job(context, shard):
+    start, end = shard
+    dissections = dconv.get_conv_dissections(context["input_to_conv"], context["node"],
+        context["outer_indices"][start:end], context["outer_chunk_size"])
+    return [dissection[1:] for dissection in dissections]
@@ -0,0 +1,170 @@
+import math
+import random
+import torch
+import torch.nn.functional as F
+
+
+# Image parameterizations and random transforms for superstimuli.
+# Optimizing in a decorrelated space (Fourier spectrum, decorrelated colors)
+# instead of raw pixels needs far fewer iterations for comparable images.
+# https://distill.pub/2017/feature-visualization/#preconditioning
+# https://github.com/tensorflow/lucid/blob/master/lucid/optvis/param/spatial.py
+# https://github.com/tensorflow/lucid/blob/master/lucid/optvis/param/color.py
+
+
+class PixelImage:
+    """ Optimize raw pixels (this is what get_image_superstimuli always did) """
+
+    def __init__(self, initial_input):
+        """
+        Args:
+            initial_input ([Tensor]): expected shape [B, C, H, W]
+        """
+        self.tensor = initial_input.detach().clone().requires_grad_(True)
+        self.detail = 1.0
+
+    def set_detail(self, fraction):
+        """ Only optimize a coarse version of the image, at fraction of the full resolution """
+        self.detail = fraction
+
+    def __call__(self):
+        if self.detail >= 1.0:
+            return self.tensor
+        image_size = self.tensor.shape[-2:]
+        coarse_size = [max(1, int(math.ceil(size * self.detail))) for size in image_size]
+        coarse = F.interpolate(self.tensor, size=coarse_size, mode="area")
+        return F.interpolate(coarse, size=image_size, mode="bilinear", align_corners=False)
+
+
+class FourierImage:
+    """ Optimize the (scaled) Fourier spectrum of the image. The spectrum is scaled by 1/frequency,
+        so that all frequencies are equally easy to change, which removes the high-frequency
+        noise that pixel optimization is prone to.
+        With decorrelate=True (only for 3-channel images) the colors are optimized in
+        a decorrelated color space as well.
+    """
+
+    # Square root of the color correlation matrix of ImageNet, from lucid
+    color_correlation_svd_sqrt = torch.tensor([[0.26, 0.09, 0.02],
+                                               [0.27, 0.00, -0.05],
+                                               [0.27, -0.09, 0.03]])
+
+    def __init__(self, initial_input, decorrelate=True):
+        """
+        Args:
+            initial_input ([Tensor]): expected shape [B, C, H, W].
+                The spectrum is initialized so that the image equals initial_input.
+            decorrelate ([bool]): optimize colors in a decorrelated space. Ignored unless C == 3
+        """
+        initial_input = initial_input.detach()
+        self.image_size = initial_input.shape[-2:]
+        self.decorrelate = decorrelate and initial_input.shape[1] == 3
+        height, width = self.image_size
+        device = initial_input.device
+
+        frequencies = torch.sqrt(torch.fft.fftfreq(height, device=device)[:, None] ** 2 +
+                                 torch.fft.rfftfreq(width, device=device)[None, :] ** 2)
+        self.frequencies = frequencies / torch.max(frequencies)
+        self.scale = 1.0 / torch.clamp(frequencies, min=1.0 / max(height, width))
+        self.mask = torch.ones_like(self.scale)
+
+        color_correlation = self.color_correlation_svd_sqrt.to(device)
+        max_norm = torch.max(torch.norm(color_correlation, dim=0))
+        self.color_correlation = color_correlation / max_norm
+
+        image = initial_input.float()
+        if self.decorrelate:
+            image = self._mix_colors(image, torch.inverse(self.color_correlation))
+        spectrum = torch.fft.rfft2(image, norm="ortho") / self.scale
+        self.tensor = torch.view_as_real(spectrum).clone().to(initial_input.dtype).requires_grad_(True)
+
+    def set_detail(self, fraction):
+        """ Only optimize frequencies up to fraction of the max frequency """
+        self.mask = (self.frequencies <= fraction).to(self.scale.dtype)
+
+    def __call__(self):
+        spectrum = torch.view_as_complex(self.tensor.float()) * (self.scale * self.mask)
+        image = torch.fft.irfft2(spectrum, s=self.image_size, norm="ortho")
+        if self.decorrelate:
+            image = self._mix_colors(image, self.color_correlation)
+        return image.to(self.tensor.dtype)
+
+    @staticmethod
+    def _mix_colors(image, matrix):
+        return torch.einsum("ij,bjhw->bihw", matrix, image)
+
+
+parameterizations = {
+    "pixel": PixelImage,
+    "fourier": lambda initial_input: FourierImage(initial_input, decorrelate=False),
+    "fourier_decorrelated": FourierImage,
+}
+
+
+def get_parameterization(parameterization, initial_input):
+    """ Create the image parameterization that starts at initial_input
+
+    Args:
+        parameterization ([str or func]): one of the keys of parameterizations,
+            or a function that takes initial_input and returns an object with
+            - tensor: the leaf Tensor to optimize
+            - __call__(): renders the image [B, C, H, W]
+            - set_detail(fraction): (only needed with a resolution schedule)
+        initial_input ([Tensor]): expected shape [B, C, H, W]
+    """
+    if callable(parameterization):
+        return parameterization(initial_input)
+    if parameterization not in parameterizations:
+        raise ValueError("parameterization must be one of " + str(list(parameterizations.keys())) +
+            ". Instead got: " + str(parameterization))
+    return parameterizations[parameterization](initial_input)
+
+
+def get_detail(resolution_schedule, iteration, num_iterations):
+    """ Detail (fraction of the full resolution) for the given iteration.
+
+    Args:
+        resolution_schedule ([list of float]): coarse-to-fine fractions of the full resolution,
+            e.g. [0.25, 0.5, 1.0]. Iterations are split evenly between them.
+    """
+    stage = min(len(resolution_schedule) - 1, iteration * len(resolution_schedule) // num_iterations)
+    return resolution_schedule[stage]
+
+
+def jitter(max_pixels):
+    """ Randomly shift the image by up to max_pixels in each direction (wrapping around) """
+    def transform(image):
+        dy = random.randint(-max_pixels, max_pixels)
+        dx = random.randint(-max_pixels, max_pixels)
+        return torch.roll(image, shifts=(dy, dx), dims=(-2, -1))
+    return transform
+
+
+def random_scale(scales):
+    """ Randomly zoom the image by one of scales, keeping its size """
+    def transform(image):
+        scale = random.choice(scales)
+        theta = torch.tensor([[1.0 / scale, 0.0, 0.0], [0.0, 1.0 / scale, 0.0]],
+            dtype=image.dtype, device=image.device)
+        grid = F.affine_grid(theta.expand(image.shape[0], 2, 3), list(image.shape), align_corners=False)
+        return F.grid_sample(image, grid, mode="bilinear", padding_mode="reflection", align_corners=False)
+    return transform
+
+
+def compose(transforms):
+    """ Apply transforms one after another """
+    def transform(image):
+        for t in transforms:
+            image = t(image)
+        return image
+    return transform
+
+
+def standard_transforms(image_size):
+    """ Jitter and scale transforms that work well for images of image_size (height or width) """
+    max_jitter = max(1, image_size // 28)
+    return compose([
+        jitter(max_jitter),
+        random_scale([1.0 + (i - 5) / 50.0 for i in range(11)]),
+        jitter(max(1, max_jitter // 2)),
+    ])
@@ -1,14 +1,25 @@
-import os
 import os.path as osp
 from random import randrange
-import uuid
-import imageio
 import math
+import numpy as np
 import torch
-from sklearn.manifold import TSNE
-from sklearn.decomposition import PCA
-# from umap import UMAP
-import dlight.utils.showing as showing
+import dlight.dissect.store as dstore
+import dlight.utils.cache as dcache
+import dlight.utils.image as dimage
+import dlight.utils.profiling as dprofiling
+
+
+# Registry of projection backends.
+# Maps projection type to a function (embedding, n_components, **kwargs) -> embedding,
+# where embedding is a numpy array or a Tensor of shape [B, C]
+projection_backends = {}
+
+def register_projection(projection_type):
+    """ Decorator that registers a projection backend under projection_type """
+    def register(backend):
+        projection_backends[projection_type] = backend
+        return backend
+    return register
 
 
 # (From sklearn.manifold.TSNE documentation):
@@ -23,20 +34,37 @@ import dlight.utils.showing as showing
 # https://umap-learn.readthedocs.io/en/latest/parameters.html
 # https://towardsdatascience.com/a-one-stop-shop-for-principal-component-analysis-5582fb7e0a9c
 # https://arxiv.org/pdf/1802.03426.pdf
-def project_fc_activations(inputs, activations, projections_pipe):
+@dprofiling.profile
+def project_fc_activations(inputs, activations, projections_pipe, max_texture_size=4096, use_cache=True,
+        lod=False, lod_texture_size=1024):
     """ Visualize the embedding of the inputs.
         Activations are treated as embeddings.
 
     Args:
-        inputs ([Tensor]): RGBA images. Expected shape [B, 4, H, W]
-        activations ([Tensor]): Embdeding to use for visualization. Expected shape [B, C]
+        inputs ([Tensor or StoredActivations]): RGBA images. Expected shape [B, 4, H, W]
+        activations ([Tensor or StoredActivations]): Embdeding to use for visualization. Expected shape [B, C]
         projections_pipe ([list of dicts]): Pipe of projections: output of one projection
             will be the input to the following projection.
             Each dict should contain the following:
             {
-                "type" (str): type of projection (one of [t-sne, pca, umap]),
+                "type" (str): type of projection (one of the keys of projection_backends:
+                    pca, randomized-pca, incremental-pca, torch-pca, t-sne, fft-tsne, umap),
                 "n_components" (int): dimensionality of the projection
+                Any other item is passed to the backend as a keyword argument,
+                e.g. {"type": "t-sne", "n_components": 3, "perplexity": 50}
             }
+        max_texture_size ([int]): max height and width (in pixels) of a single page of the atlas.
+            Sprites are split between as many pages as needed. WebGL implementations
+            typically support 4096 or more, see gl.MAX_TEXTURE_SIZE.
+        use_cache ([bool]): reuse embeddings of earlier calls with the same activations and
+            the same leading stages of projections_pipe (see run_projections_pipe).
+            Atlases are always content-addressed, so identical atlases are written once.
+        lod ([bool]): level-of-detail mode for large embeddings (see write_lod_atlas).
+            The viewer shows density points when zoomed out and loads the sprites (and downsampled
+            sprites) only of the regions close to the camera, so that the notebook payload
+            and the GPU memory stay bounded.
+        lod_texture_size ([int]): max height and width (in pixels) of a page in lod mode.
+            Every page holds the sprites of one region of the embedding.
     """
     assert len(inputs.shape) == 4 and inputs.shape[1] == 4, \
         "inputs must be RGBA -> shape= [B, 4, H, W]. Instead got: " + str(inputs.shape)
@@ -44,86 +72,363 @@ def project_fc_activations(inputs, activations, projections_pipe):
         "Only outputs of fully connected nodes (of shape [B, C]) are supported in this function"
     assert inputs.shape[0] == activations.shape[0]
 
-    inputs = inputs.detach().cpu()
-    activations = activations.detach().cpu()
+    # inputs are read page by page (or leaf by leaf) while writing the atlas
+    # activations stay on their device, so that torch-pca can run there
+    activations = dstore.as_tensor(activations).detach()
 
     num_images = inputs.shape[0]
     image_height = inputs.shape[2]
     image_width = inputs.shape[3]  
     
-    # Build the atlas grid
-    atlas_number_of_cols = int(math.ceil(math.sqrt(num_images)))
-    atlas_number_of_rows = atlas_number_of_cols
-
-    atlas = torch.zeros((4, image_height * atlas_number_of_rows, image_width * atlas_number_of_cols))
-    for y in range(atlas_number_of_rows):
-        for x in range(atlas_number_of_cols):
-            img_idx = y * atlas_number_of_cols + x
-            if img_idx < num_images:
-                img_RGBA = inputs[img_idx]
-                y_offset = y * image_height
-                x_offset = x * image_width
-                atlas[:, y_offset : y_offset + image_height, x_offset : x_offset + image_width] = img_RGBA
-
-    # We need to put the image in jupyter dir to access it from Javascript.
-    # See https://stackoverflow.com/a/49487396/13344574
-    jupyter_dir = osp.abspath("/usr/local/share/jupyter")
-    atlas_path = osp.join(
-        "nbextensions", "tmp", "atlas_" + str(uuid.uuid4()) + ".png")
-
-    atlas_dir = osp.dirname(osp.join(jupyter_dir, atlas_path))
-    if not osp.exists(atlas_dir):
-        os.makedirs(atlas_dir)
-    
-    atlas = (atlas * 255.0).byte() # convert to uint8
-    imageio.imwrite(osp.join(jupyter_dir, atlas_path), atlas.permute(1, 2, 0).numpy())
-    
-    embedding = activations.numpy()
-    print("Shape of initial embedding = ", embedding.shape)
-    for projection in projections_pipe:
-        projection_type = projection["type"]
-        projection_n_components = projection["n_components"]
-
-        if projection_n_components > embedding.shape[1]:
-            raise ValueError("n_components for " + projection_type + 
-                " has to be <= " + embedding.shape[1] + 
-                ", which is the dimensionality of the previous projection")
-        if projection_type == "t-sne":
-            tsne = TSNE(n_components=projection_n_components)
-            embedding = tsne.fit_transform(embedding)
-        elif projection_type == "pca":
-            pca = PCA(n_components=projection_n_components)
-            embedding = pca.fit_transform(embedding)
-        # elif projection_type == "umap":
-        #     umap = UMAP(n_components=projection_n_components, n_neighbors=25, min_dist=0.00001, metric='correlation')
-        #     embedding = umap.fit_transform(embedding)
-        else:
-            raise NotImplementedError("projection type = " + projection_type + " is not supported yet")
-        print("Shape after " + projection_type + " = " + str(embedding.shape))
+    embedding = run_projections_pipe(activations, projections_pipe, use_cache)
 
     # if final embedding dimension is 2D, add a fake third dimension (which is 0 for all)
     # so that it's compatible with the JS visualization library
     if embedding.shape[1] == 2:
-        embedding3d = torch.zeros((num_images, 3))
-        embedding3d[:, :2] = embedding
-        embedding = embedding3d
+        embedding = np.concatenate([embedding, np.zeros((num_images, 1), dtype=embedding.dtype)], axis=1)
     
     # Some calibration. This was calibrated for MNIST.
     # Might need to be adjusted for other datasets.
     random_embedding = embedding[randrange(num_images)]
-    distance_from_origin = torch.norm(torch.from_numpy(random_embedding)).item()
+    distance_from_origin = float(np.linalg.norm(random_embedding))
     sprite_size_in_3D = {'height': distance_from_origin / 5.0, "width": distance_from_origin / 5.0}
     initial_camera_z = 3.0 * distance_from_origin
 
-    embedding = embedding.tolist()
-
-    showing.visualize_sprites(
-        embedding,
-        {
-            "path": atlas_path,
-            "shape": {"rows": atlas_number_of_rows, "cols": atlas_number_of_cols},
+    if lod:
+        atlas = write_lod_atlas(inputs, embedding, lod_texture_size)
+    else:
+        page_paths, page_rows, page_cols = write_atlas_pages(inputs, max_texture_size)
+        atlas = {
+            "pages": page_paths,
+            "shape": {"rows": page_rows, "cols": page_cols},
             "num_sprites": num_images,
             "sprite_size": {"height": image_height, "width": image_width}
-        },
-        sprite_size_in_3D,
-        initial_camera_z)
\ No newline at end of file
+        }
+
+    import dlight.utils.showing as showing
+    showing.visualize_sprites(embedding, atlas, sprite_size_in_3D, initial_camera_z, lod=lod)
+
+
+@dprofiling.profile
+def run_projections_pipe(activations, projections_pipe, use_cache=False):
+    """ Project activations through projections_pipe (see docstring of project_fc_activations)
+
+    Args:
+        activations ([Tensor or numpy array]): expected shape [B, C]
+        use_cache ([bool]): cache the output of every stage on disk (see dlight.utils.cache.embedding_cache),
+            keyed by a hash of the activations and the config of the stage and all stages before it.
+            Re-running the same pipe, or changing only its last stages, reuses the earlier stages.
+
+    Returns:
+        [numpy array]: final embedding of shape [B, n_components of last projection]
+    """
+    embedding = activations
+    print("Shape of initial embedding = ", tuple(embedding.shape))
+    cache_key = dcache.hash_key(activations) if use_cache else None
+    for projection in projections_pipe:
+        projection_type = projection["type"]
+        projection_n_components = projection["n_components"]
+        projection_kwargs = {k: v for k, v in projection.items() if k not in ("type", "n_components")}
+
+        if projection_n_components > embedding.shape[1]:
+            raise ValueError("n_components for " + projection_type + 
+                " has to be <= " + str(embedding.shape[1]) + 
+                ", which is the dimensionality of the previous projection")
+        if projection_type not in projection_backends:
+            raise NotImplementedError("projection type = " + projection_type + " is not supported yet")
+
+        if use_cache:
+            try:
+                cache_key = dcache.hash_key(cache_key, projection)
+            except TypeError as e:
+                print("Not caching " + projection_type + " and later projections: " + str(e))
+                use_cache = False
+
+        # The span of a stage records its duration, the input shape and whether it was cached
+        with dprofiling.span("projection " + projection_type, shape=list(embedding.shape)) as s:
+            cached_embedding = dcache.embedding_cache.load_numpy(cache_key) if use_cache else None
+            s.args["cached"] = cached_embedding is not None
+            if cached_embedding is not None:
+                embedding = cached_embedding
+            else:
+                embedding = projection_backends[projection_type](embedding, projection_n_components, **projection_kwargs)
+                if use_cache:
+                    dcache.embedding_cache.save_numpy(cache_key, _to_numpy(embedding))
+        print("Shape after " + projection_type + " = " + str(tuple(embedding.shape)))
+
+    return _to_numpy(embedding)
+
+
+def _to_numpy(embedding):
+    if isinstance(embedding, torch.Tensor):
+        return embedding.detach().cpu().float().numpy()
+    return embedding
+
+
+@register_projection("pca")
+def _project_pca(embedding, n_components, **kwargs):
+    from sklearn.decomposition import PCA
+    return PCA(n_components=n_components, **kwargs).fit_transform(_to_numpy(embedding))
+
+
+@register_projection("randomized-pca")
+def _project_randomized_pca(embedding, n_components, **kwargs):
+    from sklearn.decomposition import PCA
+    # Much faster than the full SVD when n_components << min(B, C)
+    return PCA(n_components=n_components, svd_solver="randomized", **kwargs).fit_transform(_to_numpy(embedding))
+
+
+@register_projection("incremental-pca")
+def _project_incremental_pca(embedding, n_components, batch_size=4096, **kwargs):
+    from sklearn.decomposition import IncrementalPCA
+    # Fits batch by batch, so memory is bounded by batch_size for large B
+    embedding = _to_numpy(embedding)
+    pca = IncrementalPCA(n_components=n_components, batch_size=max(batch_size, n_components), **kwargs)
+    return pca.fit_transform(embedding)
+
+
+@register_projection("torch-pca")
+def _project_torch_pca(embedding, n_components, niter=4, **kwargs):
+    # Randomized PCA on the device of the embedding (e.g. GPU). Stays a Tensor.
+    # https://pytorch.org/docs/stable/generated/torch.pca_lowrank.html
+    embedding = torch.as_tensor(embedding).float()
+    embedding = embedding - torch.mean(embedding, dim=0, keepdim=True)
+    _, _, v = torch.pca_lowrank(embedding, q=n_components, center=False, niter=niter, **kwargs)
+    return embedding @ v[:, :n_components]
+
+
+@register_projection("t-sne")
+def _project_tsne(embedding, n_components, n_jobs=-1, **kwargs):
+    from sklearn.manifold import TSNE
+    # Barnes-Hut t-SNE (sklearn default for n_components < 4), on all cores by default
+    tsne = TSNE(n_components=n_components, n_jobs=n_jobs, **kwargs)
+    return tsne.fit_transform(_to_numpy(embedding))
+
+
+@register_projection("fft-tsne")
+def _project_fft_tsne(embedding, n_components, n_jobs=-1, **kwargs):
+    # FFT-accelerated interpolation-based t-SNE, much faster than Barnes-Hut for large B.
+    # Optional dependency: pip install openTSNE. Supports n_components <= 2 only.
+    # https://opentsne.readthedocs.io/
+    try:
+        from openTSNE import TSNE as OpenTSNE
+    except ImportError:
+        raise ImportError("fft-tsne projection requires openTSNE (pip install openTSNE)")
+    tsne = OpenTSNE(n_components=n_components, negative_gradient_method="fft", n_jobs=n_jobs, **kwargs)
+    return np.asarray(tsne.fit(_to_numpy(embedding)))
+
+
+@register_projection("umap")
+def _project_umap(embedding, n_components, n_neighbors=25, min_dist=0.00001, metric="correlation", **kwargs):
+    # Optional dependency: pip install umap-learn
+    try:
+        from umap import UMAP
+    except ImportError:
+        raise ImportError("umap projection requires umap-learn (pip install umap-learn)")
+    umap = UMAP(n_components=n_components, n_neighbors=n_neighbors, min_dist=min_dist, metric=metric, **kwargs)
+    return umap.fit_transform(_to_numpy(embedding))
+
+
+@dprofiling.profile
+def write_atlas_pages(inputs, max_texture_size=4096):
+    """ Write the atlas pages of inputs (see build_atlas_pages) as PNGs into
+        dlight.utils.cache.atlas_cache, unless the same atlas is already there.
+
+    Returns:
+        [tuple]: (page_paths, rows, cols), where page_paths are relative to the jupyter dir
+    """
+    num_pages, rows, cols = _get_atlas_grid(inputs.shape, max_texture_size)
+    with dprofiling.span("hash"):
+        key = dcache.hash_key(inputs, max_texture_size)
+    suffixes = ["_" + str(page_idx) + ".png" for page_idx in range(num_pages)]
+
+    if not dcache.atlas_cache.contains(key, suffixes):
+        import imageio
+        with dprofiling.span("png encode") as s:
+            for page, suffix in zip(iter_atlas_pages(inputs, max_texture_size), suffixes):
+                dcache.atlas_cache.write(key, suffix, lambda path: imageio.imwrite(path, page.numpy(), format="png"))
+                s.add_bytes(osp.getsize(dcache.atlas_cache.path(key, suffix)))
+
+    page_paths = [osp.relpath(dcache.atlas_cache.path(key, suffix), dcache.jupyter_dir) for suffix in suffixes]
+    return page_paths, rows, cols
+
+
+@dprofiling.profile
+def build_atlas_pages(inputs, max_texture_size=4096):
+    """ Tile images into pages of a sprite atlas, left to right first, then top to bottom,
+        then page by page. All pages have the same grid; the last one is padded with
+        transparent sprites.
+
+    Args:
+        inputs ([Tensor]): RGBA images with values in [0, 1]. Expected shape [B, 4, H, W]
+        max_texture_size ([int]): max height and width (in pixels) of a page
+
+    Returns:
+        [tuple]: (pages, rows, cols), where pages is a uint8 Tensor of shape
+            [num_pages, rows * H, cols * W, 4] and rows, cols is the grid of sprites in each page
+    """
+    num_pages, rows, cols = _get_atlas_grid(inputs.shape, max_texture_size)
+    return _tile_sprites(inputs, num_pages, rows, cols), rows, cols
+
+
+def iter_atlas_pages(inputs, max_texture_size=4096):
+    """ Yield the pages of build_atlas_pages one at a time, reading only the inputs of
+        the current page, so that StoredActivations are never read into memory as a whole.
+
+    Args:
+        inputs ([Tensor or StoredActivations]): see build_atlas_pages
+
+    Yields:
+        [Tensor]: uint8 page of shape [rows * H, cols * W, 4]
+    """
+    num_pages, rows, cols = _get_atlas_grid(inputs.shape, max_texture_size)
+    sprites_per_page = rows * cols
+    for page_idx in range(num_pages):
+        start = page_idx * sprites_per_page
+        sprites = inputs[start:start + sprites_per_page].detach().cpu().float()
+        yield _tile_sprites(sprites, 1, rows, cols)[0]
+
+
+@dprofiling.profile
+def build_spatial_index(embedding, leaf_size):
+    """ k-d tree over the points of embedding. A node is split along its widest dimension,
+        until it holds at most leaf_size points. Splits are close to the median, but
+        put a multiple of leaf_size points on the left, so that all leaves but one are full.
+
+    Args:
+        embedding ([numpy array]): shape [B, D]
+        leaf_size ([int]): max number of points in a leaf
+
+    Returns:
+        [tuple]: (order, leaves), where order is a permutation of range(B) that makes the
+            points of every leaf contiguous, and leaves is a list of (start, end) ranges of order,
+            one per leaf. Neighbouring leaves in the list are neighbours in space.
+    """
+    assert leaf_size >= 1
+    embedding = np.asarray(embedding)
+    order = np.arange(len(embedding))
+    leaves = []
+    nodes = [(0, len(order))] # stack of (start, end) ranges of order
+    while nodes:
+        start, end = nodes.pop()
+        if end - start <= leaf_size:
+            leaves.append((start, end))
+            continue
+        points = embedding[order[start:end]]
+        dim = int(np.argmax(points.max(axis=0) - points.min(axis=0)))
+        num_leaves = -(-(end - start) // leaf_size) # ceiling-divide
+        middle = leaf_size * -(-num_leaves // 2)
+        order[start:end] = order[start:end][np.argpartition(points[:, dim], middle)]
+        # left child is popped (and its leaves are listed) first
+        nodes.append((start + middle, end))
+        nodes.append((start, start + middle))
+    return order, leaves
+
+
+@dprofiling.profile
+def write_lod_atlas(inputs, embedding, max_texture_size=1024, mip_factor=4):
+    """ Write a level-of-detail atlas of inputs into dlight.utils.cache.atlas_cache, unless
+        the same atlas is already there. Sprites are grouped by the leaves of a k-d tree over
+        embedding (see build_spatial_index), and every leaf gets its own files, so that the
+        viewer can load the leaves close to the camera only:
+        an atlas page, the same page downsampled mip_factor times and the positions of its sprites.
+
+    Args:
+        inputs ([Tensor or StoredActivations]): RGBA images with values in [0, 1]. Expected shape [B, 4, H, W]
+        embedding ([numpy array]): shape [B, 3]
+        max_texture_size ([int]): max height and width (in pixels) of a page.
+            Smaller pages make more, smaller leaves.
+        mip_factor ([int]): how many times mip pages are smaller than pages (in each dimension)
+
+    Returns:
+        [dict]: {
+            "leaves": [{"bbox": [[min x, min y, min z], [max x, max y, max z]],
+                        "num_sprites": int, "page": path, "mip_page": path, "positions": path}],
+            "shape": {"rows": num_rows_in_page, "cols": num_cols_in_page},
+            "page_size": {"height": int, "width": int},
+            "mip_page_size": {"height": int, "width": int},
+            "num_sprites": B,
+            "sprite_size": {"height": H, "width": W}
+        }
+        Paths are relative to the jupyter dir. Sprites fill the pages of their leaves in order
+        (see build_atlas_pages) and positions are little-endian float32 of shape [num_sprites, 3].
+    """
+    num_images, _, image_height, image_width = inputs.shape
+    embedding = np.asarray(embedding, dtype="<f4")
+    assert embedding.shape == (num_images, 3), \
+        "embedding must have shape [B, 3]. Instead got: " + str(embedding.shape)
+
+    _, rows, cols = _get_atlas_grid(inputs.shape, max_texture_size)
+    order, leaves = build_spatial_index(embedding, rows * cols)
+    mip_size = max(1, max(image_height, image_width) // mip_factor)
+    mip_height, mip_width = dimage.downsample(torch.zeros(1, 1, image_height, image_width), mip_size).shape[-2:]
+
+    with dprofiling.span("hash"):
+        key = dcache.hash_key(inputs, embedding, max_texture_size, mip_factor)
+    suffixes = [["_leaf" + str(leaf_idx) + suffix for suffix in (".png", "_mip.png", ".bin")]
+        for leaf_idx in range(len(leaves))]
+
+    if not dcache.atlas_cache.contains(key, sum(suffixes, [])):
+        import imageio
+        with dprofiling.span("png encode") as s:
+            for (start, end), (page_suffix, mip_suffix, positions_suffix) in zip(leaves, suffixes):
+                index = torch.from_numpy(order[start:end])
+                sprites = inputs[index].detach().cpu().float()
+                page = _tile_sprites(sprites, 1, rows, cols)[0]
+                mip_page = _tile_sprites(dimage.downsample(sprites, mip_size), 1, rows, cols)[0]
+                dcache.atlas_cache.write(key, page_suffix, lambda path: imageio.imwrite(path, page.numpy(), format="png"))
+                dcache.atlas_cache.write(key, mip_suffix, lambda path: imageio.imwrite(path, mip_page.numpy(), format="png"))
+                dcache.atlas_cache.write(key, positions_suffix, lambda path: embedding[order[start:end]].tofile(path))
+                s.add_bytes(sum(osp.getsize(dcache.atlas_cache.path(key, suffix))
+                    for suffix in (page_suffix, mip_suffix, positions_suffix)))
+
+    def relpath(suffix):
+        return osp.relpath(dcache.atlas_cache.path(key, suffix), dcache.jupyter_dir)
+
+    lod_leaves = []
+    for (start, end), (page_suffix, mip_suffix, positions_suffix) in zip(leaves, suffixes):
+        points = embedding[order[start:end]]
+        lod_leaves.append({
+            "bbox": [points.min(axis=0).tolist(), points.max(axis=0).tolist()],
+            "num_sprites": end - start,
+            "page": relpath(page_suffix),
+            "mip_page": relpath(mip_suffix),
+            "positions": relpath(positions_suffix),
+        })
+    return {
+        "leaves": lod_leaves,
+        "shape": {"rows": rows, "cols": cols},
+        "page_size": {"height": rows * image_height, "width": cols * image_width},
+        "mip_page_size": {"height": rows * mip_height, "width": cols * mip_width},
+        "num_sprites": num_images,
+        "sprite_size": {"height": image_height, "width": image_width},
+    }
+
+
+def _tile_sprites(inputs, num_pages, rows, cols):
+    """ uint8 Tensor of shape [num_pages, rows * H, cols * W, C] with inputs [B, C, H, W]
+        (values in [0, 1]) tiled left to right first, then top to bottom, then page by page.
+        Sprites after the last input are transparent.
+    """
+    num_images, num_channels, image_height, image_width = inputs.shape
+    sprites = torch.zeros((num_pages * rows * cols, num_channels, image_height, image_width),
+        dtype=torch.uint8)
+    sprites[:num_images] = torch.clamp(inputs * 255.0, 0, 255).byte() # convert to uint8
+
+    pages = sprites.view(num_pages, rows, cols, num_channels, image_height, image_width)
+    pages = pages.permute(0, 1, 4, 2, 5, 3) # [num_pages, rows, H, cols, W, C]
+    return pages.reshape(num_pages, rows * image_height, cols * image_width, num_channels)
+
+
+def _get_atlas_grid(inputs_shape, max_texture_size):
+    """ Returns (num_pages, rows, cols) of the atlas of inputs of shape [B, C, H, W] """
+    num_images, _, image_height, image_width = inputs_shape
+    if image_height > max_texture_size or image_width > max_texture_size:
+        raise ValueError("images of size " + str((image_height, image_width)) +
+            " don't fit into a texture of max size " + str(max_texture_size))
+
+    # Square pages for small atlases, as big as allowed for the rest
+    cols = min(max_texture_size // image_width, int(math.ceil(math.sqrt(num_images))))
+    rows = min(max_texture_size // image_height, int(math.ceil(num_images / cols)))
+    num_pages = int(math.ceil(num_images / (rows * cols)))
+    return num_pages, rows, cols
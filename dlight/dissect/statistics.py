@@ -0,0 +1,303 @@
+import torch
+import dlight.dissect.capture as dcapture
+import dlight.utils.profiling as dprofiling
+
+
+class QuantileSketch:
+    """ Mergeable per-channel quantile sketch (a simplified KLL sketch,
+        https://arxiv.org/abs/1603.05346). Values are kept in levels of sorted buffers,
+        a value in level l stands for 2**l values. A level that grows to 2 * k values
+        is compacted: every other value (random offset) moves up one level.
+        Memory is O(C * k * log(n / k)) for n values per channel, and the rank error
+        is roughly 1 / k.
+        All channels receive the same number of values, so all channels are compacted together.
+    """
+
+    def __init__(self, num_channels, k=256, seed=0):
+        self.num_channels = num_channels
+        self.k = k
+        self.levels = [] # Tensors of shape [C, n_l]
+        self.generator = torch.Generator().manual_seed(seed)
+
+    def update(self, values):
+        """ Add values. A batch of 2 * k or more values is compacted before it is added:
+            it is sorted once (on its device) and halved until fewer than 2 * k values are
+            left, which go straight into their level, so that only O(C * k) values are
+            copied to the CPU and sorted again.
+
+        Args:
+            values ([Tensor]): shape [C, n]
+        """
+        values = torch.sort(values.detach().float(), dim=1)[0]
+        level = 0
+        while values.shape[1] >= 2 * self.k:
+            # Same as _compact: the last value of an odd number of values stays at its level
+            num_compacted = values.shape[1] - values.shape[1] % 2
+            offset = int(torch.randint(2, (1,), generator=self.generator))
+            if num_compacted < values.shape[1]:
+                self._add(level, values[:, num_compacted:].cpu())
+            values = values[:, offset:num_compacted:2] # a sorted subsample stays sorted
+            level += 1
+        self._add(level, values.cpu())
+        self._compact()
+
+    def merge(self, other):
+        """ Add the values summarized by another sketch of the same number of channels """
+        for level, values in enumerate(other.levels):
+            self._add(level, values)
+        self._compact()
+
+    def quantiles(self, qs):
+        """
+        Args:
+            qs ([list of float]): quantiles in [0, 1]
+
+        Returns:
+            [Tensor]: shape [C, len(qs)]
+        """
+        values = torch.cat(self.levels, dim=1)
+        weights = torch.cat([torch.full((values.shape[0], level_values.shape[1]), 2.0 ** level)
+            for level, level_values in enumerate(self.levels)], dim=1)
+        values, order = torch.sort(values, dim=1)
+        cumulative_weights = torch.cumsum(torch.gather(weights, 1, order), dim=1)
+        targets = torch.as_tensor(qs, dtype=torch.float32)[None, :] * cumulative_weights[:, -1:]
+        positions = torch.searchsorted(cumulative_weights.contiguous(), targets.contiguous())
+        positions = torch.clamp(positions, max=values.shape[1] - 1)
+        return torch.gather(values, 1, positions)
+
+    def _add(self, level, values):
+        while len(self.levels) <= level:
+            self.levels.append(torch.empty((self.num_channels, 0)))
+        self.levels[level] = torch.cat([self.levels[level], values], dim=1)
+
+    def _compact(self):
+        level = 0
+        while level < len(self.levels):
+            values = self.levels[level]
+            if values.shape[1] >= 2 * self.k:
+                values = torch.sort(values, dim=1)[0]
+                num_compacted = values.shape[1] - values.shape[1] % 2
+                offset = int(torch.randint(2, (1,), generator=self.generator))
+                self.levels[level] = values[:, num_compacted:]
+                self._add(level + 1, values[:, offset:num_compacted:2])
+            level += 1
+
+
+class ChannelStatistics:
+    """ Streaming per-channel statistics of activations: count, mean, variance
+        (Welford/Chan updates in float64), min, max, fraction of zeros (sparsity)
+        and quantiles. Memory is O(C) apart from the quantile sketch.
+        Statistics of different data shards (e.g. worker processes) can be merged.
+    """
+
+    def __init__(self, sketch_size=256, zero_threshold=0.0):
+        """
+        Args:
+            sketch_size ([int]): size of the quantile sketch buffers (k), see QuantileSketch
+            zero_threshold ([float]): values <= zero_threshold count as zeros, i.e. as
+                zero after ReLU. Works for activations before and after ReLU.
+        """
+        self.sketch_size = sketch_size
+        self.zero_threshold = zero_threshold
+        self.num_channels = None
+        self.count = 0
+
+    def update(self, activations):
+        """
+        Args:
+            activations ([Tensor]): shape [B, C, H, W] (all B * H * W values of a channel
+                are accumulated) or [B, C]
+        """
+        activations = activations.detach()
+        values = activations.transpose(0, 1).reshape(activations.shape[1], -1) # now shape is [C, n]
+        if self.num_channels is None:
+            self._init(values.shape[0])
+        elif values.shape[0] != self.num_channels:
+            raise ValueError("Expected " + str(self.num_channels) + " channels. Instead got: " + str(values.shape[0]))
+
+        values_double = values.double()
+        batch_count = values.shape[1]
+        batch_mean = torch.mean(values_double, dim=1).cpu()
+        batch_m2 = torch.sum((values_double - batch_mean.to(values.device)[:, None]) ** 2, dim=1).cpu()
+        self._merge_moments(batch_count, batch_mean, batch_m2)
+
+        self.min = torch.minimum(self.min, torch.min(values, dim=1)[0].double().cpu())
+        self.max = torch.maximum(self.max, torch.max(values, dim=1)[0].double().cpu())
+        self.zeros += torch.sum(values <= self.zero_threshold, dim=1).cpu()
+        self.sketch.update(values)
+
+    def merge(self, other):
+        """ Merge the statistics of another shard of the data into these """
+        if other.num_channels is None:
+            return self
+        if self.num_channels is None:
+            self._init(other.num_channels)
+        self._merge_moments(other.count, other._mean, other._m2)
+        self.min = torch.minimum(self.min, other.min)
+        self.max = torch.maximum(self.max, other.max)
+        self.zeros += other.zeros
+        self.sketch.merge(other.sketch)
+        return self
+
+    @property
+    def mean(self):
+        return self._mean.float()
+
+    @property
+    def variance(self):
+        return (self._m2 / max(self.count, 1)).float()
+
+    @property
+    def std(self):
+        return torch.sqrt(self.variance)
+
+    @property
+    def sparsity(self):
+        """ Fraction of values that are zero (after ReLU) """
+        return (self.zeros.double() / max(self.count, 1)).float()
+
+    def quantiles(self, qs=(0.01, 0.25, 0.5, 0.75, 0.99)):
+        """ Approximate quantiles, shape [C, len(qs)] """
+        return self.sketch.quantiles(list(qs))
+
+    def dead_channels(self, threshold=None):
+        """ Indices of channels that never exceeded threshold (default zero_threshold),
+            i.e. that are always zero after ReLU
+        """
+        if threshold is None:
+            threshold = self.zero_threshold
+        return torch.nonzero(self.max <= threshold).flatten().tolist()
+
+    def summary(self):
+        """ [dict]: all statistics, each a Tensor of shape [C] """
+        quantiles = self.quantiles((0.01, 0.5, 0.99))
+        return {
+            "mean": self.mean,
+            "std": self.std,
+            "min": self.min.float(),
+            "max": self.max.float(),
+            "sparsity": self.sparsity,
+            "p01": quantiles[:, 0],
+            "median": quantiles[:, 1],
+            "p99": quantiles[:, 2],
+        }
+
+    def _init(self, num_channels):
+        self.num_channels = num_channels
+        self._mean = torch.zeros(num_channels, dtype=torch.float64)
+        self._m2 = torch.zeros(num_channels, dtype=torch.float64)
+        self.min = torch.full((num_channels,), float("inf"), dtype=torch.float64)
+        self.max = torch.full((num_channels,), float("-inf"), dtype=torch.float64)
+        self.zeros = torch.zeros(num_channels, dtype=torch.int64)
+        self.sketch = QuantileSketch(num_channels, self.sketch_size)
+
+    def _merge_moments(self, count, mean, m2):
+        # Parallel variance algorithm of Chan et al.
+        # https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Parallel_algorithm
+        total = self.count + count
+        if total == 0:
+            return
+        delta = mean - self._mean
+        self._mean = self._mean + delta * (count / total)
+        self._m2 = self._m2 + m2 + delta ** 2 * (self.count * count / total)
+        self.count = total
+
+
+class StatisticsCollector:
+    """ Accumulate ChannelStatistics of the outputs of nodes of a model with forward hooks,
+        batch by batch, while the model runs.
+
+        Usage:
+            with StatisticsCollector(model, ["conv1", "conv2"]) as collector:
+                for x, _ in data_loader:
+                    model(x)
+            collector.statistics["conv2"].dead_channels()
+    """
+
+    def __init__(self, model, nodes, **kwargs):
+        """
+        Args:
+            model ([nn.Module]): model to collect statistics of
+            nodes ([list of str or nn.Module]): see dlight.dissect.capture.ActivationCapture
+            kwargs: passed to ChannelStatistics (sketch_size, zero_threshold)
+        """
+        self.nodes = dcapture.resolve_nodes(model, nodes)
+        self.statistics = {name: ChannelStatistics(**kwargs) for name in self.nodes}
+        self._handles = []
+
+    def __enter__(self):
+        self.attach()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.detach()
+
+    def attach(self):
+        self.detach()
+        for name, node in self.nodes.items():
+            statistics = self.statistics[name]
+            self._handles.append(node.register_forward_hook(
+                lambda module, input, output, statistics=statistics: statistics.update(output)))
+
+    def detach(self):
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+    def merge(self, other):
+        """ Merge statistics collected by another collector (e.g. in another process) """
+        for name, statistics in other.statistics.items():
+            self.statistics.setdefault(name, ChannelStatistics(statistics.sketch_size, statistics.zero_threshold))
+            self.statistics[name].merge(statistics)
+        return self
+
+
+@dprofiling.profile
+def collect_statistics(model, data_loader, nodes, **kwargs):
+    """ Run the model over data_loader and collect per-channel statistics of nodes
+
+    Args:
+        model ([nn.Module]): model to run
+        data_loader ([DataLoader]): each batch is either a Tensor or a tuple/list
+            whose first item is the input Tensor
+        nodes ([list of str or nn.Module]): see dlight.dissect.capture.ActivationCapture
+        kwargs: passed to ChannelStatistics (sketch_size, zero_threshold)
+
+    Returns:
+        [dict]: mapping from node name to ChannelStatistics
+    """
+    device = dcapture.get_device(model)
+    with StatisticsCollector(model, nodes, **kwargs) as collector:
+        with torch.no_grad():
+            for batch in data_loader:
+                if isinstance(batch, (tuple, list)):
+                    batch = batch[0]
+                model(batch.to(device))
+    return collector.statistics
+
+
+@dprofiling.profile
+def show_channel_statistics(statistics, figsize=(20, 8), clf=True):
+    """ Plot mean +- std, [p01, p99] range and sparsity of every channel
+
+    Args:
+        statistics ([ChannelStatistics]): statistics of a layer
+    """
+    import matplotlib.pyplot as plt
+
+    summary = statistics.summary()
+    channels = torch.arange(statistics.num_channels)
+
+    if clf:
+        plt.clf()
+    f, (a0, a1) = plt.subplots(2, 1, figsize=figsize, dpi=80, sharex=True)
+    a0.fill_between(channels, summary["p01"], summary["p99"], alpha=0.2, step="mid", label="p01 - p99")
+    a0.errorbar(channels, summary["mean"], yerr=summary["std"], fmt="o", label="mean +- std")
+    a0.legend()
+    a1.bar(channels, summary["sparsity"])
+    a1.set_ylabel("sparsity")
+    a1.set_xlabel("channel")
+    dead_channels = statistics.dead_channels()
+    if dead_channels:
+        a1.set_title("dead channels: " + str(dead_channels))
+    f.tight_layout()
@@ -0,0 +1,237 @@
+import json
+import os
+import os.path as osp
+import numpy as np
+import torch
+import dlight.dissect.capture as dcapture
+import dlight.utils.profiling as dprofiling
+
+
+# Functions that need all samples at once (e.g. get_contributions) read StoredActivations
+# into memory only up to this size. Larger activations have to be sliced first,
+# e.g. store["layer4"][:1024]. None disables the check.
+max_in_memory_bytes = 2 * 1024 ** 3
+
+
+class ActivationStore:
+    """ Per-layer activations on disk, in chunked shards of memory-mapped .npy files,
+        so that activations of full datasets don't have to fit in RAM.
+
+        Usage:
+            store = ActivationStore("/data/activations/resnet50")
+            write_activations(store, model, data_loader, ["layer3", "layer4"])
+            store["layer4"] # StoredActivations, can be passed to dlight.dissect functions
+            store["layer4"][:64, 10] # Tensor of shape [64, H, W]
+
+        Directory layout:
+            index.json: {layer_name: {"sample_shape", "dtype", "num_samples", "shard_size"}}
+            <layer_name>/shard_<i>.npy: activations of samples [i * shard_size, (i + 1) * shard_size)
+    """
+
+    def __init__(self, directory, shard_size=4096):
+        """
+        Args:
+            directory ([str]): directory of the store. An existing store is opened.
+            shard_size ([int]): number of samples per shard file, for new layers
+        """
+        self.directory = directory
+        self.shard_size = shard_size
+        self._index_path = osp.join(directory, "index.json")
+        self._index = {}
+        if osp.exists(self._index_path):
+            with open(self._index_path) as f:
+                self._index = json.load(f)
+
+    @property
+    def layers(self):
+        return list(self._index.keys())
+
+    def __contains__(self, layer_name):
+        return layer_name in self._index
+
+    def __getitem__(self, layer_name):
+        if layer_name not in self._index:
+            raise KeyError("No activations stored for layer " + str(layer_name))
+        return StoredActivations(self, layer_name)
+
+    def append(self, layer_name, activations):
+        """ Append a batch of activations of layer_name to the store
+
+        Args:
+            activations ([Tensor]): expected shape [B, ...]. All batches of a layer
+                must have the same shape apart from B. bfloat16 is stored as float32.
+        """
+        activations = activations.detach().cpu()
+        if activations.dtype == torch.bfloat16:
+            activations = activations.float()
+        activations = activations.numpy()
+
+        if layer_name not in self._index:
+            self._index[layer_name] = {
+                "sample_shape": list(activations.shape[1:]),
+                "dtype": activations.dtype.str,
+                "num_samples": 0,
+                "shard_size": self.shard_size,
+            }
+            os.makedirs(osp.join(self.directory, layer_name), exist_ok=True)
+        layer = self._index[layer_name]
+        if list(activations.shape[1:]) != layer["sample_shape"]:
+            raise ValueError("Expected activations of shape [B, " + ", ".join(map(str, layer["sample_shape"])) +
+                "] for layer " + layer_name + ". Instead got: " + str(list(activations.shape)))
+
+        written = 0
+        while written < activations.shape[0]:
+            shard_idx, offset = divmod(layer["num_samples"], layer["shard_size"])
+            count = min(activations.shape[0] - written, layer["shard_size"] - offset)
+            shard = self._open_shard(layer_name, shard_idx, create=(offset == 0))
+            shard[offset:offset + count] = activations[written:written + count]
+            shard.flush()
+            del shard
+            written += count
+            layer["num_samples"] += count
+
+        self.flush()
+
+    def flush(self):
+        """ Write the index. Called automatically by append """
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self._index_path)
+
+    def _open_shard(self, layer_name, shard_idx, create=False):
+        layer = self._index[layer_name]
+        path = osp.join(self.directory, layer_name, "shard_" + str(shard_idx) + ".npy")
+        if create:
+            return np.lib.format.open_memmap(path, mode="w+", dtype=np.dtype(layer["dtype"]),
+                shape=tuple([layer["shard_size"]] + layer["sample_shape"]))
+        return np.load(path, mmap_mode="r+")
+
+
+class StoredActivations:
+    """ Lazy view of the activations of one layer in an ActivationStore.
+        Indexing reads only the requested samples (and channels) from disk and returns a Tensor.
+        Can be passed to the dlight.dissect functions in place of an activations Tensor.
+    """
+
+    def __init__(self, store, layer_name):
+        self.store = store
+        self.layer_name = layer_name
+        layer = store._index[layer_name]
+        self.num_samples = layer["num_samples"]
+        self.shard_size = layer["shard_size"]
+        self.shape = torch.Size([self.num_samples] + layer["sample_shape"])
+        self._shards = {}
+
+    def __len__(self):
+        return self.num_samples
+
+    @property
+    def nbytes(self):
+        """ [int]: size of all activations of the layer in memory """
+        return int(np.prod(self.shape)) * np.dtype(self.store._index[self.layer_name]["dtype"]).itemsize
+
+    def __getitem__(self, index):
+        """ index selects samples first, e.g. stored[10], stored[:64], stored[[3, 5]], stored[:64, 10] """
+        if not isinstance(index, tuple):
+            index = (index,)
+        sample_index, rest = index[0], index[1:]
+
+        if isinstance(sample_index, (int, np.integer)):
+            if sample_index < 0:
+                sample_index += self.num_samples
+            if not 0 <= sample_index < self.num_samples:
+                raise IndexError("sample index out of range")
+            shard_idx, offset = divmod(int(sample_index), self.shard_size)
+            return torch.from_numpy(np.array(self._shard(shard_idx)[(offset,) + rest]))
+
+        if isinstance(sample_index, slice):
+            sample_indices = np.arange(self.num_samples)[sample_index]
+        else:
+            if isinstance(sample_index, torch.Tensor):
+                sample_index = sample_index.cpu().numpy()
+            sample_indices = np.arange(self.num_samples)[np.asarray(sample_index)]
+
+        chunks = []
+        shard_indices = sample_indices // self.shard_size
+        # split into runs of consecutive samples of the same shard, which read contiguously from disk
+        run_starts = np.flatnonzero(np.diff(shard_indices, prepend=-1) != 0)
+        run_ends = np.append(run_starts[1:], len(sample_indices))
+        for run_start, run_end in zip(run_starts, run_ends):
+            shard_idx = shard_indices[run_start]
+            offsets = sample_indices[run_start:run_end] - shard_idx * self.shard_size
+            if np.all(np.diff(offsets) == 1):
+                offsets = slice(offsets[0], offsets[-1] + 1)
+            chunks.append(np.array(self._shard(shard_idx)[(offsets,) + rest]))
+
+        if len(chunks) == 0:
+            empty_shape = np.empty([0] + list(self.shape[1:]))[(slice(None),) + rest].shape
+            return torch.from_numpy(np.empty(empty_shape, dtype=np.dtype(self.store._index[self.layer_name]["dtype"])))
+        return torch.from_numpy(np.concatenate(chunks, axis=0))
+
+    def iter_chunks(self, chunk_size=None):
+        """ Yield (start, Tensor of samples [start, start + chunk_size)). Defaults to one shard per chunk """
+        if chunk_size is None:
+            chunk_size = self.shard_size
+        for start in range(0, self.num_samples, chunk_size):
+            yield start, self[start:start + chunk_size]
+
+    def to_tensor(self):
+        """ Read all activations into memory """
+        return self[:]
+
+    def _shard(self, shard_idx):
+        if shard_idx not in self._shards:
+            path = osp.join(self.store.directory, self.layer_name, "shard_" + str(shard_idx) + ".npy")
+            self._shards[shard_idx] = np.load(path, mmap_mode="r")
+        return self._shards[shard_idx]
+
+
+@dprofiling.profile
+def write_activations(store, model, data_loader, nodes, **kwargs):
+    """ Run the model over data_loader and append the outputs of nodes to the store, batch by batch.
+        Only one batch of activations is held in memory at a time.
+
+    Args:
+        store ([ActivationStore]): store to write to. Layers are named after the nodes.
+        model ([nn.Module]): model to run
+        data_loader ([DataLoader]): must not shuffle, so that positions in the store
+            are dataset indices. Each batch is either a Tensor or a tuple/list whose
+            first item is the input Tensor
+        nodes ([list of str or nn.Module]): see dlight.dissect.capture.ActivationCapture
+        kwargs: passed to ActivationCapture (dtype, reductions)
+    """
+    device = dcapture.get_device(model)
+    with dcapture.ActivationCapture(model, nodes, offload_to_cpu=True, **kwargs) as capture:
+        with torch.no_grad():
+            for batch in data_loader:
+                if isinstance(batch, (tuple, list)):
+                    batch = batch[0]
+                capture.clear()
+                model(batch.to(device))
+                for name, activations in capture.activations.items():
+                    store.append(name, activations)
+
+
+def as_tensor(activations):
+    """ Tensor of activations, reading StoredActivations into memory.
+        Raises ValueError if StoredActivations are larger than max_in_memory_bytes.
+    """
+    if isinstance(activations, StoredActivations):
+        if max_in_memory_bytes is not None and activations.nbytes > max_in_memory_bytes:
+            raise ValueError("Stored activations of layer " + activations.layer_name + " take " +
+                str(activations.nbytes) + " bytes, more than dlight.dissect.store.max_in_memory_bytes (" +
+                str(max_in_memory_bytes) + "). Pass a slice of them instead, e.g. store[" +
+                repr(activations.layer_name) + "][:1024], or raise the limit.")
+        return activations.to_tensor()
+    return activations
+
+
+def iter_chunks(activations, chunk_size):
+    """ Yield (start, Tensor) chunks of samples of a Tensor or StoredActivations """
+    if isinstance(activations, StoredActivations):
+        yield from activations.iter_chunks(chunk_size)
+    else:
+        for start in range(0, activations.shape[0], chunk_size):
+            yield start, activations[start:start + chunk_size]
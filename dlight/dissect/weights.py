@@ -1,7 +1,10 @@
+import torch
 import torch.nn as nn
-import torchvision
+import dlight.dissect.contributions as dcontributions
 import dlight.utils.image as dimage
+import dlight.utils.profiling as dprofiling
 
+@dprofiling.profile
 def show_weights(node, params, num_cols=16, figsize=(20, 20), clf=True):
     """ Show weights of the node.
 
@@ -9,31 +12,73 @@ def show_weights(node, params, num_cols=16, figsize=(20, 20), clf=True):
         node ([subclass of nn.Module]): For example, nn.Conv2d, nn.Linear
         params ([dict]): content of the dict depends on the type of node.
             See below for supported types.
-        if nn.Conv2d:
+        if nn.Conv1d, nn.Conv2d or nn.Conv3d:
             {
                 outer_idx (optional): ([int])
             }
+            Every kernel is shown as an image (see dlight.utils.image.as_images),
+            num_cols kernels per row.
+        if nn.Linear:
+            {
+                outer_idx (optional): ([int])
+            }
+            The weights of outer_idx are shown wrapped into rows of num_cols values,
+            all weights are shown as an image of shape [out_features, in_features].
+    """
+    grid, bias = get_weights_grid(node, params, num_cols)
+    dimage.show_torch(grid, figsize, clf)
+
+    if bias is not None:
+        print("bias:", bias)
+
+
+@dprofiling.profile
+def get_weights_grid(node, params, num_cols=16):
+    """ Grid of the weights of the node, as shown by show_weights.
+        See docstring of show_weights.
+
+    Returns:
+        [tuple]: (grid, bias), where grid is a Tensor of shape [C, H, W] with values
+            in [0, 1] and bias is a Tensor (or None if node has no bias)
     """
-    node = node.cpu()
-    if isinstance(node, nn.Conv2d):
-        _show_conv2d_weights(node, params, num_cols, figsize, clf)
+    if isinstance(node, tuple(dcontributions.conv_types.keys())):
+        return _get_conv_weights_grid(node, params, num_cols)
+    elif isinstance(node, nn.Linear):
+        return _get_linear_weights_grid(node, params, num_cols)
     else:
         raise NotImplementedError("Type " + node.__class__.__name__ + " is not supported yet")
 
 
-def _show_conv2d_weights(node, params, num_cols, figsize, clf):
+def _get_conv_weights_grid(node, params, num_cols):
+    import torchvision
+
     outer_idx = params.get("outer_idx", None)
 
-    w = node.weight.data
+    w = node.weight.detach().cpu() # the node itself stays on its device
     if outer_idx is not None:
         w = w[outer_idx:outer_idx + 1]
-    w = w.view(-1, 1, w.shape[-2], w.shape[-1])
+    w = dimage.as_images(w.flatten(0, 1).unsqueeze(1)) # now shape is [NUM_KERNELS, 1, H, W]
     
     grid = torchvision.utils.make_grid(w, nrow=num_cols)
-    dimage.show_torch(dimage.normalize(grid), figsize, clf)
+    return dimage.normalize(grid), _get_bias(node, outer_idx)
+
+
+def _get_linear_weights_grid(node, params, num_cols):
+    outer_idx = params.get("outer_idx", None)
+
+    w = node.weight.detach().cpu()
+    if outer_idx is not None:
+        num_rows = -(-w.shape[1] // num_cols) # ceiling-divide
+        row = torch.zeros(num_rows * num_cols, dtype=w.dtype)
+        row[:w.shape[1]] = w[outer_idx]
+        w = row.view(num_rows, num_cols)
+    return dimage.normalize(w.unsqueeze(0)), _get_bias(node, outer_idx)
+
 
+def _get_bias(node, outer_idx):
+    bias = None
     if node.bias is not None:
-        b = node.bias.data
+        bias = node.bias.detach().cpu()
         if outer_idx is not None:
-            b = b[outer_idx]
-        print("bias:", b)
\ No newline at end of file
+            bias = bias[outer_idx]
+    return bias
@@ -0,0 +1,354 @@
+import argparse
+import html
+import importlib
+import json
+import os
+import os.path as osp
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+import torch
+import torch.nn as nn
+import dlight.dissect.activations as dactivations
+import dlight.dissect.capture as dcapture
+import dlight.dissect.conv as dconv
+import dlight.dissect.projections as dprojections
+import dlight.dissect.store as dstore
+import dlight.dissect.weights as dweights
+import dlight.utils.css_style as css_style
+import dlight.utils.image as dimage
+
+
+# Headless counterpart of the show_ functions: dissections are written as static
+# files (PNG, HTML, JSON) into a directory, without Colab, IPython or a browser.
+# Used as a library (ReportWriter) or from the command line:
+#   python -m dlight.report --model examples.dlight.simple_convnet:SimpleConvnet \
+#       --checkpoint examples/dlight/simple_convnet.pt --inputs inputs.pt \
+#       --nodes conv1 conv2 fc4 --dissect conv2:3 --output reports/epoch_10
+
+dlight_dir = osp.dirname(osp.realpath(__file__))
+
+# Minimal stand-in for require.js, so that the define()d dlight JS modules run in a standalone page.
+# It has no define.amd, so the inlined d3 and THREE bundles register themselves as globals.
+require_shim = """
+var dlightModules = {};
+function define(name, deps, factory) {
+  dlightModules[name] = {deps: deps, factory: factory};
+}
+function dlightRequire(name) {
+  var module = dlightModules[name];
+  if (!module.hasOwnProperty("value")) {
+    module.value = module.factory.apply(null, module.deps.map(dlightRequire));
+  }
+  return module.value;
+}
+function require(deps, callback) {
+  callback.apply(null, deps.map(dlightRequire));
+}
+define("d3", [], function () { return window.d3; });
+define("THREE", [], function () { return window.THREE; });
+"""
+
+
+class ReportWriter:
+    """ Write dissections of a model into a directory, one section per call,
+        and an index.html that links all of them.
+
+        Usage:
+            report = ReportWriter("reports/epoch_10")
+            report.add_weights("conv1", model.conv1)
+            report.add_max_activations("conv2 channel 3", inputs, activations, 16, {"outer_idx": 3})
+            report.add_conv_dissection("conv2 channel 3", input_to_conv, model.conv2, 3)
+            report.write_index()
+    """
+
+    def __init__(self, directory, title="dlight report"):
+        """
+        Args:
+            directory ([str]): output directory, created if needed
+            title ([str]): title of index.html
+        """
+        self.directory = directory
+        self.title = title
+        self.sections = [] # dicts {"kind", "name", "files", "notes"}
+        os.makedirs(directory, exist_ok=True)
+
+    def add_weights(self, name, node, params=None, num_cols=16):
+        """ Weights grid as PNG. See docstring of dlight.dissect.weights.show_weights """
+        grid, bias = dweights.get_weights_grid(node, params or {}, num_cols)
+        path = self._file_name(name, "weights", ".png")
+        dimage.save_torch(grid, osp.join(self.directory, path))
+        notes = {}
+        if bias is not None:
+            notes["bias"] = bias.tolist()
+        return self._add_section("weights", name, [path], notes)
+
+    def add_activations(self, name, inputs, activations, num_cols=16, figsize=(20, 20)):
+        """ Activations along with inputs as PNG. See docstring of dlight.dissect.activations.show_activations """
+        dactivations.show_activations(inputs, activations, num_cols, figsize, clf=False)
+        path = self._file_name(name, "activations", ".png")
+        self._save_figure(path)
+        return self._add_section("activations", name, [path])
+
+    def add_max_activations(self, name, inputs, activations, nlargest, params, num_cols=16):
+        """ Grid of the inputs with max activation as PNG, activations in the notes.
+            See docstring of dlight.dissect.activations.get_maximimum_activations
+        """
+        grid, max_activations = dactivations.get_inputs_with_max_activation_grid(
+            inputs, activations, nlargest, params, num_cols)
+        path = self._file_name(name, "max_activations", ".png")
+        dimage.save_torch(grid, osp.join(self.directory, path))
+        return self._add_section("max activations", name, [path], {"max activations": list(max_activations)})
+
+    def add_conv_dissection(self, name, input_to_conv, node, outer_idx, input_description=None, encoding="float32"):
+        """ Conv dissection as JSON (the data of conv_dissection.js) and as a standalone HTML page.
+            See docstring of dlight.dissect.conv.show_conv_dissection
+        """
+        data = dconv.get_conv_dissection_data(input_to_conv, node, outer_idx, input_description, encoding)
+        json_path = self._file_name(name, "conv_dissection", ".json")
+        with open(osp.join(self.directory, json_path), "w") as f:
+            json.dump(data, f)
+
+        html_path = self._file_name(name, "conv_dissection", ".html")
+        page = standalone_html(name,
+            libs=[osp.join(dlight_dir, "lib", "d3.v5.7.min.js")],
+            modules=[osp.join(dlight_dir, "utils", "js", "tensor_codec.js"),
+                     osp.join(dlight_dir, "dissect", "js", "conv_dissection.js")],
+            css_files=[osp.join(dlight_dir, "dissect", "js", "conv_dissection.css.html")],
+            module_name="conv_dissection", data=data)
+        with open(osp.join(self.directory, html_path), "w") as f:
+            f.write(page)
+        return self._add_section("conv dissection", name, [html_path, json_path], {"outer_idx": outer_idx})
+
+    def add_projection(self, name, inputs, activations, projections_pipe, max_texture_size=4096, use_cache=True):
+        """ Projection of fc activations: the embedding as JSON, a scatter plot of its first
+            two dimensions as PNG and the sprite atlas pages as PNGs.
+            See docstring of dlight.dissect.projections.project_fc_activations
+        """
+        assert len(activations.shape) == 2, \
+            "Only outputs of fully connected nodes (of shape [B, C]) are supported in this function"
+        activations = dstore.as_tensor(activations).detach()
+        embedding = dprojections.run_projections_pipe(activations, projections_pipe, use_cache)
+
+        files = []
+        embedding_path = self._file_name(name, "embedding", ".json")
+        with open(osp.join(self.directory, embedding_path), "w") as f:
+            json.dump({"projections_pipe": projections_pipe, "embedding": embedding.tolist()}, f)
+        files.append(embedding_path)
+
+        f, a = plt.subplots(1, 1, figsize=(10, 10), dpi=80)
+        a.scatter(embedding[:, 0], embedding[:, 1] if embedding.shape[1] > 1 else np.zeros(len(embedding)), s=4)
+        a.set_title(name)
+        scatter_path = self._file_name(name, "projection", ".png")
+        self._save_figure(scatter_path)
+        files.append(scatter_path)
+
+        if len(inputs.shape) == 4 and inputs.shape[1] == 4:
+            for page_idx, page in enumerate(dprojections.iter_atlas_pages(inputs, max_texture_size)):
+                page_path = self._file_name(name, "atlas_" + str(page_idx), ".png")
+                dimage.save_torch(page.permute(2, 0, 1).float() / 255.0, osp.join(self.directory, page_path))
+                files.append(page_path)
+        return self._add_section("projection", name, files)
+
+    def write_index(self):
+        """ Write index.html linking all sections, and index.json listing them. Returns the path of index.html """
+        with open(osp.join(self.directory, "index.json"), "w") as f:
+            json.dump({"title": self.title, "sections": self.sections}, f, indent=2)
+
+        body = []
+        for section in self.sections:
+            body.append("<h2>" + html.escape(section["kind"] + ": " + section["name"]) + "</h2>")
+            for path in section["files"]:
+                link = html.escape(path, quote=True)
+                if path.endswith(".png"):
+                    body.append("<a href='{0}'><img src='{0}' style='max-width: 100%'></a>".format(link))
+                else:
+                    body.append("<p><a href='{0}'>{0}</a></p>".format(link))
+            for key, value in section["notes"].items():
+                body.append("<p>" + html.escape(key + ": " + json.dumps(value)) + "</p>")
+
+        index_path = osp.join(self.directory, "index.html")
+        with open(index_path, "w") as f:
+            f.write("<!DOCTYPE html>\n<html><head><meta charset='utf-8'><title>{0}</title></head>\n"
+                    "<body><h1>{0}</h1>\n{1}\n</body></html>\n".format(html.escape(self.title), "\n".join(body)))
+        return index_path
+
+    def _add_section(self, kind, name, files, notes=None):
+        section = {"kind": kind, "name": name, "files": files, "notes": notes or {}}
+        self.sections.append(section)
+        return section
+
+    def _file_name(self, name, kind, extension):
+        base = "".join(c if c.isalnum() or c in "-_" else "_" for c in name) + "_" + kind
+        used = set(path for section in self.sections for path in section["files"])
+        path = base + extension
+        count = 1
+        while path in used:
+            path = base + "_" + str(count) + extension
+            count += 1
+        return path
+
+    def _save_figure(self, path):
+        plt.gcf().savefig(osp.join(self.directory, path))
+        plt.close("all")
+
+
+def standalone_html(title, libs, modules, css_files, module_name, data):
+    """ A self-contained HTML page that runs a dlight JS module, e.g. conv_dissection,
+        without Jupyter: libraries and modules are inlined and loaded with require_shim.
+
+    Args:
+        title ([str]): title of the page
+        libs ([list of str]): paths of JS libraries (d3, THREE) that define globals
+        modules ([list of str]): paths of JS files that define() dlight modules
+        css_files ([list of str]): paths of HTML files with <style> elements
+        module_name ([str]): name of the module to run as module(container, data)
+        data ([dict]): JSON-serializable data passed to the module
+    """
+    def script(source):
+        # "</" would end the <script> element early
+        return "<script>\n" + source.replace("</script", "<\\/script") + "\n</script>"
+
+    def read(path):
+        with open(path) as f:
+            return f.read()
+
+    parts = ["<!DOCTYPE html>", "<html><head><meta charset='utf-8'>",
+             "<title>" + html.escape(title) + "</title>", css_style.global_style]
+    parts += [read(path) for path in css_files]
+    parts += ["</head><body>", "<div id='container'></div>"]
+    parts += [script(read(path)) for path in libs]
+    parts.append(script(require_shim))
+    parts += [script(read(path)) for path in modules]
+    parts.append(script("""
+        require(["{}"], function (module) {{
+            module(document.getElementById("container"), {});
+        }});
+        """.format(module_name, json.dumps(data))))
+    parts.append("</body></html>")
+    return "\n".join(parts) + "\n"
+
+
+def capture_node_inputs(model, inputs, node):
+    """ Run inputs through the model and return the input of node (e.g. input_to_conv of a conv node) """
+    captured = {}
+    handle = node.register_forward_pre_hook(lambda module, input: captured.update(input=input[0].detach()))
+    try:
+        with torch.no_grad():
+            model(inputs.to(dcapture.get_device(model)))
+    finally:
+        handle.remove()
+    return captured["input"]
+
+
+def write_model_report(model, inputs, nodes, directory, nlargest=16, dissections=(),
+        projections_pipe=None, reduce_func="mean", title="dlight report"):
+    """ Write weights, activations and max activations of nodes of the model,
+        conv dissections and projections of fc nodes into directory.
+
+    Args:
+        model ([nn.Module]): model to dissect, in eval mode
+        inputs ([Tensor]): expected shape [B, C, H, W]
+        nodes ([list of str]): names of submodules of the model (as in model.named_modules())
+        directory ([str]): output directory
+        nlargest ([int]): number of inputs with max activation per channel
+        dissections ([list of tuples]): (node name, outer_idx) of conv nodes to dissect
+        projections_pipe ([list of dicts]): (optional) projections of the outputs of fc nodes,
+            see docstring of dlight.dissect.projections.project_fc_activations
+        reduce_func ([str]): how to reduce conv activations for max activations, one of ("mean", "max")
+
+    Returns:
+        [str]: path of index.html
+    """
+    report = ReportWriter(directory, title)
+    modules = dcapture.resolve_nodes(model, nodes)
+    activations = dcapture.capture_activations(model, inputs, nodes, offload_to_cpu=True)
+    inputs = inputs.detach().cpu()
+
+    for name, node in modules.items():
+        if isinstance(node, nn.Conv2d):
+            report.add_weights(name, node)
+        node_activations = activations[name]
+        if len(node_activations.shape) == 4:
+            report.add_activations(name, inputs, node_activations)
+        for outer_idx in range(node_activations.shape[1]):
+            report.add_max_activations(name + " channel " + str(outer_idx), inputs, node_activations,
+                min(nlargest, inputs.shape[0]), {"outer_idx": outer_idx, "reduce_func": reduce_func})
+        if projections_pipe is not None and len(node_activations.shape) == 2:
+            report.add_projection(name, _to_rgba(inputs), node_activations, projections_pipe)
+
+    for name, outer_idx in dissections:
+        node = dcapture.resolve_nodes(model, [name])[name]
+        input_to_conv = capture_node_inputs(model, inputs, node)
+        report.add_conv_dissection(name + " channel " + str(outer_idx), input_to_conv, node, outer_idx)
+
+    return report.write_index()
+
+
+def _to_rgba(images):
+    """ RGBA version of grayscale or RGB images of shape [B, C, H, W], with values in [0, 1] """
+    images = dimage.normalize(images.float())
+    if images.shape[1] == 1:
+        images = images.expand(-1, 3, -1, -1)
+    if images.shape[1] == 3:
+        images = torch.cat([images, torch.ones_like(images[:, :1])], dim=1)
+    return images
+
+
+def load_model(model, checkpoint=None):
+    """ Load a model for the command line
+
+    Args:
+        model ([str]): (optional) "module:attr", where attr is an nn.Module class or a function
+            that returns the model, e.g. "examples.dlight.simple_convnet:SimpleConvnet"
+        checkpoint ([str]): (optional) path of a state dict, or of a whole model saved with torch.save
+    """
+    loaded = None
+    if checkpoint is not None:
+        loaded = torch.load(checkpoint, map_location="cpu", weights_only=False)
+        if isinstance(loaded, nn.Module):
+            return loaded.eval()
+    if model is None:
+        raise ValueError("--model is needed unless the checkpoint is a whole model")
+
+    module_name, attr = model.split(":")
+    result = getattr(importlib.import_module(module_name), attr)()
+    if loaded is not None:
+        result.load_state_dict(loaded.get("state_dict", loaded) if isinstance(loaded, dict) else loaded)
+    return result.eval()
+
+
+def main(args=None):
+    matplotlib.use("Agg") # no display needed
+    parser = argparse.ArgumentParser(prog="python -m dlight.report",
+        description="Write a static dissection report (PNG, HTML, JSON) of a model")
+    parser.add_argument("--model", help="module:attr that creates the model, e.g. examples.dlight.simple_convnet:SimpleConvnet")
+    parser.add_argument("--checkpoint", help="state dict, or whole model saved with torch.save")
+    parser.add_argument("--inputs", required=True, help="Tensor of shape [B, C, H, W] saved with torch.save")
+    parser.add_argument("--nodes", nargs="+", required=True, help="names of submodules to dissect")
+    parser.add_argument("--output", required=True, help="output directory")
+    parser.add_argument("--nlargest", type=int, default=16, help="inputs with max activation per channel")
+    parser.add_argument("--reduce-func", default="mean", choices=["mean", "max"])
+    parser.add_argument("--dissect", nargs="*", default=[], metavar="NODE:OUTER_IDX",
+        help="conv nodes and outer indices to dissect, e.g. conv2:3")
+    parser.add_argument("--projections", help="JSON projections pipe for fc nodes, e.g. '[{\"type\": \"pca\", \"n_components\": 3}]'")
+    parser.add_argument("--title", default="dlight report")
+    args = parser.parse_args(args)
+
+    model = load_model(args.model, args.checkpoint)
+    inputs = torch.load(args.inputs, map_location="cpu", weights_only=False)
+    if isinstance(inputs, (tuple, list)):
+        inputs = inputs[0]
+    dissections = []
+    for dissection in args.dissect:
+        name, outer_idx = dissection.rsplit(":", 1)
+        dissections.append((name, int(outer_idx)))
+    projections_pipe = json.loads(args.projections) if args.projections else None
+
+    index_path = write_model_report(model, inputs, args.nodes, args.output, args.nlargest,
+        dissections, projections_pipe, args.reduce_func, args.title)
+    print("Wrote", index_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,22 @@
-import dlight.utils.css_style
-import dlight.utils.image
-import dlight.utils.showing
+import importlib
+
+# Submodules are imported on first access (e.g. dlight.utils.image), see dlight/__init__.py
+_submodules = [
+    "assets",
+    "cache",
+    "css_style",
+    "image",
+    "profiling",
+    "showing",
+    "tensor_codec",
+]
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module(__name__ + "." + name)
+    raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + _submodules)
@@ -0,0 +1,185 @@
+import os
+import os.path as osp
+import shutil
+import sys
+import dlight.utils.profiling as dprofiling
+
+
+# Injects JS libraries and dlight widget modules (and their styles) into the notebook
+# once per scope, instead of on every show_ call:
+# - in Colab every cell output is rendered in its own iframe, so the scope is the cell execution
+# - elsewhere (Jupyter notebook) the page keeps defined modules, so the scope is the kernel session
+# d3 and three.js are the copies bundled in dlight/lib (works offline). They are copied once
+# into the nbextensions dir of jupyter (served by Jupyter notebook and Colab under /nbextensions/)
+# and loaded by URL, so notebooks only hold a require.config line per scope.
+# If that dir is not writable, they are inlined instead.
+# Call set_library_source("cdn") to load them from CDNs, or "inline" to always inline them.
+
+dlight_dir = osp.dirname(osp.dirname(osp.realpath(__file__)))
+
+# name -> (dependencies, files relative to dlight_dir). Files ending in .js are displayed as
+# Javascript and must define() a module, files ending in .html are displayed as HTML (styles).
+assets = {
+    "require": ([], []),
+    "style": ([], []),
+    "d3": (["require"], ["lib/d3.v5.7.min.js"]),
+    "THREE": (["require"], ["lib/three.min.js"]),
+    "trackball": (["THREE"], ["lib/three_trackball_controls.js"]),
+    "tensor_codec": (["require"], ["utils/js/tensor_codec.js"]),
+    "conv_dissection": (["style", "d3", "tensor_codec"],
+        ["dissect/js/conv_dissection.js", "dissect/js/conv_dissection.css.html"]),
+    "sprite_visualizer": (["style", "THREE", "trackball", "tensor_codec"],
+        ["utils/js/sprite_visualizer.js", "utils/js/sprite_visualizer.css.html"]),
+    "draw_image": (["style", "d3", "tensor_codec"], ["utils/js/draw_image.js", "utils/js/draw_image.css.html"]),
+}
+
+cdn_paths = {
+    "d3": "https://d3js.org/d3.v5.min",
+    "THREE": "https://cdnjs.cloudflare.com/ajax/libs/three.js/88/three.min",
+}
+
+library_source = "local"
+
+# Where the bundled libraries are copied to, and the URL it is served under
+nbextension_dir = osp.join(osp.abspath("/usr/local/share/jupyter"), "nbextensions", "dlight")
+nbextension_url = "/nbextensions/dlight"
+
+_injected = {} # scope -> set of injected asset names. Only the current scope is kept
+
+
+@dprofiling.profile
+def use(names):
+    """ Make sure that the assets (and their dependencies) are injected in the current scope.
+        Assets that were already injected in the scope are not sent again.
+
+    Args:
+        names ([list of str]): keys of assets, e.g. ["conv_dissection"]
+    """
+    import IPython.display as ipd
+
+    scope = _scope()
+    if scope not in _injected:
+        # Assets of earlier Colab cells can't be used by later cells
+        _injected.clear()
+    injected = _injected.setdefault(scope, set())
+    for name in _resolve(names):
+        if name in injected:
+            continue
+        for display_object in _render(name):
+            ipd.display(display_object)
+            dprofiling.add_bytes(len(display_object.data or ""))
+        injected.add(name)
+
+
+def reset():
+    """ Forget injected assets, so that they are injected again
+        (e.g. after reloading the notebook page without restarting the kernel)
+    """
+    _injected.clear()
+
+
+def set_library_source(source):
+    """ Where d3 and three.js are loaded from
+
+    Args:
+        source ([str]): one of ("local", "inline", "cdn"). "local" (default) loads the copies
+            bundled in dlight/lib from nbextension_dir (and inlines them if it is not writable),
+            "inline" always inlines them and "cdn" loads them from cdn_paths
+    """
+    global library_source
+    if source not in ("local", "inline", "cdn"):
+        raise ValueError("source must be one of ('local', 'inline', 'cdn'). Instead got: " + str(source))
+    library_source = source
+    reset()
+
+
+def _scope():
+    import IPython
+    ipython = IPython.get_ipython()
+    if ipython is not None and "google.colab" in sys.modules:
+        return ("cell", ipython.execution_count)
+    return "kernel"
+
+
+def _resolve(names):
+    """ names and their dependencies, dependencies first """
+    ordered = []
+
+    def visit(name):
+        if name not in assets:
+            raise ValueError("Unknown asset " + str(name) + ". Available assets: " + ", ".join(assets.keys()))
+        if name in ordered:
+            return
+        for dependency in assets[name][0]:
+            visit(dependency)
+        ordered.append(name)
+
+    for name in names:
+        visit(name)
+    return ordered
+
+
+def _render(name):
+    """ Display objects that inject asset name """
+    import IPython.display as ipd
+    import dlight.utils.css_style as css_style
+
+    if name == "require":
+        # See https://github.com/googlecolab/colabtools/issues/461#issuecomment-469854101
+        # (require.js does nothing if it is already on the page, as in Jupyter notebook)
+        return [ipd.HTML('<script src="/static/components/requirejs/require.js"></script>')]
+    if name == "style":
+        return [ipd.HTML(css_style.global_style)]
+    if name in cdn_paths:
+        if library_source == "cdn":
+            return [ipd.Javascript("require.config({paths: {" + name + ": '" + cdn_paths[name] + "'}});")]
+        if library_source == "local":
+            url = _install_library(name)
+            if url is not None:
+                return [ipd.Javascript("require.config({paths: {" + name + ": '" + url + "'}});")]
+        return [ipd.Javascript(_read_library(name))]
+
+    display_objects = []
+    for path in assets[name][1]:
+        path = osp.join(dlight_dir, path)
+        if path.endswith(".js"):
+            display_objects.append(ipd.Javascript(filename=path))
+        else:
+            display_objects.append(ipd.HTML(filename=path))
+    if name == "trackball":
+        display_objects.append(ipd.Javascript("""
+            require(['THREE', 'trackballLoader'], function(THREE, trackballLoader) {
+                if (!THREE.hasOwnProperty("TrackballControls")) {
+                    trackballLoader(THREE);
+                }
+            });
+        """))
+    return display_objects
+
+
+def _install_library(name):
+    """ Copy the bundled library of asset name into nbextension_dir, unless it is already there.
+        Returns its URL (without .js, as require.config expects), or None if it can't be copied.
+    """
+    source_path = osp.join(dlight_dir, assets[name][1][0])
+    target_path = osp.join(nbextension_dir, osp.basename(source_path))
+    try:
+        if not osp.exists(target_path) or osp.getsize(target_path) != osp.getsize(source_path):
+            os.makedirs(nbextension_dir, exist_ok=True)
+            tmp_path = target_path + ".tmp"
+            shutil.copyfile(source_path, tmp_path)
+            os.replace(tmp_path, target_path)
+    except OSError:
+        return None
+    return nbextension_url + "/" + osp.splitext(osp.basename(source_path))[0]
+
+
+def _read_library(name):
+    """ JS that inlines a bundled UMD library and defines it as a require module.
+        define, exports and module are shadowed, so that the library sets a global
+        (an anonymous define() outside of require would fail), which is then define()d.
+    """
+    with open(osp.join(dlight_dir, assets[name][1][0])) as f:
+        source = f.read()
+    return ("(function (define, exports, module) {\n" + source + "\n}).call(window);\n" +
+            "define('" + name + "', [], function () { return window." + name + "; });\n")
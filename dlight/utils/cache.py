@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import os.path as osp
+import pickle
+import uuid
+import numpy as np
+import torch
+
+
+class DiskCache:
+    """ Content-addressed files in a directory. An entry is one or more files whose names
+        start with its key (e.g. "<key>.npy" or "<key>_0.png", "<key>_1.png").
+        Entries are evicted least recently used first, once the total size of the
+        directory exceeds max_size_bytes. Reading an entry counts as using it.
+    """
+
+    def __init__(self, directory, max_size_bytes):
+        self.directory = directory
+        self.max_size_bytes = max_size_bytes
+
+    def path(self, key, suffix=""):
+        """ Path of the file of entry key with the given suffix (e.g. ".npy" or "_0.png") """
+        return osp.join(self.directory, key + suffix)
+
+    def contains(self, key, suffixes):
+        """ Whether all files of entry key exist. Marks the entry as recently used """
+        paths = [self.path(key, suffix) for suffix in suffixes]
+        if not all(osp.exists(path) for path in paths):
+            return False
+        for path in paths:
+            os.utime(path) # last access for LRU eviction
+        return True
+
+    def load_numpy(self, key):
+        """ Cached numpy array of entry key, or None """
+        if not self.contains(key, [".npy"]):
+            return None
+        return np.load(self.path(key, ".npy"))
+
+    def save_numpy(self, key, array):
+        self.write(key, ".npy", lambda path: np.save(path, array))
+
+    def write(self, key, suffix, write_func):
+        """ Write a file of entry key with write_func(path), atomically, then evict if needed """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key, suffix)
+        root, ext = osp.splitext(path)
+        tmp_path = root + ".tmp-" + uuid.uuid4().hex + ext
+        write_func(tmp_path)
+        os.replace(tmp_path, path)
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """ Remove least recently used entries until the cache fits into max_size_bytes.
+            Entry keep is never removed.
+        """
+        if not osp.isdir(self.directory):
+            return
+        entries = {} # key -> [last access time, size, paths]
+        total_size = 0
+        for name in os.listdir(self.directory):
+            path = osp.join(self.directory, name)
+            if not osp.isfile(path) or ".tmp-" in name:
+                continue
+            key = name.split("_")[0].split(".")[0]
+            stat = os.stat(path)
+            entry = entries.setdefault(key, [0.0, 0, []])
+            entry[0] = max(entry[0], stat.st_mtime)
+            entry[1] += stat.st_size
+            entry[2].append(path)
+            total_size += stat.st_size
+
+        for key, (_, size, paths) in sorted(entries.items(), key=lambda item: item[1][0]):
+            if total_size <= self.max_size_bytes:
+                break
+            if key == keep:
+                continue
+            for path in paths:
+                os.remove(path)
+            total_size -= size
+
+    def clear(self):
+        """ Remove all entries """
+        if osp.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                path = osp.join(self.directory, name)
+                if osp.isfile(path):
+                    os.remove(path)
+
+
+def hash_key(*parts):
+    """ Content hash of parts. Each part is a Tensor, a numpy array, a lazy array with
+        iter_chunks (e.g. dlight.dissect.store.StoredActivations, hashed chunk by chunk,
+        to the same key as the Tensor of all its chunks), or anything JSON-serializable
+        (e.g. a config dict or another key). Values in JSON that JSON can't serialize
+        (numpy scalars, arrays, objects like a numpy RandomState) are hashed by content,
+        objects through pickle. Raises TypeError if a value can't be pickled either.
+    """
+    sha = hashlib.sha256()
+    for part in parts:
+        if hasattr(part, "iter_chunks"):
+            for chunk_idx, (_, chunk) in enumerate(part.iter_chunks()):
+                chunk = _to_numpy(chunk)
+                if chunk_idx == 0:
+                    sha.update(str((chunk.dtype.str, tuple(part.shape))).encode("utf-8"))
+                sha.update(chunk.data)
+            sha.update(b"|")
+            continue
+        if isinstance(part, torch.Tensor):
+            part = _to_numpy(part)
+        if isinstance(part, np.ndarray):
+            part = np.ascontiguousarray(part)
+            sha.update(str((part.dtype.str, part.shape)).encode("utf-8"))
+            sha.update(part.data)
+        else:
+            sha.update(json.dumps(part, sort_keys=True, default=_json_default).encode("utf-8"))
+        sha.update(b"|")
+    return sha.hexdigest()[:32]
+
+
+def _json_default(value):
+    """ JSON-serializable stand-in for a value that json can't serialize """
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (torch.Tensor, np.ndarray)):
+        return {"array": hash_key(value)}
+    try:
+        data = pickle.dumps(value, protocol=4)
+    except Exception as e:
+        raise TypeError("Can't hash object of type " + type(value).__name__ + ": " + str(e))
+    return {"pickle": hashlib.sha256(data).hexdigest()}
+
+
+def _to_numpy(tensor):
+    tensor = tensor.detach().cpu()
+    if tensor.dtype == torch.bfloat16:
+        tensor = tensor.float()
+    return np.ascontiguousarray(tensor.numpy())
+
+
+# Atlases have to be in jupyter dir to be accessed from Javascript.
+# See https://stackoverflow.com/a/49487396/13344574
+jupyter_dir = osp.abspath("/usr/local/share/jupyter")
+atlas_cache = DiskCache(osp.join(jupyter_dir, "nbextensions", "tmp", "dlight_atlases"), 1024 ** 3)
+embedding_cache = DiskCache(osp.join(osp.expanduser("~"), ".cache", "dlight", "embeddings"), 1024 ** 3)
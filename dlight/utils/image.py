@@ -1,11 +1,13 @@
-import os.path as osp
 from random import randrange
+import base64
 import json
-import matplotlib.pyplot as plt
+import sys
+import numpy as np
 import torch
-import IPython.display as ipd
-from google.colab import output
-import dlight
+import torch.nn.functional as F
+import dlight.utils.assets as dassets
+import dlight.utils.profiling as dprofiling
+import dlight.utils.tensor_codec as dcodec
 
 
 def normalize(x):
@@ -14,12 +16,63 @@ def normalize(x):
     return (x - mn) / (mx - mn)
     
 
+def grid_buffer(num_channels, rows, cols, height, width, padding=2, pad_value=0.0, dtype=torch.float32):
+    """ Preallocated grid of rows x cols images with padding around them
+        (the layout of torchvision.utils.make_grid)
+
+    Returns:
+        [tuple of Tensors]: (grid, tiles). grid has shape
+            [C, rows * (H + padding) + padding, cols * (W + padding) + padding].
+            tiles is a view of grid of shape [C, rows, H, cols, W]: tiles[:, r, :, c, :] is
+            the image in row r and column c, so writing into tiles fills the grid.
+    """
+    grid = torch.full((num_channels, rows * (height + padding) + padding, cols * (width + padding) + padding),
+        pad_value, dtype=dtype)
+    tiles = grid[:, padding:, padding:].unflatten(1, (rows, height + padding)).unflatten(3, (cols, width + padding))
+    return grid, tiles[:, :, :height, :, :width]
+
+
+def downsample(images, max_size):
+    """ Downsample images by area averaging, so that their height and width are at most max_size.
+        The aspect ratio is kept. Smaller images are returned as they are.
+
+    Args:
+        images ([Tensor]): expected shape [B, C, H, W]
+    """
+    height, width = images.shape[-2:]
+    if max(height, width) <= max_size:
+        return images
+    scale = max_size / max(height, width)
+    size = (max(1, int(round(height * scale))), max(1, int(round(width * scale))))
+    return F.interpolate(images, size=size, mode="area")
+
+
+def as_images(tensor):
+    """ Tensor of shape [B, C, *spatial] as images of shape [B, C, H, W], for visualization.
+        No spatial dims become 1 x 1 images, [L] becomes 1 x L and the depth slices
+        of [D, H, W] are stacked vertically into (D * H) x W.
+    """
+    num_spatial_dims = len(tensor.shape) - 2
+    if num_spatial_dims == 0:
+        return tensor[:, :, None, None]
+    if num_spatial_dims == 1:
+        return tensor[:, :, None, :]
+    if num_spatial_dims == 2:
+        return tensor
+    if num_spatial_dims == 3:
+        return tensor.flatten(2, 3)
+    raise NotImplementedError("Only tensors of shape [B, C], [B, C, L], [B, C, H, W] and [B, C, D, H, W] are supported for now")
+
+
+@dprofiling.profile
 def show_torch(tensor, figsize=(22, 22), clf=True):
     """ Show tensor using matplotlib
 
     Args:
         tensor ([Tensor]): expected shape: [C, H, W]
     """
+    import matplotlib.pyplot as plt
+
     channels = tensor.shape[0]
     if channels == 3:
         # RGB
@@ -37,49 +90,87 @@ def show_torch(tensor, figsize=(22, 22), clf=True):
     plt.show()
 
 
+@dprofiling.profile
+def save_torch(tensor, path):
+    """ Save tensor as a PNG file (the headless counterpart of show_torch)
+
+    Args:
+        tensor ([Tensor]): values in [0, 1], expected shape: [C, H, W] with C one of (1, 3, 4)
+        path ([str]): path of the PNG file
+    """
+    import imageio
+
+    channels = tensor.shape[0]
+    if channels not in (1, 3, 4):
+        raise ValueError("unsupported number of channels " + str(channels))
+    image = torch.clamp(tensor.detach().cpu().float() * 255.0, 0, 255).byte().permute(1, 2, 0)
+    if channels == 1:
+        image = image[:, :, 0]
+    imageio.imwrite(path, image.numpy(), format="png")
+
+
 def total_variation_loss(img):
     """ 
     Args:
-        img ([Tensor]): shape should be [C, H, W]
+        img ([Tensor]): shape should be [C, H, W] or [B, C, H, W].
+            For a batch, the losses of the images are summed.
     """
     # https://towardsdatascience.com/pytorch-implementation-of-perceptual-losses-for-real-time-style-transfer-8d608e2e9902
     # https://discuss.pytorch.org/t/yet-another-post-on-custom-loss-functions/14552
     # The total variation norm formula for 2D signal images: https://www.wikiwand.com/en/Total_variation_denoising
-    return torch.sum(torch.abs(img[:, :, :-1] - img[:, :, 1:])) + \
-            torch.sum(torch.abs(img[:, :-1, :] - img[:, 1:, :]))
+    return torch.sum(torch.abs(img[..., :, :-1] - img[..., :, 1:])) + \
+            torch.sum(torch.abs(img[..., :-1, :] - img[..., 1:, :]))
 
 
-def draw_synthetic_input(input_height, input_width, callback):
+@dprofiling.profile
+def draw_synthetic_input(input_height, input_width, callback, live=False, transport=None):
     """ Draw synthetic input and call the provided callback
-        with the image array when image is changed.
+        with the image when image is changed.
 
     Args:
         input_height ([int]): height of the input image
         input_width ([int]): width of the input image
         callback ([func]): callback to call when drawn image is changed.
-            The only argument to the callback will be a 2D image_array
-            with grayscale values of type int within [0, 255]
+            The only argument to the callback will be a uint8 Tensor of shape
+            [input_height, input_width] with grayscale values within [0, 255].
+            The drawing is sent from JS as {"shape": [H, W], "data": base64 of uint8 pixels}
+            and decoded before calling the callback; callbacks written for the former
+            2D list of ints should index the Tensor, or call .tolist() on it.
+            If the callback returns a Tensor of shape [H, W] (e.g. activations),
+            it is shown next to the drawing.
+        live ([bool]): call the callback on every change of the drawing, instead of once
+            drawing stops for 2 sec. Changes made while the callback runs are coalesced
+            into a single call, so the callback is never queued up.
+        transport ([str]): (optional) one of ("colab", "comm"). How the drawing is sent
+            to the kernel: google.colab callbacks, or a Jupyter notebook comm.
+            Default is "colab" in Colab, "comm" elsewhere.
     """
-    def draw_synthetic_input_callback(x):
-        x = json.loads(x) # parse json from string
-        callback(x)
-        return ipd.JSON({'result': "parsed synthetic input"})
-
-    # JS to PY communication.
-    # See https://colab.research.google.com/notebooks/snippets/advanced_outputs.ipynb#scrollTo=Ytn7tY-C9U0T
-    output_callback_name = "draw_synthetic_input_callback_" + str(randrange(1000))
-    output.register_callback(
-        'notebook.' + output_callback_name, draw_synthetic_input_callback)
-
-    dlight.load_js_libs()
-    utils_dir = osp.dirname(osp.realpath(__file__))
-    ipd.display(ipd.Javascript(filename=osp.join(utils_dir, "js", "draw_image.js")))
-    ipd.display(ipd.HTML(filename=osp.join(utils_dir, "js", "draw_image.css.html")))
+    import IPython.display as ipd
+
+    if transport is None:
+        transport = "colab" if "google.colab" in sys.modules else "comm"
+    if transport not in ("colab", "comm"):
+        raise ValueError("transport must be one of ('colab', 'comm'). Instead got: " + str(transport))
+
+    def draw_synthetic_input_callback(payload):
+        image = np.frombuffer(base64.b64decode(payload["data"]), dtype=np.uint8)
+        image = torch.from_numpy(image.copy()).view(*payload["shape"])
+        result = callback(image)
+        if isinstance(result, torch.Tensor):
+            return {"image": dcodec.encode_tensor(result, "uint8")}
+        return {'result': "parsed synthetic input"}
+
+    callback_name = "draw_synthetic_input_callback_" + str(randrange(1000))
+    _register_callback(callback_name, draw_synthetic_input_callback, transport)
+
+    dassets.use(["draw_image"])
     
     data = {
         "image_height": input_height,
         "image_width": input_width,
-        "callback_name": output_callback_name
+        "callback_name": callback_name,
+        "transport": transport,
+        "live": live
     }
     
     container_id = "draw-image-container-" + str(randrange(1000))
@@ -89,4 +180,23 @@ def draw_synthetic_input(input_height, input_width, callback):
                 draw_image(document.getElementById("{}"), {});
             }});
         """.format(container_id, json.dumps(data))))
-        
\ No newline at end of file
+
+
+def _register_callback(name, handler, transport):
+    """ Make handler(payload) -> reply callable from JS under name (see js/draw_image.js).
+        payload and reply are JSON-serializable dicts.
+    """
+    if transport == "colab":
+        import IPython.display as ipd
+        from google.colab import output
+
+        # JS to PY communication.
+        # See https://colab.research.google.com/notebooks/snippets/advanced_outputs.ipynb#scrollTo=Ytn7tY-C9U0T
+        output.register_callback('notebook.' + name, lambda payload: ipd.JSON(handler(json.loads(payload))))
+    else:
+        import IPython
+
+        # https://jupyter-notebook.readthedocs.io/en/stable/comms.html
+        def open_comm(comm, open_msg):
+            comm.on_msg(lambda msg: comm.send(handler(msg["content"]["data"])))
+        IPython.get_ipython().kernel.comm_manager.register_target(name, open_comm)
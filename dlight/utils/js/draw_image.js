@@ -3,7 +3,7 @@
 // Uncomment for debugging
 // require.undef("draw_image");
 
-define("draw_image", ["d3"], function (d3) {
+define("draw_image", ["d3", "tensor_codec"], function (d3, tensor_codec) {
   return (container, data) => {
     /** data should contain the following:
      * {
@@ -11,13 +11,22 @@ define("draw_image", ["d3"], function (d3) {
      *   image_width: output image width
      *   callback_name: the name of the callback to call.
      *                  the callback should have been registered with
-     *                  google.colab.output.
+     *                  google.colab.output (transport "colab") or as a comm target
+     *                  of the kernel (transport "comm").
      *                  See JS to PY communication: https://colab.research.google.com/notebooks/snippets/advanced_outputs.ipynb#scrollTo=Ytn7tY-C9U0T
+     *   transport: one of ("colab", "comm")
+     *   live: if true, the image is sent on every change (at most one request in flight,
+     *         changes made meanwhile are sent together once it returns).
+     *         Otherwise it is sent once drawing stops for 2 sec.
      * }
+     * The callback gets {shape: [image_height, image_width], data: base64 of uint8 pixels}
+     * and can reply with {image: tensor encoded by dlight.utils.tensor_codec.encode_tensor}
+     * of shape [H, W], which is shown next to the drawing.
      */
 
-    const { image_height, image_width, callback_name } = data;
+    const { image_height, image_width, callback_name, transport, live } = data;
 
+    const stroke_width = 20; // px
     const draw_color = "#fff";
     const erase_color = "#000";
     var stroke_color = draw_color;
@@ -29,6 +38,7 @@ define("draw_image", ["d3"], function (d3) {
     const body = container.append("div");
     const footer = container.append("div").classed("draw-image-footer", true);
 
+    body.style("display", "flex").style("align-items", "flex-start");
     var svg = body
       .append("div")
       .append("svg")
@@ -46,8 +56,19 @@ define("draw_image", ["d3"], function (d3) {
       .attr("width", "100%")
       .attr("height", "100%");
 
-    // Used to extract image_array from svg
-    var canvas;
+    // Reply of the callback (e.g. activations), if any
+    const result_canvas = body
+      .append("canvas")
+      .style("margin-left", "10px")
+      .style("image-rendering", "pixelated")
+      .style("display", "none")
+      .node();
+
+    // Paths are rasterized into this (hidden) canvas
+    const canvas = document.createElement("canvas");
+    canvas.height = image_height;
+    canvas.width = image_width;
+    const ctx = canvas.getContext("2d");
 
     const svg_line = d3.line().curve(d3.curveBasis);
     const svg_transition = d3.transition().duration(500).ease(d3.easeLinear);
@@ -66,13 +87,7 @@ define("draw_image", ["d3"], function (d3) {
         svg_paths_stack[svg_paths_stack.length - 1].remove();
         svg_paths_stack.splice(-1, 1);
 
-        if (img_change_timeout !== null) {
-          clearTimeout(img_change_timeout);
-        }
-        img_change_timeout = setTimeout(
-          img_change_callback,
-          img_change_timeout_duration
-        );
+        image_changed();
       });
 
     footer
@@ -118,7 +133,7 @@ define("draw_image", ["d3"], function (d3) {
           // all styles have to be inline in order to extract image array from SVG, can't store these styles in a separate file
           .attr("stroke", stroke_color)
           .attr("fill", "none")
-          .attr("stroke-width", "20px")
+          .attr("stroke-width", stroke_width + "px")
           .attr("stroke-linejoin", "round")
           .attr("stroke-linecap", "round")
           .datum(d),
@@ -136,80 +151,125 @@ define("draw_image", ["d3"], function (d3) {
         else d[d.length - 1] = [x1, y1];
         active.attr("d", svg_line);
 
+        image_changed();
+      });
+    }
+
+    const send = transport === "comm" ? commTransport() : colabTransport();
+    var request_in_flight = false;
+    var image_dirty = false;
+
+    function image_changed() {
+      if (!live) {
         if (img_change_timeout !== null) {
           clearTimeout(img_change_timeout);
         }
-        img_change_timeout = setTimeout(
-          img_change_callback,
-          img_change_timeout_duration
-        );
-      });
+        img_change_timeout = setTimeout(function () {
+          img_change_timeout = null;
+          image_dirty = true;
+          send_image();
+        }, img_change_timeout_duration);
+        return;
+      }
+      // Coalesce changes: while a request is in flight, only remember that the image changed
+      image_dirty = true;
+      if (!request_in_flight) send_image();
     }
 
-    function img_change_callback() {
-      img_change_timeout = null;
-
-      get_image_array(async function (image_array) {
-        // TODO describe how to make everything work in Jupyter on github (sync to a previous commit)
+    async function send_image() {
+      if (request_in_flight) return;
+      request_in_flight = true;
+      while (image_dirty) {
+        image_dirty = false;
+        try {
+          show_result(await send(get_image_payload()));
+        } catch (error) {
+          console.error("callback in draw_image failed. ", error);
+        }
+      }
+      request_in_flight = false;
+    }
 
-        // JS to PY communication.
-        // See https://colab.research.google.com/notebooks/snippets/advanced_outputs.ipynb#scrollTo=Ytn7tY-C9U0T
+    // JS to PY communication.
+    // See https://colab.research.google.com/notebooks/snippets/advanced_outputs.ipynb#scrollTo=Ytn7tY-C9U0T
+    function colabTransport() {
+      return async (payload) => {
         const result = await google.colab.kernel.invokeFunction(
           "notebook." + callback_name, // The callback name.
-          [JSON.stringify(image_array)], // The arguments.
+          [JSON.stringify(payload)], // The arguments.
           {}
         ); // kwargs
+        return result.data["application/json"];
+      };
+    }
 
-        const output = result.data["application/json"];
-        console.log("callback in draw_image successful. ", output);
-
-        d3.select(canvas).remove();
+    // Jupyter notebook comm, see dlight.utils.image.draw_synthetic_input.
+    // Replies come in the order of the requests, and there is at most one in flight.
+    function commTransport() {
+      const comm = Jupyter.notebook.kernel.comm_manager.new_comm(callback_name, {});
+      var resolve_reply = null;
+      comm.on_msg((msg) => {
+        if (resolve_reply !== null) resolve_reply(msg.content.data);
+        resolve_reply = null;
       });
+      return (payload) =>
+        new Promise((resolve) => {
+          resolve_reply = resolve;
+          comm.send(payload);
+        });
     }
 
-    function get_image_array(image_array_callback) {
-      const svgString = new XMLSerializer().serializeToString(svg.node());
-      const svg_blob = new Blob([svgString], {
-        type: "image/svg+xml;charset=utf-8",
+    // The drawing as {shape: [H, W], data: base64 of uint8 pixels (row-major)}
+    function get_image_payload() {
+      ctx.fillStyle = "#000";
+      ctx.fillRect(0, 0, image_width, image_height);
+      ctx.lineJoin = "round";
+      ctx.lineCap = "round";
+      svg.selectAll("path").each(function () {
+        // same stroke as in the SVG
+        ctx.lineWidth = parseFloat(this.getAttribute("stroke-width"));
+        ctx.strokeStyle = this.getAttribute("stroke");
+        ctx.stroke(new Path2D(this.getAttribute("d")));
       });
 
-      const DOMURL = self.URL || self.webkitURL || self;
-      const url = DOMURL.createObjectURL(svg_blob);
-
-      canvas = body
-        .append("canvas")
-        .attr("height", image_height)
-        .attr("width", image_width)
-        // make it invisible
-        .style("opacity", 0.0)
-        .style("position", "absolute")
-        .node();
-
-      var ctx = canvas.getContext("2d");
-      var img = new Image();
-
-      img.onload = function () {
-        ctx.drawImage(img, 0, 0);
-
-        const image_data = ctx.getImageData(0, 0, image_width, image_height);
-        const image_array = new Array();
-        for (let y = 0; y < image_height; y++) {
-          image_array.push(new Array());
-          for (let x = 0; x < image_width; x++) {
-            // if (y === 0 || y === (image_height - 1) ||
-            //     x === 0 || x === (image_width - 1)) {
-            //       image_array[y].push(255); // skip borders
-            //       continue;
-            //     }
-            let pos = y * image_width + x;
-            image_array[y].push(image_data.data[pos * 4]);
-          }
-        }
-
-        image_array_callback(image_array);
-      };
+      const rgba = ctx.getImageData(0, 0, image_width, image_height).data;
+      let binary = "";
+      for (let i = 0; i < rgba.length; i += 4) {
+        binary += String.fromCharCode(rgba[i]); // red channel, the drawing is grayscale
+      }
+      return { shape: [image_height, image_width], data: btoa(binary) };
+    }
 
-      img.src = url;
+    function show_result(result) {
+      if (!result || !result.image) return;
+      const { shape, data } = tensor_codec.decode(result.image);
+      const [height, width] = shape;
+      let min = Infinity;
+      let max = -Infinity;
+      for (let i = 0; i < data.length; i++) {
+        min = Math.min(min, data[i]);
+        max = Math.max(max, data[i]);
+      }
+      const scale = max > min ? 255 / (max - min) : 0;
+
+      result_canvas.height = height;
+      result_canvas.width = width;
+      // shown at least as high as the drawing
+      const zoom = Math.max(1, Math.floor(image_height / height));
+      result_canvas.style.height = zoom * height + "px";
+      result_canvas.style.width = zoom * width + "px";
+      result_canvas.style.display = null;
+
+      const result_ctx = result_canvas.getContext("2d");
+      const image_data = result_ctx.createImageData(width, height);
+      for (let i = 0; i < data.length; i++) {
+        const value = (data[i] - min) * scale;
+        image_data.data[4 * i] = value;
+        image_data.data[4 * i + 1] = value;
+        image_data.data[4 * i + 2] = value;
+        image_data.data[4 * i + 3] = 255;
+      }
+      result_ctx.putImageData(image_data, 0, 0);
     }
   };
 });
@@ -2,30 +2,302 @@
 // require.undef('sprite_visualizer');
 
 // https://douglasduhaime.com/posts/visualizing-tsne-maps-with-three-js.html
-define("sprite_visualizer", ["THREE"], function (THREE) {
+// Sprites are instanced quads: every atlas page is a single draw call, and the quads
+// are turned toward the camera in the vertex shader (no per-frame work in JS).
+define("sprite_visualizer", ["THREE", "tensor_codec"], function (THREE, tensor_codec) {
+  const vertexShader = `
+    uniform vec2 sprite_size;
+    uniform vec2 uv_scale;
+    attribute vec3 offset;
+    attribute vec2 uv_offset;
+    varying vec2 v_uv;
+
+    void main() {
+      v_uv = uv_offset + uv * uv_scale;
+      // Billboard: expand the quad in view space, so that it always faces the camera
+      vec4 mv_position = modelViewMatrix * vec4(offset, 1.0);
+      mv_position.xy += position.xy * sprite_size;
+      gl_Position = projectionMatrix * mv_position;
+    }
+  `;
+
+  const fragmentShader = `
+    uniform sampler2D map;
+    varying vec2 v_uv;
+
+    void main() {
+      gl_FragColor = texture2D(map, v_uv);
+    }
+  `;
+
+  // Unit quad shared by all meshes: lower left, lower right, upper right, upper left.
+  // Scaled to sprite_size_in_3D in the vertex shader.
+  const quad_positions = new Float32Array([
+    -0.5, -0.5, 0.0,
+    0.5, -0.5, 0.0,
+    0.5, 0.5, 0.0,
+    -0.5, 0.5, 0.0,
+  ]);
+  const quad_uvs = new Float32Array([0, 0, 1, 0, 1, 1, 0, 1]);
+  // the lower-right and the upper-left triangles
+  const quad_indices = new Uint16Array([0, 1, 2, 0, 2, 3]);
+
+  // Mesh of the sprites of one atlas page.
+  // offsets: Float32Array of x, y, z of every sprite (in the order of the sprites in the page)
+  function createSpriteMesh(offsets, atlas_shape, texture, sprite_size_in_3D) {
+    const num_sprites = offsets.length / 3;
+    const geometry = new THREE.InstancedBufferGeometry();
+    geometry.addAttribute(
+      "position",
+      new THREE.BufferAttribute(quad_positions, 3)
+    );
+    geometry.addAttribute("uv", new THREE.BufferAttribute(quad_uvs, 2));
+    geometry.setIndex(new THREE.BufferAttribute(quad_indices, 1));
+
+    // Lower left corner of every sprite in the page (v goes up, rows go down)
+    const uv_offsets = new Float32Array(2 * num_sprites);
+    for (let i = 0; i < num_sprites; i++) {
+      const y = Math.floor(i / atlas_shape.cols);
+      const x = i % atlas_shape.cols;
+      uv_offsets[2 * i] = x / atlas_shape.cols;
+      uv_offsets[2 * i + 1] = 1.0 - (y + 1) / atlas_shape.rows;
+    }
+    geometry.addAttribute(
+      "offset",
+      new THREE.InstancedBufferAttribute(offsets, 3, 1)
+    );
+    geometry.addAttribute(
+      "uv_offset",
+      new THREE.InstancedBufferAttribute(uv_offsets, 2, 1)
+    );
+    geometry.maxInstancedCount = num_sprites;
+
+    const material = new THREE.ShaderMaterial({
+      uniforms: {
+        map: { value: texture },
+        sprite_size: {
+          value: new THREE.Vector2(sprite_size_in_3D.width, sprite_size_in_3D.height),
+        },
+        uv_scale: {
+          value: new THREE.Vector2(1.0 / atlas_shape.cols, 1.0 / atlas_shape.rows),
+        },
+      },
+      vertexShader: vertexShader,
+      fragmentShader: fragmentShader,
+    });
+
+    const mesh = new THREE.Mesh(geometry, material);
+    // the bounding sphere of the geometry is the one of the unit quad, not of the sprites
+    mesh.frustumCulled = false;
+    return mesh;
+  }
+
+  function loadTexture(loader, url, onLoad) {
+    const texture = loader.load(url, onLoad);
+    // pages are not necessarily powers of two, and sprites are sampled close to their size
+    texture.generateMipmaps = false;
+    texture.minFilter = THREE.LinearFilter;
+    return texture;
+  }
+
+  /**
+   * Level of detail: density points everywhere, and for every leaf of the spatial index
+   * (see dlight.dissect.projections.write_lod_atlas) in view, sprites from its page when they
+   * are large on screen, from its downsampled page when they are smaller, nothing otherwise.
+   * Pages are loaded when needed and released least recently used first,
+   * beyond atlas.max_texture_bytes. Call update() before rendering.
+   */
+  function createLevelOfDetail(scene, camera, canvas_height, data, density, loader, render) {
+    const { atlas, sprite_size_in_3D } = data;
+    // below this size (in pixels) on screen sprites are not drawn, only density points
+    const min_sprite_pixels = 4;
+    const mip_sprite_height =
+      atlas.mip_page_size.height / atlas.shape.rows;
+    const level_bytes = {
+      page: 4 * atlas.page_size.height * atlas.page_size.width,
+      mip_page: 4 * atlas.mip_page_size.height * atlas.mip_page_size.width,
+    };
+
+    const points_geometry = new THREE.BufferGeometry();
+    points_geometry.addAttribute(
+      "position",
+      new THREE.BufferAttribute(density, 3)
+    );
+    scene.add(
+      new THREE.Points(
+        points_geometry,
+        new THREE.PointsMaterial({
+          color: 0x888888,
+          size: 2,
+          sizeAttenuation: false,
+          transparent: true,
+          opacity: 0.6,
+          depthWrite: false,
+          blending: THREE.AdditiveBlending,
+        })
+      )
+    );
+
+    const leaves = atlas.leaves.map((leaf) => ({
+      urls: { page: leaf.page, mip_page: leaf.mip_page },
+      positions_url: leaf.positions,
+      box: new THREE.Box3(
+        new THREE.Vector3(...leaf.bbox[0]),
+        new THREE.Vector3(...leaf.bbox[1])
+      ),
+      offsets: null, // Float32Array, once loaded
+      mesh: null,
+      mesh_url: null, // url of the texture of mesh
+    }));
+
+    // url -> {texture, bytes, ready}, least recently used first
+    const textures = new Map();
+    let texture_bytes = 0;
+
+    function useTexture(url, bytes) {
+      let entry = textures.get(url);
+      if (entry) {
+        textures.delete(url);
+      } else {
+        entry = { bytes: bytes, ready: false };
+        entry.texture = loadTexture(loader, url, () => {
+          if (textures.get(url) === entry) {
+            entry.ready = true;
+            render();
+          }
+        });
+        texture_bytes += bytes;
+      }
+      textures.set(url, entry);
+      return entry;
+    }
+
+    function evictTextures(needed_urls) {
+      for (const [url, entry] of textures) {
+        if (texture_bytes <= atlas.max_texture_bytes) break;
+        if (needed_urls.has(url)) continue;
+        entry.texture.dispose();
+        textures.delete(url);
+        texture_bytes -= entry.bytes;
+      }
+    }
+
+    function loadPositions(leaf) {
+      leaf.offsets = "loading";
+      fetch(leaf.positions_url)
+        .then((response) => response.arrayBuffer())
+        .then((buffer) => {
+          leaf.offsets = new Float32Array(buffer);
+          render();
+        })
+        .catch(() => {
+          leaf.offsets = null;
+        });
+    }
+
+    function showLevel(leaf, level) {
+      const has_texture = leaf.mesh !== null && textures.has(leaf.mesh_url);
+      if (leaf.mesh) leaf.mesh.visible = level !== null && has_texture;
+      if (level === null) return;
+      if (leaf.offsets === null) loadPositions(leaf);
+      const entry = useTexture(leaf.urls[level], level_bytes[level]);
+      // until the texture of level is ready, keep showing the one of the other level
+      if (leaf.offsets === "loading" || !entry.ready) return;
+
+      if (!leaf.mesh) {
+        leaf.mesh = createSpriteMesh(leaf.offsets, atlas.shape, entry.texture, sprite_size_in_3D);
+        scene.add(leaf.mesh);
+      }
+      leaf.mesh.material.uniforms.map.value = entry.texture;
+      leaf.mesh_url = leaf.urls[level];
+      leaf.mesh.visible = true;
+    }
+
+    const frustum = new THREE.Frustum();
+    const view_projection = new THREE.Matrix4();
+
+    function update() {
+      camera.updateMatrixWorld();
+      view_projection.multiplyMatrices(camera.projectionMatrix, camera.matrixWorldInverse);
+      frustum.setFromMatrix(view_projection);
+      // size on screen (in pixels) of a unit at distance 1 from the camera
+      const pixels_per_unit =
+        canvas_height / (2 * Math.tan(THREE.Math.degToRad(camera.fov / 2)));
+
+      // closest leaves first, as long as they fit into the budget
+      const in_view = [];
+      for (const leaf of leaves) {
+        if (!frustum.intersectsBox(leaf.box)) continue;
+        const distance = Math.max(leaf.box.distanceToPoint(camera.position), 1e-6);
+        const sprite_pixels = (sprite_size_in_3D.height * pixels_per_unit) / distance;
+        if (sprite_pixels >= min_sprite_pixels) {
+          in_view.push({ leaf, distance, sprite_pixels });
+        }
+      }
+      in_view.sort((a, b) => a.distance - b.distance);
+
+      // Downsampled pages for all leaves in view first, then full pages for the
+      // leaves whose sprites are larger than the downsampled ones (their downsampled pages
+      // stay loaded, they are shown until the full page is ready)
+      const levels = new Map();
+      const needed_urls = new Set();
+      let needed_bytes = 0;
+      for (const level of ["mip_page", "page"]) {
+        for (const { leaf, sprite_pixels } of in_view) {
+          if (level === "page" && (!levels.has(leaf) || sprite_pixels <= mip_sprite_height)) continue;
+          if (needed_bytes + level_bytes[level] > atlas.max_texture_bytes) break;
+          levels.set(leaf, level);
+          needed_urls.add(leaf.urls[level]);
+          needed_bytes += level_bytes[level];
+        }
+      }
+
+      evictTextures(needed_urls);
+      for (const leaf of leaves) {
+        showLevel(leaf, levels.has(leaf) ? levels.get(leaf) : null);
+      }
+    }
+
+    return { update: update };
+  }
+
   return (container, data) => {
     /** data should contain the following:
      * {
-     *   embedding: ([list of tuples (x, y, z)]),
+     *   embedding: tensor of shape [num_sprites, 3] encoded by
+     *     dlight.utils.tensor_codec.encode_tensor,
      *   atlas: {
-     *     path: str,
-     *     shape: {rows: int, cols: int},
+     *     pages: [str], // paths of atlas pages
+     *     shape: {rows: int, cols: int}, // grid of sprites in each page
      *     num_sprites: int,
      *     sprite_size: {height: int, width: int}
      *   },
      *   sprite_size_in_3D: {height: float, width: float},
-     *   initial_camera_z: float
+     *   initial_camera_z: float,
+     *   lod: bool
+     * }
+     * If lod is true, embedding is a sample of the embedding (shown as density points)
+     * and atlas is a level-of-detail atlas (see dlight.dissect.projections.write_lod_atlas):
+     * {
+     *   leaves: [{bbox: [[x, y, z], [x, y, z]], num_sprites: int,
+     *             page: str, mip_page: str, positions: str}],
+     *   shape: {rows: int, cols: int},
+     *   page_size: {height: int, width: int},
+     *   mip_page_size: {height: int, width: int},
+     *   max_texture_bytes: int,
+     *   ...
      * }
      */
-    const { embedding, atlas, sprite_size_in_3D, initial_camera_z } = data;
-    atlas.height = atlas.shape.rows * atlas.sprite_size.height;
-    atlas.width = atlas.shape.cols * atlas.sprite_size.width;
+    const { atlas, sprite_size_in_3D, initial_camera_z } = data;
+    // x, y, z of sprite i are at 3 * i, 3 * i + 1, 3 * i + 2
+    const embedding = tensor_codec.decode(data.embedding).data;
+    const sprites_per_page = atlas.shape.rows * atlas.shape.cols;
+    var level_of_detail = null;
 
     const canvas_width = Math.floor(1.0 * container.offsetWidth);
     const canvas_height = Math.floor(0.6 * canvas_width);
 
     const scene = new THREE.Scene();
-    var mesh;
 
     var fieldOfView = 75;
     var aspectRatio = canvas_width / canvas_height;
@@ -48,164 +320,33 @@ define("sprite_visualizer", ["THREE"], function (THREE) {
     container.appendChild(renderer.domElement);
 
     // Create a texture loader so we can load the
-    // atlas image file into a custom material
+    // atlas page image files into custom materials
     var loader = new THREE.TextureLoader();
-    var material = new THREE.MeshBasicMaterial({
-      map: loader.load(atlas.path),
-    });
 
-    // Add four vertices (one for each corner), in the following order:
-    // lower left, lower right, upper right, upper left.
-    // Assumes quads are facing -z axis.
-    // Return index of the first vertex of this quad in geom.vertices
-    function addQuad(geom, x, y, z, height, width) {
-      let dx = width / 2.0;
-      let dy = height / 2.0;
-      geom.vertices.push(
-        new THREE.Vector3(x - dx, y - dy, z),
-        new THREE.Vector3(x + dx, y - dy, z),
-        new THREE.Vector3(x + dx, y + dy, z),
-        new THREE.Vector3(x - dx, y + dy, z)
+    if (data.lod) {
+      // Only a sample of the embedding, shown as density points.
+      // Sprites are loaded by leaf of the spatial index, see createLevelOfDetail
+      level_of_detail = createLevelOfDetail(
+        scene, camera, canvas_height, data, embedding, loader, render
       );
-      return geom.vertices.length - 4;
-    }
-
-    // Add two faces for the quad.
-    // Assumes that the vertices have been added to geom,
-    // using the order specified in addQuad.
-    // Assumes quads are facing -z axis.
-    function addQuadFaces(geom, vtx1_idx) {
-      geom.faces.push(
-        // the lower-right triangle
-        new THREE.Face3(vtx1_idx, vtx1_idx + 1, vtx1_idx + 2),
-        // the upper-left triangle
-        new THREE.Face3(vtx1_idx, vtx1_idx + 2, vtx1_idx + 3)
-      );
-
-      // // compute orientation of quad
-      // let v1 = geom.vertices[vtx1_idx+1].clone().sub(geom.vertices[vtx1_idx]);
-      // let v2 = geom.vertices[vtx1_idx+2].clone().sub(geom.vertices[vtx1_idx+1]);
-      // v1.cross(v2);
-      // v1.normalize();
-      // return v1;
-    }
-
-    // Add UV coordinates for each vertex of last two faces
-    function addQuadUVs(geom, u_left, u_right, v_top, v_bottom) {
-      geom.faceVertexUvs[0].push([
-        new THREE.Vector2(u_left, v_bottom),
-        new THREE.Vector2(u_right, v_bottom),
-        new THREE.Vector2(u_right, v_top),
-      ]);
-      geom.faceVertexUvs[0].push([
-        new THREE.Vector2(u_left, v_bottom),
-        new THREE.Vector2(u_right, v_top),
-        new THREE.Vector2(u_left, v_top),
-      ]);
-    }
-
-    // Create the empty geometry
-    const geometry = new THREE.Geometry();
-
-    // For each sprite in atlas,
-    for (let y = 0; y < atlas.shape.rows; y++) {
-      for (let x = 0; x < atlas.shape.cols; x++) {
-        const sprite_idx = y * atlas.shape.cols + x;
-        if (sprite_idx < atlas.num_sprites) {
-          const vtx1_idx = addQuad(
-            geometry,
-            embedding[sprite_idx][0],
-            embedding[sprite_idx][1],
-            embedding[sprite_idx][2],
-            sprite_size_in_3D.height,
-            sprite_size_in_3D.width
-          );
-
-          addQuadFaces(geometry, vtx1_idx);
-
-          const u_left = (x * atlas.sprite_size.width) / atlas.width;
-          const u_right = u_left + 1.0 / atlas.shape.cols;
-
-          const v_top = 1.0 - (y * atlas.sprite_size.height) / atlas.height;
-          const v_bottom = v_top - 1.0 / atlas.shape.rows;
-
-          addQuadUVs(geometry, u_left, u_right, v_top, v_bottom);
-        }
-      }
-    }
-
-    // // Rotate an object around an arbitrary axis in world space
-    // // https://stackoverflow.com/a/11060965
-    // function rotateAroundWorldAxis(object, rotWorldMatrix) {
-    //     // old code for Three.JS pre r54:
-    //     //  rotWorldMatrix.multiply(object.matrix);
-    //     // new code for Three.JS r55+:
-    //     rotWorldMatrix.multiply(object.matrix);                // pre-multiply
-
-    //     object.matrix = rotWorldMatrix;
-
-    //     // old code for Three.js pre r49:
-    //     // object.rotation.getRotationFromMatrix(object.matrix, object.scale);
-    //     // old code for Three.js pre r59:
-    //     // object.rotation.setEulerFromRotationMatrix(object.matrix);
-    //     // code for r59+:
-    //     object.rotation.setFromRotationMatrix(object.matrix);
-    // }
-
-    // Always orient quads toward the camera
-    function updateQuadOrientation() {
-      // ----------------- Method1 (orthographic projection) ---------------------
-      let new_orientation = new THREE.Vector3();
-      camera.getWorldDirection(new_orientation);
-      new_orientation.multiplyScalar(-1);
-      new_orientation.normalize();
-      let x_dir = camera.up.clone().cross(new_orientation).normalize();
-      let y_dir = new_orientation.clone().cross(x_dir);
-
-      let dw = x_dir.clone().multiplyScalar(sprite_size_in_3D.width / 2.0);
-      let dh = y_dir.clone().multiplyScalar(sprite_size_in_3D.height / 2.0);
-      // -------------------------------------------------------------------------
-
-      for (let sprite_idx = 0; sprite_idx < atlas.num_sprites; sprite_idx++) {
-        let sprite_vtx1_idx = sprite_idx * 4;
-
-        let quad_pos = new THREE.Vector3(
-          embedding[sprite_idx][0],
-          embedding[sprite_idx][1],
-          embedding[sprite_idx][2]
+    } else {
+      // For each page of the atlas,
+      for (let page_idx = 0; page_idx < atlas.pages.length; page_idx++) {
+        const first_sprite_idx = page_idx * sprites_per_page;
+        const num_sprites = Math.min(
+          sprites_per_page,
+          atlas.num_sprites - first_sprite_idx
         );
-
-        // ----------------- Method2 (perspective projection) ---------------------
-        // let new_orientation = camera.position.clone().sub(quad_pos);
-        // new_orientation.normalize();
-        // let x_dir = camera.up.clone().cross(new_orientation).normalize();
-        // let y_dir = new_orientation.clone().cross(x_dir);
-
-        // let dw = x_dir.clone().multiplyScalar(sprite_size_in_3D.width / 2.0);
-        // let dh = y_dir.clone().multiplyScalar(sprite_size_in_3D.height / 2.0);
-        // -------------------------------------------------------------------------
-
-        mesh.geometry.vertices[sprite_vtx1_idx + 0].copy(
-          quad_pos.clone().sub(dw).sub(dh)
-        );
-        mesh.geometry.vertices[sprite_vtx1_idx + 1].copy(
-          quad_pos.clone().add(dw).sub(dh)
-        );
-        mesh.geometry.vertices[sprite_vtx1_idx + 2].copy(
-          quad_pos.clone().add(dw).add(dh)
-        );
-        mesh.geometry.vertices[sprite_vtx1_idx + 3].copy(
-          quad_pos.clone().sub(dw).add(dh)
+        // Sprites of a page are contiguous in the embedding
+        const offsets = embedding.subarray(
+          3 * first_sprite_idx,
+          3 * (first_sprite_idx + num_sprites)
         );
+        const texture = loadTexture(loader, atlas.pages[page_idx], render);
+        scene.add(createSpriteMesh(offsets, atlas.shape, texture, sprite_size_in_3D));
       }
-      mesh.geometry.verticesNeedUpdate = true;
     }
 
-    // Combine the image geometry and material into a mesh
-    mesh = new THREE.Mesh(geometry, material);
-    mesh.position.set(0, 0, 0);
-    scene.add(mesh);
-
     // Add controls
     var controls = new THREE.TrackballControls(camera, renderer.domElement);
     controls.rotateSpeed = 1.0;
@@ -219,7 +360,6 @@ define("sprite_visualizer", ["THREE"], function (THREE) {
     controls.dynamicDampingFactor = 0.2;
 
     controls.keys = [65, 83, 68];
-    // controls.addEventListener( 'change', updateQuadOrientation );
     controls.addEventListener("change", render);
 
     var axisHelper = new THREE.AxesHelper(
@@ -241,15 +381,13 @@ define("sprite_visualizer", ["THREE"], function (THREE) {
     );
 
     function render() {
-      updateQuadOrientation();
+      if (level_of_detail) level_of_detail.update();
       renderer.render(scene, camera);
-      // mesh.lookAt(camera.position);
     }
 
     // The main animation function
     function animate() {
       controls.update();
-      // render()
       requestAnimationFrame(animate);
     }
     animate();
@@ -0,0 +1,71 @@
+// Uncomment for debugging
+// require.undef("tensor_codec");
+
+// Decodes tensors encoded by dlight.utils.tensor_codec.encode_tensor
+define("tensor_codec", [], function () {
+  function base64ToBytes(base64) {
+    const binary = atob(base64);
+    const bytes = new Uint8Array(binary.length);
+    for (let i = 0; i < binary.length; i++) {
+      bytes[i] = binary.charCodeAt(i);
+    }
+    return bytes;
+  }
+
+  // IEEE 754 half precision to float
+  function halfToFloat(h) {
+    const sign = h & 0x8000 ? -1 : 1;
+    const exponent = (h >> 10) & 0x1f;
+    const fraction = h & 0x03ff;
+    if (exponent === 0) return sign * Math.pow(2, -14) * (fraction / 1024);
+    if (exponent === 31) return fraction ? NaN : sign * Infinity;
+    return sign * Math.pow(2, exponent - 15) * (1 + fraction / 1024);
+  }
+
+  /** Returns {shape: [int], data: Float32Array} (values in row-major order) */
+  function decode(encoded) {
+    const bytes = base64ToBytes(encoded.data);
+    let data;
+    if (encoded.encoding === "float32") {
+      data = new Float32Array(bytes.buffer);
+    } else if (encoded.encoding === "float16") {
+      const halves = new Uint16Array(bytes.buffer);
+      data = new Float32Array(halves.length);
+      for (let i = 0; i < halves.length; i++) {
+        data[i] = halfToFloat(halves[i]);
+      }
+    } else if (encoded.encoding === "uint8") {
+      data = new Float32Array(bytes.length);
+      for (let i = 0; i < bytes.length; i++) {
+        data[i] = encoded.offset + encoded.scale * bytes[i];
+      }
+    } else {
+      throw new Error("Unsupported tensor encoding: " + encoded.encoding);
+    }
+    return { shape: encoded.shape, data: data };
+  }
+
+  /**
+   * Split a decoded tensor of shape (B, C, H, W) into nested arrays [B][C]
+   * of images {values: Float32Array view of length H * W, height: H, width: W}
+   */
+  function toImages(tensor) {
+    const [num_images, num_channels, height, width] = tensor.shape;
+    const images = [];
+    for (let b = 0; b < num_images; b++) {
+      const channels = [];
+      for (let c = 0; c < num_channels; c++) {
+        const start = (b * num_channels + c) * height * width;
+        channels.push({
+          values: tensor.data.subarray(start, start + height * width),
+          height: height,
+          width: width,
+        });
+      }
+      images.push(channels);
+    }
+    return images;
+  }
+
+  return { decode: decode, toImages: toImages };
+});
@@ -0,0 +1,278 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import torch
+
+
+# Opt-in instrumentation of the dlight entry points. Entry points are decorated with
+# @profile and their stages (forward pass, serialization, PNG encoding, projections, ...)
+# are wrapped in span(...). Nothing is recorded (and the overhead is one flag check)
+# unless profiling is enabled.
+#
+# Usage:
+#     import dlight.utils.profiling as dprofiling
+#     with dprofiling.profiling():
+#         dlight.dissect.conv.show_conv_dissection(input_to_conv, model.conv2, 3)
+#     print(dprofiling.report())
+#     dprofiling.export_chrome_trace("trace.json") # open in chrome://tracing or https://ui.perfetto.dev
+
+enabled = False
+
+_events = [] # finished spans, as dicts
+_events_lock = threading.Lock()
+_local = threading.local() # stack of open spans of the current thread
+
+
+class span:
+    """ Context manager that records the wall time of a stage, and optionally
+        the bytes it serialized and the memory of the tensors it produced.
+
+        Usage:
+            with span("serialize") as s:
+                payload = json.dumps(data)
+                s.add_bytes(len(payload))
+    """
+
+    def __init__(self, name, **args):
+        """
+        Args:
+            name ([str]): name of the stage
+            args: extra information shown in the Chrome trace, e.g. shape=list(x.shape)
+        """
+        self.name = name
+        self.args = args
+        self.bytes = 0
+        self.tensor_bytes = 0
+        self._active = False
+        self._children_ns = 0
+
+    def __enter__(self):
+        if not enabled:
+            return self
+        self._active = True
+        stack = _stack()
+        self.depth = len(stack)
+        stack.append(self)
+        self._cuda_memory = _cuda_memory()
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self._active:
+            return
+        end = time.perf_counter_ns()
+        self._active = False
+        stack = _stack()
+        stack.pop()
+        if stack:
+            stack[-1]._children_ns += end - self._start
+        event = {
+            "name": self.name,
+            "start_ns": self._start,
+            "duration_ns": end - self._start,
+            "self_ns": end - self._start - self._children_ns,
+            "depth": self.depth,
+            "thread": threading.get_ident(),
+            "bytes": self.bytes,
+            "tensor_bytes": self.tensor_bytes,
+            "args": self.args,
+        }
+        if self._cuda_memory is not None:
+            event["cuda_memory_delta"] = _cuda_memory() - self._cuda_memory
+        with _events_lock:
+            _events.append(event)
+
+    def add_bytes(self, num_bytes):
+        """ Count num_bytes as serialized (or written) by this span """
+        self.bytes += int(num_bytes)
+
+    def add_tensors(self, *tensors):
+        """ Count the memory of tensors (and of tensors nested in tuples, lists and dicts) """
+        self.tensor_bytes += tensor_bytes(tensors)
+
+
+def profile(func=None, name=None):
+    """ Decorator that wraps each call of func in a span. The memory of the tensors
+        returned by func is counted as the tensor memory of the span.
+
+        Usage:
+            @profile
+            def get_conv_dissection(...):
+
+            @profile(name="conv dissection")
+            def get_conv_dissection(...):
+    """
+    if func is None:
+        return lambda func: profile(func, name)
+    span_name = name or func.__module__.replace("dlight.", "") + "." + func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return func(*args, **kwargs)
+        with span(span_name) as s:
+            result = func(*args, **kwargs)
+            s.add_tensors(result)
+            return result
+    return wrapper
+
+
+def current_span():
+    """ The innermost open span of the current thread, or None """
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+def add_bytes(num_bytes):
+    """ Count num_bytes as serialized by the innermost open span (no-op if profiling is disabled) """
+    s = current_span()
+    if s is not None:
+        s.add_bytes(num_bytes)
+
+
+def tensor_bytes(obj):
+    """ Memory of the tensors in obj (a Tensor, or tuples, lists and dicts of them), in bytes """
+    if isinstance(obj, torch.Tensor):
+        return obj.numel() * obj.element_size()
+    if isinstance(obj, (tuple, list)):
+        return sum(tensor_bytes(item) for item in obj)
+    if isinstance(obj, dict):
+        return sum(tensor_bytes(item) for item in obj.values())
+    return 0
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    """ Forget recorded spans """
+    with _events_lock:
+        _events.clear()
+
+
+class profiling:
+    """ Context manager that enables profiling inside of it. Recorded spans are kept
+        after it exits, for report and export_chrome_trace.
+
+        Usage:
+            with profiling():
+                ...
+            print(report())
+    """
+
+    def __init__(self, reset_events=True):
+        """
+        Args:
+            reset_events ([bool]): forget spans recorded earlier
+        """
+        self.reset_events = reset_events
+
+    def __enter__(self):
+        if self.reset_events:
+            reset()
+        self._was_enabled = enabled
+        enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self._was_enabled:
+            disable()
+
+
+def events():
+    """ [list of dicts]: recorded spans, in the order they finished """
+    with _events_lock:
+        return list(_events)
+
+
+def summary():
+    """ Recorded spans aggregated by name
+
+    Returns:
+        [OrderedDict]: name -> {"count", "total_s", "self_s", "max_s", "bytes", "tensor_bytes"},
+            sorted by total time (descending). self_s excludes the time of nested spans.
+    """
+    stats = {}
+    for event in events():
+        entry = stats.setdefault(event["name"],
+            {"count": 0, "total_s": 0.0, "self_s": 0.0, "max_s": 0.0, "bytes": 0, "tensor_bytes": 0})
+        entry["count"] += 1
+        entry["total_s"] += event["duration_ns"] / 1e9
+        entry["self_s"] += event["self_ns"] / 1e9
+        entry["max_s"] = max(entry["max_s"], event["duration_ns"] / 1e9)
+        entry["bytes"] += event["bytes"]
+        entry["tensor_bytes"] += event["tensor_bytes"]
+    return OrderedDict(sorted(stats.items(), key=lambda item: -item[1]["total_s"]))
+
+
+def report():
+    """ [str]: table of summary() """
+    lines = ["{:<56} {:>6} {:>10} {:>10} {:>10} {:>12} {:>12}".format(
+        "span", "count", "total s", "self s", "max s", "serialized", "tensors")]
+    for name, entry in summary().items():
+        lines.append("{:<56} {:>6} {:>10.4f} {:>10.4f} {:>10.4f} {:>12} {:>12}".format(
+            name[:56], entry["count"], entry["total_s"], entry["self_s"], entry["max_s"],
+            format_bytes(entry["bytes"]), format_bytes(entry["tensor_bytes"])))
+    return "\n".join(lines)
+
+
+def export_chrome_trace(path):
+    """ Write recorded spans in the Chrome trace event format
+        (https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU),
+        viewable in chrome://tracing or https://ui.perfetto.dev
+    """
+    pid = os.getpid()
+    trace_events = []
+    for event in events():
+        args = dict(event["args"])
+        args.update({"bytes": event["bytes"], "tensor_bytes": event["tensor_bytes"]})
+        if "cuda_memory_delta" in event:
+            args["cuda_memory_delta"] = event["cuda_memory_delta"]
+        trace_events.append({
+            "name": event["name"],
+            "ph": "X", # complete event
+            "ts": event["start_ns"] / 1e3, # microseconds
+            "dur": event["duration_ns"] / 1e3,
+            "pid": pid,
+            "tid": event["thread"],
+            "args": {key: _jsonable(value) for key, value in args.items()},
+        })
+    with open(path, "w") as f:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+
+
+def format_bytes(num_bytes):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(num_bytes) < 1024 or unit == "GB":
+            return ("{:.0f} " if unit == "B" else "{:.1f} ").format(num_bytes) + unit
+        num_bytes /= 1024.0
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def _cuda_memory():
+    if torch.cuda.is_available() and torch.cuda.is_initialized():
+        return torch.cuda.memory_allocated()
+    return None
+
+
+def _jsonable(value):
+    try:
+        json.dumps(value)
+        return value
+    except TypeError:
+        return str(value)
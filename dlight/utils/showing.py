@@ -1,21 +1,27 @@
-import os.path as osp
 from random import randrange
 import json
-import IPython.display as ipd
-import dlight
+import torch
+import dlight.utils.assets as dassets
+import dlight.utils.profiling as dprofiling
+import dlight.utils.tensor_codec as dcodec
 
 
-def visualize_sprites(embedding, atlas, sprite_size_in_3D=None, initial_camera_z=60.0):
+@dprofiling.profile
+def visualize_sprites(embedding, atlas, sprite_size_in_3D=None, initial_camera_z=60.0,
+        lod=False, max_density_points=20000, max_texture_mb=256):
     """ Plot sprites from the atlas in 3D using embedding as coordinates
 
     Args:
-        embedding ([list of tuples (x, y, z)]): The order has to follow the order
-            of sprites in atlas (left to right first, then top to bottom)
+        embedding ([Tensor, ndarray or list of tuples (x, y, z)]): shape [num_sprites, 3].
+            The order has to follow the order of sprites in atlas
+            (left to right first, then top to bottom, then page by page).
+            It is sent to the notebook as binary float32 (see dlight.utils.tensor_codec)
         atlas ([dict]): dict with the following items:
             {
-                "path": path to PNG file of atlas. Should be relative to /usr/local/share/jupyter
+                "pages": paths to PNG files of atlas pages. Should be relative to /usr/local/share/jupyter
                         See https://stackoverflow.com/a/49487396/13344574
-                "shape": {"rows": num_rows_in_atlas, "cols": num_cols_in_atlas},
+                        Sprites fill the pages in order (see dlight.dissect.projections.build_atlas_pages)
+                "shape": {"rows": num_rows_in_page, "cols": num_cols_in_page},
                 "num_sprites": number of sprites within the atlas,
                 "sprite_size": {"height": height of single sprite,
                                 "width": width of single sprite}
@@ -26,21 +32,43 @@ def visualize_sprites(embedding, atlas, sprite_size_in_3D=None, initial_camera_z
         sprite_size_in_3D ([dict]): {"height", expected height of single sprite in 3D, 
                                      "width", expected width of single sprite in 3D}
         initial_camera_z ([float]): initial z position of camera
+
+        lod ([bool]): level-of-detail mode. atlas must then be a level-of-detail atlas
+            (see dlight.dissect.projections.write_lod_atlas), and embedding is only used for
+            the density points shown when zoomed out. Sprites are loaded from the atlas
+            for the regions close to the camera (downsampled sprites a bit further away).
+        max_density_points ([int]): (lod mode) max number of density points.
+            A random sample of embedding is sent if it has more points.
+        max_texture_mb ([float]): (lod mode) GPU memory budget for loaded atlas pages.
+            Least recently used pages are released beyond it.
     """
+    import IPython.display as ipd
+
     if sprite_size_in_3D is None:
         sprite_size_in_3D = {'height': 4.0, "width": 4.0}
 
+    embedding = torch.as_tensor(embedding, dtype=torch.float32)
+    assert len(embedding.shape) == 2 and embedding.shape[1] == 3, \
+        "embedding must have shape [num_sprites, 3]. Instead got: " + str(list(embedding.shape))
+    if lod:
+        assert "leaves" in atlas, "lod mode needs a level-of-detail atlas (see write_lod_atlas)"
+        if embedding.shape[0] > max_density_points:
+            embedding = embedding[torch.randperm(embedding.shape[0])[:max_density_points]]
+        atlas = dict(atlas, max_texture_bytes=int(max_texture_mb * 1024 ** 2))
+
     data = {
-        "embedding": embedding,
+        "embedding": dcodec.encode_tensor(embedding),
         "atlas": atlas,
         "sprite_size_in_3D": sprite_size_in_3D,
-        "initial_camera_z": initial_camera_z
+        "initial_camera_z": initial_camera_z,
+        "lod": lod
     }
 
-    dlight.load_js_libs()
-    utils_dir = osp.dirname(osp.realpath(__file__))
-    ipd.display(ipd.Javascript(filename=osp.join(utils_dir, "js", "sprite_visualizer.js")))
-    ipd.display(ipd.HTML(filename=osp.join(utils_dir, "js", "sprite_visualizer.css.html")))
+    dassets.use(["sprite_visualizer"])
+
+    with dprofiling.span("serialize") as s:
+        payload = json.dumps(data)
+        s.add_bytes(len(payload))
 
     container_id = "sprite-visualizer-container-" + str(randrange(1000))
     ipd.display(ipd.HTML("<div id='{}'></div> ".format(container_id)))
@@ -48,4 +76,4 @@ def visualize_sprites(embedding, atlas, sprite_size_in_3D=None, initial_camera_z
             require(['sprite_visualizer'], function(sprite_visualizer) {{
                 sprite_visualizer(document.getElementById("{}"), {});
             }});
-        """.format(container_id, json.dumps(data))))
+        """.format(container_id, payload)))
@@ -0,0 +1,52 @@
+import base64
+import numpy as np
+import dlight.utils.profiling as dprofiling
+
+
+# Supported encodings of encode_tensor. Decoded in JS by the "tensor_codec"
+# module (see js/tensor_codec.js)
+ENCODINGS = ("float32", "float16", "uint8")
+
+
+@dprofiling.profile
+def encode_tensor(tensor, encoding="float32"):
+    """ Encode a tensor as a compact, JSON-serializable dict holding its values as a
+        base64 string of a little-endian typed array, instead of nested lists of floats.
+
+    Args:
+        tensor ([Tensor]): tensor of any shape
+        encoding ([str]): one of ENCODINGS.
+            "float16" halves the payload of "float32", at a relative precision of ~1e-3.
+            Values above 65504 in magnitude become inf.
+            "uint8" quantizes values linearly between min and max of the tensor
+            (256 levels), which is usually enough for visualization.
+
+    Returns:
+        [dict]: {
+            "encoding": str,
+            "shape": list of ints,
+            "data": base64 string,
+            "offset", "scale" (only for "uint8"): value = offset + scale * quantized_value
+        }
+    """
+    array = tensor.detach().cpu().float().numpy()
+    encoded = {"encoding": encoding, "shape": list(array.shape)}
+
+    if encoding == "float32":
+        data = array.astype("<f4")
+    elif encoding == "float16":
+        data = array.astype("<f2")
+    elif encoding == "uint8":
+        offset = float(array.min()) if array.size > 0 else 0.0
+        scale = (float(array.max()) - offset) / 255.0 if array.size > 0 else 0.0
+        if scale == 0.0:
+            scale = 1.0
+        data = np.round((array - offset) / scale).astype(np.uint8)
+        encoded["offset"] = offset
+        encoded["scale"] = scale
+    else:
+        raise ValueError("encoding must be one of " + str(ENCODINGS) + ". Instead got: " + str(encoding))
+
+    encoded["data"] = base64.b64encode(data.tobytes()).decode("ascii")
+    dprofiling.add_bytes(len(encoded["data"]))
+    return encoded
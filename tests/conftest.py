@@ -0,0 +1,17 @@
+import os
+import sys
+import matplotlib
+matplotlib.use("Agg")
+import pytest
+import torch
+
+# Correctness tests of the dissect functions, on CPU. Run with:
+#   python -m pytest tests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def seed():
+    torch.manual_seed(0)
+    yield
@@ -0,0 +1,51 @@
+import pytest
+import torch
+import torchvision
+import dlight.dissect.activations as dactivations
+import dlight.utils.image as dimage
+
+
+def _reference_grids(inputs, activations, num_cols):
+    """ Grids of show_activations built with torchvision.utils.make_grid: every input is
+        followed by empty images, and the channels of every input by empty channels,
+        to fill its group of rows
+    """
+    num_inputs, num_channels, height, width = activations.shape
+    num_cols = min(num_cols, num_channels)
+    num_rows_per_input = -(-num_channels // num_cols)
+
+    padded_inputs = torch.zeros((num_inputs, num_rows_per_input) + tuple(inputs.shape[1:]))
+    padded_inputs[:, 0] = inputs
+    inputs_grid = torchvision.utils.make_grid(padded_inputs.flatten(0, 1), nrow=1)
+
+    padded_activations = torch.zeros(num_inputs, num_rows_per_input * num_cols, height, width)
+    padded_activations[:, :num_channels] = activations
+    activations_grid = torchvision.utils.make_grid(padded_activations.reshape(-1, 1, height, width), nrow=num_cols)
+    # make_grid turns single channel images into 3 equal channels
+    return dimage.normalize(inputs_grid[:inputs.shape[1]]), dimage.normalize(activations_grid[0])
+
+
+@pytest.mark.parametrize("inputs_shape, activations_shape, num_cols", [
+    ((5, 1, 28, 28), (5, 8, 28, 28), 16),
+    ((4, 3, 20, 20), (4, 37, 10, 12), 16),
+    ((3, 1, 9, 9), (3, 32, 7, 7), 16),
+    ((2, 3, 8, 8), (2, 5, 6, 6), 2),
+])
+def test_grids_match_make_grid(inputs_shape, activations_shape, num_cols):
+    inputs = torch.rand(inputs_shape)
+    activations = torch.randn(activations_shape)
+    inputs_grid, activations_grid = dactivations.get_activations_grid(inputs, activations, num_cols)
+
+    expected_inputs_grid, expected_activations_grid = _reference_grids(inputs, activations, num_cols)
+    assert torch.allclose(inputs_grid, expected_inputs_grid)
+    assert torch.allclose(activations_grid, expected_activations_grid)
+
+
+def test_grid_rows():
+    inputs = torch.rand(6, 1, 8, 8)
+    activations = torch.randn(6, 4, 8, 8)
+    inputs_grid, activations_grid = dactivations.get_activations_grid(inputs, activations, rows=(2, 4))
+
+    expected_inputs_grid, expected_activations_grid = _reference_grids(inputs[2:4], activations[2:4], 16)
+    assert torch.allclose(inputs_grid, expected_inputs_grid)
+    assert torch.allclose(activations_grid, expected_activations_grid)
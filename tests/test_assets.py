@@ -0,0 +1,55 @@
+import os.path as osp
+import pytest
+import dlight.utils.assets as dassets
+
+
+@pytest.fixture
+def displayed(tmp_path, monkeypatch):
+    """ Display objects sent to the notebook, with the libraries copied into tmp_path """
+    import IPython.display as ipd
+    displayed = []
+    monkeypatch.setattr(ipd, "display", displayed.append)
+    monkeypatch.setattr(dassets, "nbextension_dir", str(tmp_path / "nbextensions" / "dlight"))
+    monkeypatch.setattr(dassets, "library_source", "local")
+    dassets.reset()
+    yield displayed
+    dassets.reset()
+
+
+def _sources(displayed):
+    return [display_object.data or "" for display_object in displayed]
+
+
+def test_local_libraries_are_served_from_nbextensions(displayed):
+    dassets.use(["d3"])
+    config = "require.config({paths: {d3: '/nbextensions/dlight/d3.v5.7.min'}});"
+    assert config in _sources(displayed)
+    with open(osp.join(dassets.dlight_dir, "lib", "d3.v5.7.min.js")) as f:
+        with open(osp.join(dassets.nbextension_dir, "d3.v5.7.min.js")) as g:
+            assert f.read() == g.read()
+    assert sum(len(source) for source in _sources(displayed)) < 1000
+
+
+def test_assets_are_injected_once_per_scope(displayed):
+    dassets.use(["sprite_visualizer"])
+    num_displayed = len(displayed)
+    dassets.use(["sprite_visualizer", "THREE"])
+    assert len(displayed) == num_displayed
+    dassets.reset()
+    dassets.use(["THREE"])
+    assert len(displayed) == num_displayed + 2 # require and THREE
+
+
+def test_unwritable_nbextensions_inline_libraries(displayed, tmp_path, monkeypatch):
+    (tmp_path / "file").write_text("")
+    monkeypatch.setattr(dassets, "nbextension_dir", str(tmp_path / "file" / "dlight"))
+    dassets.use(["d3"])
+    assert any("define('d3'" in source for source in _sources(displayed))
+
+
+def test_cdn_is_opt_in(displayed):
+    dassets.set_library_source("cdn")
+    dassets.use(["THREE"])
+    assert "require.config({paths: {THREE: '" + dassets.cdn_paths["THREE"] + "'}});" in _sources(displayed)
+    with pytest.raises(ValueError):
+        dassets.set_library_source("unpkg")
@@ -0,0 +1,39 @@
+import pytest
+import torch
+import dlight.dissect.projections as dprojections
+
+
+def _sprite(pages, rows, cols, idx):
+    """ Sprite idx of the atlas, read back from its page, shape [H, W, 4] """
+    page_idx, position = divmod(idx, rows * cols)
+    row, col = divmod(position, cols)
+    height, width = pages.shape[1] // rows, pages.shape[2] // cols
+    return pages[page_idx, row * height:(row + 1) * height, col * width:(col + 1) * width]
+
+
+@pytest.mark.parametrize("num_images, max_texture_size", [(10, 4096), (10, 12), (37, 20), (1, 5)])
+def test_sprites_are_tiled_in_order(num_images, max_texture_size):
+    inputs = torch.rand(num_images, 4, 5, 4)
+    pages, rows, cols = dprojections.build_atlas_pages(inputs, max_texture_size)
+
+    assert pages.dtype == torch.uint8
+    assert pages.shape[1:] == (rows * 5, cols * 4, 4)
+    assert rows * 5 <= max_texture_size and cols * 4 <= max_texture_size
+    assert pages.shape[0] * rows * cols >= num_images > (pages.shape[0] - 1) * rows * cols
+    expected = torch.clamp(inputs * 255.0, 0, 255).byte().permute(0, 2, 3, 1)
+    for idx in range(num_images):
+        assert torch.equal(_sprite(pages, rows, cols, idx), expected[idx])
+    # the rest of the last page is transparent
+    for idx in range(num_images, pages.shape[0] * rows * cols):
+        assert torch.all(_sprite(pages, rows, cols, idx) == 0)
+
+
+def test_small_atlases_are_square():
+    _, rows, cols = dprojections.build_atlas_pages(torch.rand(16, 4, 3, 3), 4096)
+    assert (rows, cols) == (4, 4)
+
+
+def test_sprites_larger_than_texture():
+    with pytest.raises(ValueError):
+        dprojections.build_atlas_pages(torch.rand(2, 4, 10, 10), 8)
+
@@ -0,0 +1,36 @@
+import pytest
+import torch
+import torch.nn as nn
+import dlight.dissect.attribution as dattribution
+
+
+def _model():
+    return nn.Sequential(nn.Conv2d(2, 4, 3), nn.Softplus(), nn.Flatten(), nn.Linear(4 * 6 * 6, 3)).eval()
+
+
+@pytest.mark.parametrize("batch_size", [7, 256])
+def test_integrated_gradients_completeness(batch_size):
+    model = _model()
+    inputs = torch.rand(4, 2, 8, 8)
+    baseline = torch.rand(1, 2, 8, 8)
+    outer_idx = [0, 1, 2, 1]
+
+    attributions = dattribution.get_attributions(model, inputs, outer_idx, "integrated-gradients",
+        baseline=baseline, num_steps=128, batch_size=batch_size)
+
+    with torch.no_grad():
+        expected = model(inputs)[torch.arange(4), outer_idx] - model(baseline)[0, outer_idx]
+    assert attributions.shape == inputs.shape
+    assert torch.allclose(torch.sum(attributions, dim=(1, 2, 3)), expected, rtol=1e-3, atol=1e-3)
+
+
+def test_gradient_methods():
+    model = _model()
+    inputs = torch.rand(5, 2, 8, 8)
+    inputs_with_grad = inputs.clone().requires_grad_(True)
+    torch.sum(model(inputs_with_grad)[:, 2]).backward()
+
+    saliency = dattribution.get_attributions(model, inputs, 2, "saliency", batch_size=2)
+    gradient_x_input = dattribution.get_attributions(model, inputs, 2, "gradient-x-input", batch_size=2)
+    assert torch.allclose(saliency, torch.abs(inputs_with_grad.grad), atol=1e-6)
+    assert torch.allclose(gradient_x_input, inputs_with_grad.grad * inputs, atol=1e-6)
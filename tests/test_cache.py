@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+import torch
+import dlight.utils.cache as dcache
+
+
+def test_hash_key_of_numpy_values():
+    config = {"type": "t-sne", "n_components": np.int64(2), "perplexity": np.float32(30.0)}
+    assert dcache.hash_key(config) == dcache.hash_key({"type": "t-sne", "n_components": 2, "perplexity": 30.0})
+    assert dcache.hash_key({"init": np.ones(3)}) != dcache.hash_key({"init": np.zeros(3)})
+
+
+def test_hash_key_of_objects():
+    key = dcache.hash_key({"random_state": np.random.RandomState(0)})
+    assert key == dcache.hash_key({"random_state": np.random.RandomState(0)})
+    assert key != dcache.hash_key({"random_state": np.random.RandomState(1)})
+    with pytest.raises(TypeError):
+        dcache.hash_key({"metric": lambda x, y: 0.0})
+
+
+def test_hash_key_of_tensors():
+    values = torch.arange(12.0).view(3, 4)
+    assert dcache.hash_key(values) == dcache.hash_key(values.numpy())
+    assert dcache.hash_key(values) != dcache.hash_key(values.view(4, 3))
@@ -0,0 +1,31 @@
+import torch
+import torch.nn as nn
+import dlight.dissect.capture as dcapture
+
+
+def test_capture_activations_of_model_without_parameters():
+    model = nn.Sequential(nn.MaxPool2d(2), nn.ReLU())
+    inputs = torch.randn(3, 2, 8, 8)
+    activations = dcapture.capture_activations(model, inputs, ["0", "1"])
+    assert torch.equal(activations["1"], torch.relu(nn.functional.max_pool2d(inputs, 2)))
+    assert dcapture.get_device(model) == torch.device("cpu")
+
+
+def test_capture_activations_accumulates_batches():
+    model = nn.Sequential(nn.Conv2d(2, 3, 3), nn.ReLU()).eval()
+    inputs = torch.randn(10, 2, 6, 6)
+    activations = dcapture.capture_activations(model, [inputs[:4], (inputs[4:], None)], ["1"], reductions="max")
+    with torch.no_grad():
+        expected = torch.amax(model(inputs), dim=(2, 3))
+    assert torch.allclose(activations["1"], expected)
+
+
+def test_get_device_of_model_without_parameters():
+    assert dcapture.get_device(nn.Sequential(nn.ReLU(), nn.Flatten())) == torch.device("cpu")
+
+
+def test_get_device_of_model_with_buffers_only():
+    model = nn.Module()
+    model.register_buffer("mean", torch.zeros(3, device="meta"))
+    assert dcapture.get_device(model) == torch.device("meta")
+    assert dcapture.get_device(nn.BatchNorm2d(3, affine=False)) == torch.device("cpu")
@@ -0,0 +1,81 @@
+import pytest
+import torch
+import torch.nn as nn
+import dlight.dissect.contributions as dcontributions
+import dlight.dissect.conv as dconv
+
+
+nodes_and_inputs = {
+    "conv2d": (lambda: nn.Conv2d(6, 4, 3, stride=2, padding=1, dilation=2), (3, 6, 11, 11)),
+    "conv2d-reflect": (lambda: nn.Conv2d(3, 5, 3, padding=2, padding_mode="reflect"), (2, 3, 9, 9)),
+    "grouped": (lambda: nn.Conv2d(6, 9, 3, groups=3), (3, 6, 8, 8)),
+    "depthwise": (lambda: nn.Conv2d(4, 8, 3, groups=4, bias=False), (3, 4, 8, 8)),
+    "conv1d": (lambda: nn.Conv1d(4, 6, 5, padding=2, groups=2), (3, 4, 20)),
+    "conv3d": (lambda: nn.Conv3d(3, 4, 3, padding=1), (2, 3, 5, 6, 6)),
+    "linear": (lambda: nn.Linear(7, 5), (4, 7)),
+    "linear-tokens": (lambda: nn.Linear(7, 5), (4, 3, 7)),
+}
+
+
+@pytest.mark.parametrize("name", list(nodes_and_inputs.keys()))
+def test_contributions_sum_up_to_outputs(name):
+    make_node, input_shape = nodes_and_inputs[name]
+    node = make_node().eval()
+    inputs = torch.randn(input_shape)
+    outer_indices = list(range(node.weight.shape[0]))
+
+    inner_indices, weights, bias, contributions, outputs = \
+        dcontributions.get_contributions(inputs, node, outer_indices)
+
+    with torch.no_grad():
+        expected_outputs = node(inputs)
+    if isinstance(node, nn.Linear):
+        expected_outputs = expected_outputs.movedim(-1, 1)
+    extra_dims = (1,) * (len(outputs.shape) - 2)
+    assert torch.allclose(outputs, expected_outputs, atol=1e-6)
+    assert torch.allclose(torch.sum(contributions, dim=2) + bias.view(1, -1, *extra_dims), outputs, atol=1e-5)
+
+
+@pytest.mark.parametrize("name", [name for name in nodes_and_inputs if not name.startswith("linear")])
+@pytest.mark.parametrize("outer_chunk_size", [1, 2, 3])
+def test_chunked_contributions(name, outer_chunk_size):
+    make_node, input_shape = nodes_and_inputs[name]
+    node = make_node().eval()
+    inputs = torch.randn(input_shape)
+    outer_indices = [3, 0, 2, 1, 3]
+
+    expected = dcontributions.get_contributions(inputs, node, outer_indices, outer_chunk_size=len(outer_indices))
+    chunked = dcontributions.get_contributions(inputs, node, outer_indices, outer_chunk_size=outer_chunk_size)
+    for expected_tensor, chunked_tensor in zip(expected, chunked):
+        assert torch.allclose(chunked_tensor, expected_tensor, atol=1e-6)
+
+
+def test_chunk_size_follows_byte_budget(monkeypatch):
+    node = nn.Conv2d(6, 8, 3, groups=2)
+    inputs = torch.randn(2, 6, 10, 10)
+    # an outer index gathers 3 input channels: 2 * 3 * 10 * 10 float32
+    monkeypatch.setattr(dcontributions, "max_chunk_bytes", 3 * 2400)
+    assert dcontributions.get_outer_chunk_size(inputs, node) == 3
+    monkeypatch.setattr(dcontributions, "max_chunk_bytes", 100)
+    assert dcontributions.get_outer_chunk_size(inputs, node) == 1
+
+    chunked = dconv.get_conv_dissections(inputs, node, list(range(8)))
+    expected = dconv.get_conv_dissections(inputs, node, list(range(8)), outer_chunk_size=8)
+    for chunked_dissection, expected_dissection in zip(chunked, expected):
+        assert chunked_dissection[2] == expected_dissection[2]
+        for chunked_tensor, expected_tensor in zip(chunked_dissection[3:], expected_dissection[3:]):
+            assert torch.allclose(chunked_tensor, expected_tensor, atol=1e-6)
+
+
+def test_grouped_inner_indices():
+    node = nn.Conv2d(6, 9, 3, groups=3)
+    inner_indices, weights, _, contributions, _ = \
+        dcontributions.get_contributions(torch.randn(2, 6, 5, 5), node, [0, 4, 8])
+    assert inner_indices.tolist() == [[0, 1], [2, 3], [4, 5]]
+    assert torch.equal(weights, node.weight.data[[0, 4, 8]])
+    assert contributions.shape == (2, 3, 2, 3, 3)
+
+
+def test_unsupported_node():
+    with pytest.raises(NotImplementedError):
+        dcontributions.get_contributions(torch.randn(2, 3, 5, 5), nn.MaxPool2d(2), [0])
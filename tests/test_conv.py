@@ -0,0 +1,50 @@
+import pytest
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import dlight.dissect.conv as dconv
+
+
+conv_nodes = {
+    "conv2d": lambda: nn.Conv2d(4, 5, 3),
+    "strided-dilated": lambda: nn.Conv2d(6, 4, 3, stride=2, padding=1, dilation=2),
+    "reflect-no-bias": lambda: nn.Conv2d(3, 5, 3, padding=2, padding_mode="reflect", bias=False),
+}
+
+
+def _reference_dissection(input_to_conv, node, outer_idx):
+    """ Contribution of every inner channel to outer_idx, one F.conv2d call per inner channel """
+    if node.padding_mode != "zeros":
+        input_to_conv = F.pad(input_to_conv, node._reversed_padding_repeated_twice, mode=node.padding_mode)
+        padding = 0
+    else:
+        padding = node.padding
+    contributions = [F.conv2d(input_to_conv[:, k:k + 1], node.weight[outer_idx:outer_idx + 1, k:k + 1],
+        stride=node.stride, padding=padding, dilation=node.dilation) for k in range(node.in_channels)]
+    return torch.cat(contributions, dim=1)
+
+
+@pytest.mark.parametrize("name", list(conv_nodes.keys()))
+def test_conv_dissection_matches_per_channel_convs(name):
+    node = conv_nodes[name]().eval()
+    input_to_conv = torch.randn(3, node.in_channels, 9, 9)
+    with torch.no_grad():
+        expected_outputs = node(input_to_conv)
+
+    dissections = dconv.get_conv_dissections(input_to_conv, node, list(range(node.out_channels)))
+    for outer_idx, (group_input, weights, bias, contributions, activation) in enumerate(dissections):
+        with torch.no_grad():
+            expected_contributions = _reference_dissection(input_to_conv, node, outer_idx)
+        assert torch.equal(group_input, input_to_conv)
+        assert torch.equal(weights, node.weight.data[outer_idx:outer_idx + 1])
+        assert bias == (0.0 if node.bias is None else node.bias[outer_idx].item())
+        assert torch.allclose(contributions, expected_contributions, atol=1e-6)
+        assert torch.allclose(activation, expected_outputs[:, outer_idx:outer_idx + 1], atol=1e-6)
+        assert torch.allclose(torch.sum(contributions, dim=1, keepdim=True) + bias, activation, atol=1e-5)
+
+
+def test_cumulative_activations_end_with_activation():
+    node = conv_nodes["conv2d"]().eval()
+    data = dconv.get_conv_dissection_data(torch.randn(2, 4, 7, 7), node, 2)
+    assert data["cumulative_activations"]["shape"] == [2, 5, 5, 5]
+    assert data["activation"]["shape"] == [2, 1, 5, 5]
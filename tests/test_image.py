@@ -0,0 +1,43 @@
+import base64
+import numpy as np
+import pytest
+import torch
+import dlight.utils.assets as dassets
+import dlight.utils.image as dimage
+import dlight.utils.tensor_codec as dcodec
+
+
+@pytest.fixture
+def handlers(monkeypatch):
+    """ Callbacks registered by draw_synthetic_input, by name """
+    import IPython.display as ipd
+    handlers = {}
+    monkeypatch.setattr(dimage, "_register_callback",
+        lambda name, handler, transport: handlers.__setitem__(name, handler))
+    monkeypatch.setattr(dassets, "use", lambda names: None)
+    monkeypatch.setattr(ipd, "display", lambda display_object: None)
+    return handlers
+
+
+def _payload(image):
+    # as sent by get_image_payload in js/draw_image.js
+    return {"shape": list(image.shape), "data": base64.b64encode(image.tobytes()).decode("ascii")}
+
+
+def test_draw_synthetic_input_decodes_payload(handlers):
+    drawn = []
+    dimage.draw_synthetic_input(3, 5, drawn.append, transport="comm")
+    (handler,) = handlers.values()
+
+    image = np.random.RandomState(0).randint(0, 256, (3, 5)).astype(np.uint8)
+    assert handler(_payload(image)) == {"result": "parsed synthetic input"}
+    assert drawn[0].dtype == torch.uint8
+    assert torch.equal(drawn[0], torch.from_numpy(image))
+
+
+def test_draw_synthetic_input_replies_with_tensor(handlers):
+    dimage.draw_synthetic_input(4, 4, lambda image: image.float().mean(dim=0, keepdim=True), transport="comm")
+    (handler,) = handlers.values()
+
+    reply = handler(_payload(np.full((4, 4), 7, dtype=np.uint8)))
+    assert reply["image"] == dcodec.encode_tensor(torch.full((1, 4), 7.0), "uint8")
@@ -0,0 +1,67 @@
+import imageio.v2 as imageio
+import numpy as np
+import pytest
+import torch
+import dlight.dissect.projections as dprojections
+import dlight.utils.cache as dcache
+
+
+@pytest.fixture
+def atlas_cache(tmp_path, monkeypatch):
+    cache = dcache.DiskCache(str(tmp_path / "atlases"), 1024 ** 3)
+    monkeypatch.setattr(dcache, "atlas_cache", cache)
+    monkeypatch.setattr(dcache, "jupyter_dir", str(tmp_path))
+    return cache
+
+
+@pytest.mark.parametrize("num_points,leaf_size", [(1, 4), (16, 4), (103, 8), (50, 1)])
+def test_spatial_index_leaves(num_points, leaf_size):
+    embedding = np.random.RandomState(0).randn(num_points, 3)
+    order, leaves = dprojections.build_spatial_index(embedding, leaf_size)
+
+    assert sorted(order.tolist()) == list(range(num_points))
+    assert [start for start, _ in leaves] == [0] + [end for _, end in leaves[:-1]]
+    assert leaves[-1][1] == num_points
+    sizes = [end - start for start, end in leaves]
+    assert len(leaves) == -(-num_points // leaf_size)
+    assert sum(size != leaf_size for size in sizes) <= 1 and max(sizes) <= leaf_size
+
+
+def test_spatial_index_separates_clusters():
+    # two far apart clusters of 8 points each end up in different leaves
+    embedding = np.concatenate([np.random.RandomState(0).rand(8, 3), 100 + np.random.RandomState(1).rand(8, 3)])
+    order, leaves = dprojections.build_spatial_index(embedding, 8)
+    assert sorted(set(order[start:end] // 8) for start, end in leaves) == [{0}, {1}]
+
+
+def test_lod_atlas(atlas_cache, tmp_path):
+    inputs = torch.rand(11, 4, 6, 6)
+    embedding = np.random.RandomState(0).randn(11, 3).astype("float32")
+    lod = dprojections.write_lod_atlas(inputs, embedding, max_texture_size=12, mip_factor=3)
+
+    rows, cols = lod["shape"]["rows"], lod["shape"]["cols"]
+    assert (rows, cols) == (2, 2) and lod["num_sprites"] == 11
+    assert lod["sprite_size"] == {"height": 6, "width": 6}
+    assert lod["page_size"] == {"height": 12, "width": 12} and lod["mip_page_size"] == {"height": 4, "width": 4}
+    assert [leaf["num_sprites"] for leaf in lod["leaves"]] == [4, 4, 3]
+
+    pages = []
+    for leaf in lod["leaves"]:
+        positions = np.fromfile(str(tmp_path / leaf["positions"]), dtype="<f4").reshape(-1, 3)
+        assert len(positions) == leaf["num_sprites"]
+        assert np.allclose(positions.min(axis=0), leaf["bbox"][0]) and np.allclose(positions.max(axis=0), leaf["bbox"][1])
+        # sprites are found back in the pages from their positions
+        idx = [int(np.where((embedding == position).all(axis=1))[0][0]) for position in positions]
+        page = imageio.imread(str(tmp_path / leaf["page"]))
+        assert page.shape == (12, 12, 4)
+        assert imageio.imread(str(tmp_path / leaf["mip_page"])).shape == (4, 4, 4)
+        for sprite_idx, input_idx in enumerate(idx):
+            row, col = divmod(sprite_idx, cols)
+            sprite = page[row * 6:(row + 1) * 6, col * 6:(col + 1) * 6]
+            expected = (inputs[input_idx].permute(1, 2, 0) * 255).round().numpy()
+            assert np.abs(sprite.astype("float32") - expected).max() <= 1
+        pages.append(idx)
+    assert sorted(sum(pages, [])) == list(range(11))
+
+    # same inputs: cached files are reused
+    assert dprojections.write_lod_atlas(inputs, embedding, max_texture_size=12, mip_factor=3) == lod
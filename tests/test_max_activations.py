@@ -0,0 +1,61 @@
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, TensorDataset
+import dlight.dissect.activations as dactivations
+import dlight.dissect.store as dstore
+
+
+def _reduced(activations, reduce_func):
+    return torch.amax(activations, dim=(2, 3)) if reduce_func == "max" else torch.mean(activations, dim=(2, 3))
+
+
+def test_table_matches_topk():
+    activations = torch.randn(50, 6, 4, 4)
+    for reduce_func in ("mean", "max"):
+        indices, values = dactivations.get_maximimum_activations_table(activations, 5, reduce_func)
+        expected_values, expected_indices = torch.topk(_reduced(activations, reduce_func).t(), 5, dim=1)
+        assert torch.equal(indices, expected_indices)
+        assert torch.allclose(values, expected_values)
+
+
+def test_table_cache():
+    activations = torch.randn(30, 4)
+    indices, values = dactivations.get_maximimum_activations_table(activations, 8)
+    cached_indices, _ = dactivations.get_maximimum_activations_table(activations, 3)
+    assert torch.equal(cached_indices, indices[:, :3])
+
+    # in-place changes invalidate the cached table
+    activations[0] = 100.0
+    indices, _ = dactivations.get_maximimum_activations_table(activations, 3)
+    assert indices[:, 0].tolist() == [0, 0, 0, 0]
+
+
+def test_table_cache_of_stored_activations(tmp_path, monkeypatch):
+    activations = torch.randn(20, 3, 2, 2)
+    store = dstore.ActivationStore(str(tmp_path), shard_size=8)
+    store.append("conv", activations)
+    indices, values = dactivations.get_maximimum_activations_table(store["conv"], 4)
+    assert torch.equal(indices, torch.topk(_reduced(activations, "mean").t(), 4, dim=1)[1])
+
+    # a new StoredActivations of the same layer hits the cache, without reading the shards
+    monkeypatch.setattr(dstore.StoredActivations, "iter_chunks", None)
+    cached_indices, _ = dactivations.get_maximimum_activations_table(store["conv"], 4)
+    assert torch.equal(cached_indices, indices)
+    monkeypatch.undo()
+
+    # appending samples invalidates it
+    store.append("conv", torch.full((1, 3, 2, 2), 100.0))
+    indices, _ = dactivations.get_maximimum_activations_table(store["conv"], 4)
+    assert indices[:, 0].tolist() == [20, 20, 20]
+
+
+def test_streaming_matches_table():
+    model = nn.Sequential(nn.Conv2d(1, 5, 3), nn.ReLU()).eval()
+    inputs = torch.randn(70, 1, 8, 8)
+    indices, values = dactivations.get_maximimum_activations_streaming(model, "1",
+        DataLoader(TensorDataset(inputs), batch_size=16), 6, {"reduce_func": "max"})
+
+    with torch.no_grad():
+        expected_values, expected_indices = torch.topk(_reduced(model(inputs), "max").t(), 6, dim=1)
+    assert torch.equal(indices, expected_indices)
+    assert torch.allclose(values, expected_values)
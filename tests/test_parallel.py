@@ -0,0 +1,53 @@
+import pytest
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, TensorDataset
+import dlight.dissect.activations as dactivations
+import dlight.dissect.conv as dconv
+import dlight.dissect.parallel as dparallel
+import dlight.dissect.parameterizations as dparam
+
+
+def test_merge_topk_breaks_ties_by_index():
+    indices = torch.tensor([[7, 2, 5, 1]])
+    values = torch.tensor([[1.0, 3.0, 3.0, 1.0]])
+    merged_indices, merged_values = dparallel.merge_topk(indices, values, 3)
+    assert merged_indices.tolist() == [[2, 5, 1]]
+    assert merged_values.tolist() == [[3.0, 3.0, 1.0]]
+
+
+@pytest.mark.parametrize("num_workers", [1, 3])
+def test_parallel_maximum_activations(num_workers):
+    model = nn.Sequential(nn.Conv2d(1, 4, 3), nn.ReLU()).eval()
+    dataset = TensorDataset(torch.randn(50, 1, 7, 7))
+    indices, values = dparallel.parallel_maximum_activations(model, "1", dataset, 5,
+        num_workers=num_workers, batch_size=8)
+    expected_indices, expected_values = dactivations.get_maximimum_activations_streaming(model, "1",
+        DataLoader(dataset, batch_size=50), 5)
+    assert torch.equal(indices, expected_indices)
+    assert torch.allclose(values, expected_values)
+
+
+def test_parallel_superstimuli_do_not_depend_on_num_workers():
+    model = nn.Sequential(nn.Conv2d(3, 6, 3), nn.ReLU(), nn.Conv2d(6, 5, 3)).eval()
+    initial_input = torch.rand(1, 3, 12, 12)
+    kwargs = {"num_iterations": 8, "patience": 2, "transforms": dparam.jitter(1)}
+    superstimuli = [dparallel.parallel_image_superstimuli(model, "2", [4, 0, 3, 1, 2], initial_input,
+        num_workers=num_workers, seed=5, **kwargs) for num_workers in (1, 2, 3)]
+    assert superstimuli[0].shape == (5, 3, 12, 12)
+    assert torch.equal(superstimuli[0], superstimuli[1])
+    assert torch.equal(superstimuli[0], superstimuli[2])
+
+
+@pytest.mark.parametrize("outer_chunk_size", [None, 1])
+def test_parallel_conv_dissections_match_serial(outer_chunk_size):
+    node = nn.Conv2d(6, 8, 3, groups=2).eval()
+    input_to_conv = torch.randn(3, 6, 7, 7)
+    serial = dconv.get_conv_dissections(input_to_conv, node, list(range(8)))
+    parallel = dparallel.parallel_conv_dissections(input_to_conv, node, outer_chunk_size=outer_chunk_size, num_workers=3)
+    for expected, dissection in zip(serial, parallel):
+        assert torch.equal(expected[0], dissection[0])
+        assert torch.allclose(expected[3], dissection[3]) and torch.allclose(expected[4], dissection[4])
+        assert expected[2] == dissection[2]
+    # outer indices of a group share their input
+    assert parallel[0][0] is parallel[3][0] and parallel[4][0] is not parallel[0][0]
@@ -0,0 +1,73 @@
+import random
+import pytest
+import torch
+import dlight.dissect.activations as dactivations
+import dlight.dissect.parameterizations as dparam
+import dlight.utils.image as dimage
+
+
+@pytest.mark.parametrize("parameterization", list(dparam.parameterizations.keys()))
+@pytest.mark.parametrize("image_size", [(16, 16), (15, 10)])
+def test_parameterization_starts_at_initial_input(parameterization, image_size):
+    initial_input = torch.rand((2, 3) + image_size)
+    image = dparam.get_parameterization(parameterization, initial_input)
+    assert image.tensor.requires_grad and image.tensor.is_leaf
+    assert torch.allclose(image(), initial_input, atol=1e-5)
+
+
+def test_fourier_detail_keeps_low_frequencies():
+    initial_input = torch.ones(1, 1, 16, 16) * 0.5
+    initial_input[..., ::2] += 0.25 # highest horizontal frequency
+    image = dparam.FourierImage(initial_input)
+    image.set_detail(0.1)
+    assert torch.allclose(image(), torch.full_like(initial_input, 0.625), atol=1e-5)
+
+
+def test_pixel_detail_is_coarse():
+    initial_input = torch.rand(1, 1, 8, 8)
+    image = dparam.PixelImage(initial_input)
+    image.set_detail(0.25)
+    coarse = image()
+    assert coarse.shape == (1, 1, 8, 8)
+    assert torch.allclose(torch.mean(coarse), torch.mean(initial_input), atol=0.05)
+    assert dimage.total_variation_loss(coarse) < 0.5 * dimage.total_variation_loss(initial_input)
+
+
+def test_get_detail():
+    details = [dparam.get_detail([0.25, 0.5, 1.0], iteration, 9) for iteration in range(9)]
+    assert details == [0.25] * 3 + [0.5] * 3 + [1.0] * 3
+
+
+def test_unknown_parameterization():
+    with pytest.raises(ValueError):
+        dparam.get_parameterization("wavelet", torch.rand(1, 3, 4, 4))
+
+
+def test_transforms_keep_shape_and_are_seeded():
+    image = torch.rand(2, 3, 28, 28)
+    transforms = dparam.standard_transforms(28)
+    random.seed(3)
+    first = transforms(image)
+    random.seed(3)
+    assert first.shape == image.shape
+    assert torch.equal(first, transforms(image))
+
+
+def test_jitter_is_a_roll():
+    image = torch.arange(16.0).view(1, 1, 4, 4)
+    random.seed(0)
+    jittered = dparam.jitter(1)(image)
+    assert sorted(jittered.flatten().tolist()) == image.flatten().tolist()
+
+
+@pytest.mark.parametrize("parameterization", ["fourier", "fourier_decorrelated"])
+def test_superstimuli_with_parameterization(parameterization):
+    model = torch.nn.Conv2d(3, 2, 3).eval()
+    initial_input = torch.rand(1, 3, 12, 12)
+    superstimuli = dactivations.get_image_superstimuli_batched(model, [0, 1], initial_input,
+        num_iterations=20, parameterization=parameterization, resolution_schedule=[0.5, 1.0],
+        transforms=dparam.jitter(1))
+    with torch.no_grad():
+        before = torch.mean(model(initial_input)[0], dim=(1, 2))
+        after = torch.mean(model(superstimuli), dim=(2, 3)).diagonal()
+    assert torch.all(after > before)
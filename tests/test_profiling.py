@@ -0,0 +1,51 @@
+import json
+import torch
+import dlight.utils.profiling as dprofiling
+
+
+@dprofiling.profile
+def _stage(size):
+    with dprofiling.span("inner", size=size) as s:
+        s.add_bytes(10)
+    return torch.zeros(size)
+
+
+def test_nothing_is_recorded_when_disabled():
+    dprofiling.reset()
+    _stage(4)
+    assert dprofiling.events() == []
+
+
+def test_spans_are_nested_and_counted():
+    with dprofiling.profiling():
+        _stage(4)
+        _stage(8)
+    events = dprofiling.events()
+    assert [event["name"] for event in events] == ["inner", "test_profiling._stage"] * 2
+    inner, outer = events[0], events[1]
+    assert inner["depth"] == outer["depth"] + 1
+    assert inner["start_ns"] >= outer["start_ns"] and inner["duration_ns"] <= outer["duration_ns"]
+    assert outer["self_ns"] == outer["duration_ns"] - inner["duration_ns"]
+    assert inner["bytes"] == 10 and outer["tensor_bytes"] == 4 * 4
+
+    summary = dprofiling.summary()
+    assert summary["inner"]["count"] == 2 and summary["inner"]["bytes"] == 20
+    assert summary["test_profiling._stage"]["tensor_bytes"] == 12 * 4
+    assert "test_profiling._stage" in dprofiling.report()
+    assert not dprofiling.enabled
+
+
+def test_export_chrome_trace(tmp_path):
+    with dprofiling.profiling():
+        _stage(2)
+    path = str(tmp_path / "trace.json")
+    dprofiling.export_chrome_trace(path)
+    with open(path) as f:
+        trace = json.load(f)
+
+    trace_events = trace["traceEvents"]
+    assert [event["name"] for event in trace_events] == ["inner", "test_profiling._stage"]
+    for event, recorded in zip(trace_events, dprofiling.events()):
+        assert event["ph"] == "X"
+        assert event["ts"] == recorded["start_ns"] / 1e3 and event["dur"] == recorded["duration_ns"] / 1e3
+    assert trace_events[0]["args"] == {"size": 2, "bytes": 10, "tensor_bytes": 0}
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+import torch
+import dlight.dissect.projections as dprojections
+import dlight.utils.cache as dcache
+import dlight.utils.profiling as dprofiling
+
+
+@pytest.fixture
+def embedding_cache(tmp_path, monkeypatch):
+    cache = dcache.DiskCache(str(tmp_path), 1024 ** 2)
+    monkeypatch.setattr(dcache, "embedding_cache", cache)
+    return cache
+
+
+def test_pipe_matches_sklearn(embedding_cache):
+    from sklearn.decomposition import PCA
+    activations = torch.randn(60, 10)
+    pipe = [{"type": "pca", "n_components": 5}, {"type": "pca", "n_components": 2, "whiten": True}]
+    embedding = dprojections.run_projections_pipe(activations, pipe)
+
+    expected = PCA(n_components=2, whiten=True).fit_transform(PCA(n_components=5).fit_transform(activations.numpy()))
+    assert np.allclose(embedding, expected, atol=1e-5)
+
+
+def test_torch_pca_matches_pca():
+    # distinct singular values, so that components are unique up to sign
+    activations = torch.randn(200, 3) @ torch.diag(torch.tensor([5.0, 2.0, 0.5])) @ torch.linalg.qr(torch.randn(3, 3))[0]
+    embedding = dprojections.run_projections_pipe(activations, [{"type": "torch-pca", "n_components": 2}])
+    expected = dprojections.run_projections_pipe(activations, [{"type": "pca", "n_components": 2}])
+    assert np.allclose(np.abs(embedding), np.abs(expected), atol=1e-3)
+
+
+def test_stage_spans_record_cache_hits(embedding_cache):
+    activations = torch.randn(40, 6)
+    pipe = [{"type": "pca", "n_components": 4}, {"type": "pca", "n_components": 2}]
+    with dprofiling.profiling():
+        first = dprojections.run_projections_pipe(activations, pipe, use_cache=True)
+        # only the last stage changed
+        second = dprojections.run_projections_pipe(activations, pipe[:1] + [{"type": "pca", "n_components": 3}],
+            use_cache=True)
+        third = dprojections.run_projections_pipe(activations, pipe, use_cache=True)
+
+    spans = [(event["name"], event["args"]["cached"]) for event in dprofiling.events()
+        if event["name"].startswith("projection ")]
+    assert [cached for _, cached in spans] == [False, False, True, False, True, True]
+    assert np.array_equal(first, third)
+    assert second.shape == (40, 3)
+
+
+def test_pipe_errors():
+    with pytest.raises(ValueError):
+        dprojections.run_projections_pipe(torch.randn(10, 3), [{"type": "pca", "n_components": 4}])
+    with pytest.raises(NotImplementedError):
+        dprojections.run_projections_pipe(torch.randn(10, 3), [{"type": "isomap", "n_components": 2}])
@@ -0,0 +1,40 @@
+import json
+import os.path as osp
+import torch
+import torch.nn as nn
+import dlight.report as dreport
+
+
+class _Model(nn.Module):
+
+    def __init__(self):
+        super(_Model, self).__init__()
+        self.conv1 = nn.Conv2d(1, 3, 3)
+        self.conv2 = nn.Conv2d(3, 4, 3)
+        self.fc = nn.Linear(4 * 4 * 4, 5)
+
+    def forward(self, x):
+        x = torch.relu(self.conv2(torch.relu(self.conv1(x))))
+        return self.fc(torch.flatten(x, 1))
+
+
+def test_write_model_report(tmp_path, monkeypatch):
+    model = _Model().eval()
+    devices = {name: parameter.device for name, parameter in model.named_parameters()}
+    # Modules must never be moved (e.g. by node.cpu()), the model may be on a GPU
+    def _apply(module, *args, **kwargs):
+        raise AssertionError("module " + module.__class__.__name__ + " was moved")
+    monkeypatch.setattr(nn.Module, "_apply", _apply)
+
+    index_path = dreport.write_model_report(model, torch.rand(6, 1, 8, 8), ["conv1", "conv2", "fc"],
+        str(tmp_path), nlargest=2, dissections=[("conv2", 1)])
+
+    assert {name: parameter.device for name, parameter in model.named_parameters()} == devices
+    assert osp.exists(index_path)
+    with open(osp.join(str(tmp_path), "index.json")) as f:
+        sections = json.load(f)["sections"]
+    kinds = [section["kind"] for section in sections]
+    assert kinds.count("weights") == 2 and kinds.count("conv dissection") == 1
+    for section in sections:
+        for path in section["files"]:
+            assert osp.exists(osp.join(str(tmp_path), path))
@@ -0,0 +1,78 @@
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, TensorDataset
+import dlight.dissect.capture as dcapture
+import dlight.dissect.statistics as dstatistics
+
+
+def _channel_values(activations):
+    """ All values of each channel, shape [C, n] """
+    return activations.transpose(0, 1).reshape(activations.shape[1], -1)
+
+
+def test_moments_match_torch():
+    activations = torch.randn(40, 3, 5, 5) * torch.tensor([1.0, 10.0, 0.1])[None, :, None, None] + 3.0
+    statistics = dstatistics.ChannelStatistics()
+    for batch in activations.split(7):
+        statistics.update(batch)
+
+    values = _channel_values(activations)
+    assert statistics.count == values.shape[1]
+    assert torch.allclose(statistics.mean, torch.mean(values, dim=1), rtol=1e-5)
+    assert torch.allclose(statistics.variance, torch.var(values, dim=1, unbiased=False), rtol=1e-4)
+    assert torch.equal(statistics.min.float(), torch.min(values, dim=1)[0])
+    assert torch.equal(statistics.max.float(), torch.max(values, dim=1)[0])
+    assert torch.allclose(statistics.sparsity, torch.mean((values <= 0).float(), dim=1))
+
+
+def test_merged_shards_match_torch():
+    activations = torch.randn(300, 4)
+    shards = [dstatistics.ChannelStatistics() for _ in range(3)]
+    for shard, batch in zip(shards, activations.split(100)):
+        shard.update(batch)
+    statistics = shards[0].merge(shards[1]).merge(shards[2])
+
+    assert torch.allclose(statistics.mean, torch.mean(activations, dim=0), atol=1e-6)
+    assert torch.allclose(statistics.variance, torch.var(activations, dim=0, unbiased=False), rtol=1e-4)
+
+
+def test_quantiles_match_torch():
+    # 20000 values per channel are compacted several times by a sketch of size 256
+    activations = torch.randn(200, 2, 10, 10)
+    statistics = dstatistics.ChannelStatistics(sketch_size=256)
+    for batch in activations.split(16):
+        statistics.update(batch)
+
+    qs = (0.1, 0.25, 0.5, 0.75, 0.9)
+    values = _channel_values(activations)
+    expected = torch.quantile(values, torch.tensor(qs), dim=1).t()
+    assert torch.allclose(statistics.quantiles(qs), expected, atol=0.05)
+    # rank error of the sketch is roughly 1 / sketch_size
+    ranks = torch.mean((values[:, :, None] <= statistics.quantiles(qs)[:, None, :]).float(), dim=1)
+    assert torch.allclose(ranks, torch.tensor(qs).expand_as(ranks), atol=0.02)
+
+
+def test_collect_statistics_dead_channels():
+    model = nn.Sequential(nn.Conv2d(1, 4, 3), nn.ReLU()).eval()
+    with torch.no_grad():
+        model[0].bias[2] = -100.0
+    inputs = torch.rand(64, 1, 8, 8)
+    statistics = dstatistics.collect_statistics(model, DataLoader(TensorDataset(inputs), batch_size=10), ["1"])["1"]
+
+    values = _channel_values(dcapture.capture_activations(model, inputs, ["1"])["1"])
+    assert statistics.dead_channels() == [2]
+    assert torch.allclose(statistics.mean, torch.mean(values, dim=1), atol=1e-6)
+    assert torch.allclose(statistics.variance, torch.var(values, dim=1, unbiased=False), atol=1e-6)
+
+
+def test_sketch_of_large_batches_stays_small():
+    sketch = dstatistics.QuantileSketch(3, k=64)
+    values = torch.randn(3, 100000)
+    for batch in values.split(25000, dim=1):
+        sketch.update(batch)
+
+    assert all(level.shape[1] < 2 * 64 for level in sketch.levels)
+    # levels are weighted by 2**level and account for all values
+    assert sum(level.shape[1] * 2 ** l for l, level in enumerate(sketch.levels)) == 100000
+    ranks = torch.mean((values[:, :, None] <= sketch.quantiles([0.1, 0.5, 0.9])[:, None, :]).float(), dim=1)
+    assert torch.allclose(ranks, torch.tensor([0.1, 0.5, 0.9]).expand_as(ranks), atol=0.05)
@@ -0,0 +1,83 @@
+import pytest
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, TensorDataset
+import dlight.dissect.projections as dprojections
+import dlight.dissect.store as dstore
+import dlight.utils.cache as dcache
+
+
+@pytest.fixture
+def activations():
+    return torch.randn(23, 3, 4, 4)
+
+
+@pytest.fixture
+def stored(tmp_path, activations):
+    store = dstore.ActivationStore(str(tmp_path), shard_size=5)
+    # batches that don't line up with the shards
+    for batch in activations.split(7):
+        store.append("conv", batch)
+    return store["conv"]
+
+
+@pytest.mark.parametrize("index", [
+    3, -1, slice(None), slice(4, 13), slice(2, 20, 3), slice(30, 40),
+    [0, 22, 5, 6], torch.tensor([9, 8, 7]), (slice(3, 12), 1), (slice(None), slice(0, 2), 3),
+])
+def test_indexing_matches_tensor(stored, activations, index):
+    assert torch.equal(stored[index], activations[index])
+
+
+def test_out_of_range(stored):
+    with pytest.raises(IndexError):
+        stored[23]
+
+
+def test_reopen_and_append(tmp_path, activations, stored):
+    reopened = dstore.ActivationStore(str(tmp_path))
+    assert reopened.layers == ["conv"] and len(reopened["conv"]) == 23
+    reopened.append("conv", activations[:2])
+    assert torch.equal(reopened["conv"][:], torch.cat([activations, activations[:2]]))
+    with pytest.raises(ValueError):
+        reopened.append("conv", torch.randn(2, 3, 5, 5))
+    with pytest.raises(KeyError):
+        reopened["fc"]
+
+
+def test_iter_chunks(stored, activations):
+    chunks = list(stored.iter_chunks(6))
+    assert [start for start, _ in chunks] == [0, 6, 12, 18]
+    assert torch.equal(torch.cat([chunk for _, chunk in chunks]), activations)
+
+
+def test_write_activations(tmp_path):
+    model = nn.Sequential(nn.Conv2d(1, 2, 3), nn.ReLU(), nn.Flatten(), nn.Linear(2 * 4 * 4, 3)).eval()
+    inputs = torch.randn(10, 1, 6, 6)
+    store = dstore.ActivationStore(str(tmp_path), shard_size=4)
+    dstore.write_activations(store, model, DataLoader(TensorDataset(inputs), batch_size=3), ["1", "3"])
+    with torch.no_grad():
+        assert torch.allclose(store["3"][:], model(inputs))
+        assert torch.allclose(store["1"][:], model[1](model[0](inputs)))
+
+
+def test_as_tensor_limit(stored, activations, monkeypatch):
+    assert torch.equal(dstore.as_tensor(stored), activations)
+    monkeypatch.setattr(dstore, "max_in_memory_bytes", stored.nbytes - 1)
+    with pytest.raises(ValueError):
+        dstore.as_tensor(stored)
+    assert torch.equal(dstore.as_tensor(stored[:5]), activations[:5])
+
+
+def test_hash_key_matches_tensor(stored, activations):
+    assert dcache.hash_key(stored, 1) == dcache.hash_key(activations, 1)
+
+
+def test_iter_atlas_pages_of_stored_inputs(tmp_path):
+    inputs = torch.rand(23, 4, 5, 5)
+    store = dstore.ActivationStore(str(tmp_path), shard_size=6)
+    store.append("inputs", inputs)
+    pages, _, _ = dprojections.build_atlas_pages(inputs, 15)
+    stored_pages = list(dprojections.iter_atlas_pages(store["inputs"], 15))
+    assert len(stored_pages) == len(pages)
+    assert all(torch.equal(page, stored_page) for page, stored_page in zip(pages, stored_pages))
@@ -0,0 +1,38 @@
+import pytest
+import torch
+import torch.nn as nn
+import dlight.dissect.activations as dactivations
+
+
+def _model():
+    return nn.Sequential(nn.Conv2d(3, 6, 3), nn.ReLU(), nn.Conv2d(6, 4, 3)).eval()
+
+
+def _channel_objective(model, channel):
+    return lambda x: torch.mean(model(x)[0, channel])
+
+
+@pytest.mark.parametrize("batch_size", [None, 3])
+def test_batched_matches_sequential(batch_size):
+    model = _model()
+    initial_input = torch.rand(1, 3, 12, 12)
+    channel_indices = [0, 3, 1, 2]
+
+    batched = dactivations.get_image_superstimuli_batched(model, channel_indices, initial_input,
+        num_iterations=15, batch_size=batch_size)
+    sequential = dactivations.get_image_superstimuli(
+        [_channel_objective(model, channel) for channel in channel_indices], initial_input, num_iterations=15)
+
+    assert batched.shape == (4, 3, 12, 12)
+    assert torch.allclose(batched, torch.cat(sequential, dim=0), atol=1e-5)
+
+
+def test_superstimuli_increase_activation():
+    model = _model()
+    initial_input = torch.rand(1, 3, 12, 12)
+    superstimuli = dactivations.get_image_superstimuli_batched(model, [0, 1, 2, 3], initial_input,
+        num_iterations=30, reduce_func="max")
+    with torch.no_grad():
+        before = torch.amax(model(initial_input)[0], dim=(1, 2))
+        after = torch.amax(model(superstimuli), dim=(2, 3)).diagonal()
+    assert torch.all(after > before)
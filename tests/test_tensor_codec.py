@@ -0,0 +1,50 @@
+import base64
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+import dlight.dissect.conv as dconv
+from dlight.utils.tensor_codec import encode_tensor
+
+
+def _decode(encoded):
+    """ Same as decodeTensor of js/tensor_codec.js """
+    data = base64.b64decode(encoded["data"])
+    dtype = {"float32": "<f4", "float16": "<f2", "uint8": "u1"}[encoded["encoding"]]
+    array = np.frombuffer(data, dtype=dtype).astype(np.float32)
+    if encoded["encoding"] == "uint8":
+        array = encoded["offset"] + encoded["scale"] * array
+    return torch.from_numpy(array.reshape(encoded["shape"]))
+
+
+def test_float32_round_trip_is_exact():
+    tensor = torch.randn(2, 3, 4, 5) * 1e6
+    assert torch.equal(_decode(encode_tensor(tensor, "float32")), tensor)
+
+
+@pytest.mark.filterwarnings("ignore:overflow encountered")
+def test_float16_round_trip():
+    tensor = torch.randn(3, 7)
+    assert torch.allclose(_decode(encode_tensor(tensor, "float16")), tensor, rtol=1e-3, atol=1e-4)
+    assert torch.isinf(_decode(encode_tensor(torch.tensor([70000.0]), "float16"))).all()
+
+
+def test_uint8_round_trip():
+    tensor = torch.rand(4, 9) * 10.0 - 3.0
+    decoded = _decode(encode_tensor(tensor, "uint8"))
+    assert torch.max(torch.abs(decoded - tensor)) <= (10.0 / 255.0) / 2 + 1e-5
+    assert torch.equal(_decode(encode_tensor(torch.full((3,), 2.5), "uint8")), torch.full((3,), 2.5))
+
+
+def test_unknown_encoding():
+    with pytest.raises(ValueError):
+        encode_tensor(torch.zeros(2), "int4")
+
+
+def test_cumulative_activations():
+    node = nn.Conv2d(3, 2, 3).eval()
+    data = dconv.get_conv_dissection_data(torch.randn(2, 3, 6, 6), node, 1)
+    intermediate_activations = _decode(data["intermediate_activations"])
+    cumulative_activations = _decode(data["cumulative_activations"])
+    assert torch.allclose(cumulative_activations[:, :3], torch.cumsum(intermediate_activations, dim=1), atol=1e-6)
+    assert torch.allclose(cumulative_activations[:, 3:], _decode(data["activation"]), atol=1e-5)